@@ -6,7 +6,31 @@ editions made with LaTeX and reledmac.
 """
 import os
 
-__all__ = ["brackets", "cli", "core", "document", "matcher", "settings", "tokenize"]
+__all__ = [
+    "bench",
+    "brackets",
+    "cache",
+    "cli",
+    "core",
+    "distributed",
+    "document",
+    "instrumentation",
+    "lsp",
+    "matcher",
+    "metrics",
+    "parallel",
+    "pipeline",
+    "profiling",
+    "progress",
+    "server",
+    "service",
+    "settings",
+    "stats",
+    "synth",
+    "tokenize",
+    "trace",
+    "watch",
+]
 __root__ = os.path.dirname(os.path.realpath(__file__))
 __version__ = "0.5.6"
 
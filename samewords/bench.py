@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of annotating, updating and cleaning documents.
+
+Each method is timed on the bundled test documents and on generated
+documents of increasing size (see `samewords.synth`) under each combination
+of the `context_distance`, `sensitive_context_match` and `multiword`
+settings. The median and percentiles of the time of the repeated runs, the
+peak memory of an extra run traced with tracemalloc and the throughput in
+words and registry entries per second are reported as JSON, so the results
+of releases and settings can be compared.
+
+Documents are updated and cleaned after they have been annotated, which is
+not timed. Run `python -m samewords.bench --help` for the options.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import warnings
+
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+from samewords import __root__, __version__
+from samewords.core import process_string
+from samewords.document import doc_content
+from samewords.profiling import tracing
+from samewords.settings import settings
+from samewords.stats import Statistics
+from samewords.synth import generate
+
+METHODS = ["annotate", "update", "clean"]
+ASSETS = ["da-49-l1q1.tex", "simple.tex"]
+PERCENTILES = [10, 50, 90, 99]
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Return the `q`th percentile of the values, interpolated linearly
+    between the closest ranks."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+@contextmanager
+def configured(**overrides) -> Iterator[None]:
+    """Replace the settings while the context lasts."""
+    saved = {key: settings[key] for key in overrides}
+    settings.update(overrides)
+    try:
+        yield
+    finally:
+        settings.update(saved)
+
+
+def inputs(
+    sizes: List[int], words: int = 100, seed: int = 0, assets: bool = True
+) -> List[Tuple[str, str]]:
+    """Return the name and content of the documents to benchmark: the bundled
+    test documents and a generated document of each size in paragraphs."""
+    documents = []
+    if assets:
+        for name in ASSETS:
+            filename = os.path.join(__root__, "test/assets", name)
+            documents.append((name, doc_content(filename)))
+    for size in sizes:
+        content = generate(paragraphs=size, words=words, seed=seed)
+        documents.append(("synth-{}x{}".format(size, words), content))
+    return documents
+
+
+def settings_grid(
+    distances: List[int], sensitive: List[bool], multiword: List[bool]
+) -> List[Dict]:
+    """Return each combination of the settings to benchmark."""
+    return [
+        {
+            "context_distance": distance,
+            "sensitive_context_match": case,
+            "multiword": multi,
+        }
+        for distance, case, multi in itertools.product(distances, sensitive, multiword)
+    ]
+
+
+def bench_case(content: str, method: str = "annotate", repeat: int = 5) -> Dict:
+    """Time the processing of the content with the method and the current
+    settings `repeat` times. Return the timings, the peak memory and the
+    throughput."""
+    if method != "annotate":
+        content = process_string(content, "annotate")
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        process_string(content, method)
+        times.append(time.perf_counter() - start)
+    # The tracing slows the processing down, so the memory gets its own run.
+    stats = Statistics()
+    with tracing():
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        process_string(content, method, stats)
+        _, peak = tracemalloc.get_traced_memory()
+    median = percentile(times, 50)
+    return {
+        "seconds": dict(
+            {"p{}".format(q): percentile(times, q) for q in PERCENTILES},
+            min=min(times),
+            max=max(times),
+        ),
+        "peak_memory": peak,
+        "paragraphs": stats["paragraphs"],
+        "words": stats["words"],
+        "entries": stats["entries"],
+        "words_per_second": stats["words"] / median if median else 0.0,
+        "entries_per_second": stats["entries"] / median if median else 0.0,
+    }
+
+
+def run(
+    documents: List[Tuple[str, str]],
+    methods: List[str] = None,
+    grid: List[Dict] = None,
+    repeat: int = 5,
+    log=None,
+) -> Dict:
+    """Benchmark each method on each document under each settings of the
+    grid (default: the current settings). Each case is reported to `log`, if
+    given, before it runs. The cases that fail have an `error` instead of
+    the measurements."""
+    methods = METHODS if methods is None else methods
+    grid = [{}] if grid is None else grid
+    results = []
+    with warnings.catch_warnings():
+        # The warnings about unmatched lemmas are not what is measured.
+        warnings.simplefilter("ignore")
+        for (name, content), method, overrides in itertools.product(
+            documents, methods, grid
+        ):
+            if log is not None:
+                log("{} {} {}".format(name, method, json.dumps(overrides)))
+            try:
+                with configured(**overrides):
+                    result = bench_case(content, method, repeat)
+            except Exception as e:
+                # A failing case is reported instead of ending the run.
+                result = {"error": "{}: {}".format(type(e).__name__, e)}
+            results.append(
+                dict(
+                    input=name,
+                    characters=len(content),
+                    method=method,
+                    settings=overrides,
+                    **result
+                )
+            )
+    return {
+        "version": __version__,
+        "python": platform.python_version(),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def _boolean(value: str) -> bool:
+    if value.lower() not in ["true", "false"]:
+        raise argparse.ArgumentTypeError("Expected true or false.")
+    return value.lower() == "true"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m samewords.bench",
+        description="Benchmark the processing methods and settings.",
+    )
+    parser.add_argument(
+        "--methods", nargs="+", choices=METHODS, default=METHODS, metavar="METHOD"
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=[20, 40, 80],
+        help="Paragraphs of the generated documents. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--words",
+        type=int,
+        default=100,
+        help="Words per generated paragraph. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-assets", action="store_true", help="Skip the bundled documents."
+    )
+    parser.add_argument("--context-distance", nargs="+", type=int, default=[10, 20, 40])
+    parser.add_argument(
+        "--sensitive-context-match", nargs="+", type=_boolean, default=[True, False]
+    )
+    parser.add_argument("--multiword", nargs="+", type=_boolean, default=[False, True])
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Timed runs of each case. (default: %(default)s)",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="File to write the JSON report to.")
+    args = parser.parse_args()
+
+    documents = inputs(args.sizes, args.words, args.seed, not args.no_assets)
+    grid = settings_grid(
+        args.context_distance, args.sensitive_context_match, args.multiword
+    )
+    report = run(
+        documents,
+        args.methods,
+        grid,
+        args.repeat,
+        log=lambda line: print(line, file=sys.stderr),
+    )
+    if args.output:
+        with open(args.output, mode="w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
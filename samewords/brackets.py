@@ -1,3 +1,6 @@
+from samewords import instrumentation
+
+
 class Brackets:
     """
     Given a start position with a bracket, analyze the length and make the
@@ -28,6 +31,9 @@ class Brackets:
                 elif c == "}":
                     opened -= 1
                 pos += 1
+            if instrumentation.enabled:
+                instrumentation.count("bracket_scans")
+                instrumentation.count("bracket_chars", pos - self.start)
             return pos
         else:
             raise ValueError(
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of processed paragraphs.
+
+The result of processing a paragraph only depends on its text, the
+processing method, the settings and the code of samewords. The cache
+stores the results in an SQLite database keyed by a hash of those, so a
+re-run of a document only has to process the paragraphs that have changed.
+
+Several processes may use the same cache at once. The database is written
+in small batches, each in a short transaction, so no process holds the lock
+of the database for long.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from samewords import __version__
+from samewords.settings import settings
+
+# The cache of the user, e.g. ~/.cache/samewords.
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "samewords",
+)
+# The number of new entries and uses that are written to the database at once.
+BATCH_SIZE = 32
+
+
+# The modules whose code determines the result of processing a paragraph.
+CODE_MODULES = ["brackets", "core", "document", "matcher", "settings", "tokenize"]
+
+_code_fingerprint = None  # type: Optional[str]
+
+
+def code_fingerprint() -> str:
+    """Return a hash of the version and the source of `CODE_MODULES`, so a
+    change to the code invalidates the cache even if the version is not
+    bumped. It is computed once."""
+    global _code_fingerprint
+    if _code_fingerprint is None:
+        digest = hashlib.sha256(__version__.encode("utf-8"))
+        package = os.path.dirname(os.path.abspath(__file__))
+        for module in CODE_MODULES:
+            with open(os.path.join(package, module + ".py"), "rb") as f:
+                digest.update(f.read())
+        _code_fingerprint = digest.hexdigest()
+    return _code_fingerprint
+
+
+_fingerprinted = {}  # type: Dict
+_settings_fingerprint = ""
+
+
+def settings_fingerprint() -> str:
+    """Return a hash of the current settings. It is only computed again when
+    the settings have changed since the last call."""
+    global _fingerprinted, _settings_fingerprint
+    if not _settings_fingerprint or settings != _fingerprinted:
+        data = json.dumps(settings, sort_keys=True).encode("utf-8")
+        _settings_fingerprint = hashlib.sha256(data).hexdigest()
+        _fingerprinted = copy.deepcopy(settings)
+    return _settings_fingerprint
+
+
+class ParagraphCache:
+    """
+    Cache of processed paragraphs stored in `directory`. New entries and
+    the time entries were last used are kept in memory until `BATCH_SIZE`
+    of them have been made or the cache is flushed. When the cache is
+    closed, the least recently used entries are removed until the stored
+    output is no larger than `max_size` bytes. It can be shared by threads
+    and by processes.
+
+    Attributes:
+        self.hits: The number of lookups that were found in the cache.
+        self.misses: The number of lookups that were not found.
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, max_size: int = 100 * 2**20):
+        self.path = os.path.join(directory, "paragraphs.sqlite3")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # The entries and the times of use that are not written yet.
+        self._entries: Dict[str, Tuple[str, str, int, float]] = {}
+        self._used: Dict[str, float] = {}
+        try:
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            # With a write-ahead log, readers do not wait for a writer.
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS paragraphs ("
+                "key TEXT PRIMARY KEY, output TEXT, size INTEGER, used REAL)"
+            )
+            self._db.commit()
+        except sqlite3.Error as e:
+            raise OSError("Cannot open the cache {}: {}".format(self.path, e)) from e
+
+    def __enter__(self) -> "ParagraphCache":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @staticmethod
+    def key(par: str, method: str) -> str:
+        """The key of the paragraph processed with the method under the
+        current settings and code."""
+        digest = hashlib.sha256()
+        for part in [code_fingerprint(), method, settings_fingerprint(), par]:
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, par: str, method: str) -> Optional[str]:
+        """Return the cached output of the paragraph or None."""
+        key = self.key(par, method)
+        with self._lock:
+            if key in self._entries:
+                row = self._entries[key][1:2]
+            else:
+                row = self._db.execute(
+                    "SELECT output FROM paragraphs WHERE key = ?", (key,)
+                ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._used[key] = time.time()
+            self._write_batch()
+        return row[0]
+
+    def put(self, par: str, method: str, output: str) -> None:
+        key = self.key(par, method)
+        with self._lock:
+            self._entries[key] = (key, output, len(output.encode("utf-8")), time.time())
+            self._used.pop(key, None)
+            self._write_batch()
+
+    def _write_batch(self) -> None:
+        if len(self._entries) + len(self._used) >= BATCH_SIZE:
+            self._write()
+
+    def _write(self) -> None:
+        """Write the pending entries and times of use in one transaction.
+        Must be called with the lock held."""
+        if not self._entries and not self._used:
+            return
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO paragraphs VALUES (?, ?, ?, ?)",
+                self._entries.values(),
+            )
+            self._db.executemany(
+                "UPDATE paragraphs SET used = ? WHERE key = ?",
+                [(used, key) for key, used in self._used.items()],
+            )
+        self._entries = {}
+        self._used = {}
+
+    def flush(self) -> None:
+        """Write the pending entries, so other processes can find them."""
+        with self._lock:
+            self._write()
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def evict(self) -> int:
+        """Remove the least recently used entries exceeding the size limit.
+        Return the number of removed entries."""
+        size = 0
+        expired = []
+        with self._lock:
+            self._write()
+            rows = self._db.execute(
+                "SELECT key, size FROM paragraphs ORDER BY used DESC"
+            ).fetchall()
+            for key, entry_size in rows:
+                size += entry_size
+                if size > self.max_size:
+                    expired.append((key,))
+            with self._db:
+                self._db.executemany("DELETE FROM paragraphs WHERE key = ?", expired)
+        return len(expired)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries = {}
+            self._used = {}
+            with self._db:
+                self._db.execute("DELETE FROM paragraphs")
+
+    def close(self) -> None:
+        self.evict()
+        with self._lock:
+            self._db.close()
+
+
+class MemoryCache:
+    """
+    In-memory cache of processed paragraphs with the same interface as
+    `ParagraphCache`. Lookups that are not found in memory are passed on to
+    the optional `backend`. The entries that have not been used since the
+    last call of `prune` can be removed with that, so the cache only holds
+    the paragraphs of the latest version of a document.
+    """
+
+    def __init__(self, backend: ParagraphCache = None) -> None:
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Tuple[str, str], str] = {}
+        self._used: Set[Tuple[str, str]] = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, par: str, method: str) -> Optional[str]:
+        key = (par, method)
+        result = self._entries.get(key)
+        if result is None and self.backend is not None:
+            result = self.backend.get(par, method)
+            if result is not None:
+                self._entries[key] = result
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._used.add(key)
+        return result
+
+    def put(self, par: str, method: str, output: str) -> None:
+        key = (par, method)
+        self._entries[key] = output
+        self._used.add(key)
+        if self.backend is not None:
+            self.backend.put(par, method, output)
+
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def prune(self, keep: Iterable[str] = ()) -> int:
+        """Remove the entries not used since the last pruning, except those
+        of the paragraphs in `keep`. Return the number of removed entries."""
+        kept = set(keep)
+        unused = [
+            key for key in self._entries if key not in self._used and key[0] not in kept
+        ]
+        for key in unused:
+            del self._entries[key]
+        self._used = set()
+        return len(unused)
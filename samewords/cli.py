@@ -1,16 +1,32 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-"""Command line interface director for the samewords script.
-"""
+"""Command line interface director for the samewords script."""
 
+import glob
 import json
+import sys
+import time
+
+from contextlib import ExitStack
 
 import samewords
 import argparse
 import os
 
-from typing import Dict
-from samewords.settings import settings
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+from samewords import instrumentation
+from samewords.settings import apply_config, settings
+from samewords.cache import CACHE_DIR, ParagraphCache
+from samewords.document import normalize_content, read_content
+from samewords.metrics import registry
+from samewords.server import SOCKET_PATH, call
+from samewords.stats import Statistics, observe, observing, phase
+
+# The modules of the other modes and options are imported when they are
+# used, so processing a single file starts fast.
+if TYPE_CHECKING:
+    from samewords.progress import Progress
+    from samewords.trace import Tracer
 
 
 def load_config(filename) -> Dict:
@@ -35,16 +51,7 @@ def parse_config_file(filename: str) -> None:
     print(filename)
     try:
         user_conf = load_config(filename)
-        settings["ellipsis_patterns"] += user_conf.get("ellipsis_patterns", [])
-        settings["exclude_macros"] += user_conf.get("exclude_macros", [])
-        settings["sensitive_context_match"] = user_conf.get(
-            "sensitive_context_match", settings["sensitive_context_match"]
-        )
-        settings["context_distance"] = user_conf.get(
-            "context_distance", settings["context_distance"]
-        )
-        settings["punctuation"] += user_conf.get("punctuation", [])
-        settings["multiword"] = user_conf.get("multiword", settings["multiword"])
+        apply_config(user_conf)
         # TODO: Add test for this multiword config setting.
     except FileNotFoundError as e:
         raise FileNotFoundError(
@@ -55,7 +62,7 @@ def parse_config_file(filename: str) -> None:
 def parse_arguments():
     parser = argparse.ArgumentParser(
         prog="samewords",
-        usage="%(prog)s [options] FILE",
+        usage="%(prog)s [options] FILE [FILE ...]",
         description="Annotate potentially ambiguous words in critical text "
         "editions made with LaTeX and reledmac.",
     )
@@ -63,8 +70,13 @@ def parse_arguments():
         "file",
         metavar="FILE",
         type=str,
-        nargs=1,
-        help="Location of local file to be processed.",
+        nargs="*",
+        help=(
+            "Location of local file to be processed. When several files, "
+            "directories or glob patterns are given, all the matched `.tex` "
+            "files are processed in a shared pool and written to the "
+            "directory given with `--output`."
+        ),
     )
     group = parser.add_mutually_exclusive_group()
     group.add_argument(
@@ -101,6 +113,125 @@ def parse_arguments():
             "default)s')"
         ),
     )
+    parser.add_argument(
+        "--stream",
+        dest="stream",
+        action="store_true",
+        help=(
+            "Read, process and write the file one paragraph at a time. This "
+            "keeps the memory use proportional to the largest paragraph "
+            "instead of the whole document."
+        ),
+    )
+    parser.add_argument(
+        "--mmap",
+        dest="mmap",
+        action="store_true",
+        help=(
+            "Map the file into memory and only decode the numbered paragraphs. "
+            "The text outside the numbered sections is copied to the output "
+            "unchanged. Useful for very large files."
+        ),
+    )
+    parser.add_argument(
+        "--preserve-unnumbered",
+        dest="preserve_unnumbered",
+        action="store_true",
+        help=(
+            "Keep the text outside `\\beginnumbering` and `\\endnumbering` "
+            "exactly as it is instead of Unicode normalizing the whole file."
+        ),
+    )
+    parser.add_argument(
+        "--watch",
+        dest="watch",
+        action="store_true",
+        help=(
+            "Keep running and process the file again each time it is saved. "
+            "Only the paragraphs that have changed are processed again."
+        ),
+    )
+    parser.add_argument(
+        "--processes",
+        "-j",
+        dest="processes",
+        action="store",
+        type=int,
+        help=(
+            "Number of worker processes used when processing several files "
+            "(default: the number of CPUs)."
+        ),
+    )
+    parser.add_argument(
+        "--coordinator",
+        dest="coordinator",
+        action="store",
+        metavar="[HOST:]PORT",
+        help=(
+            "When processing several files, hand out the work to workers "
+            "started with `samewords worker HOST:PORT` on this or other "
+            "machines instead of processing it here."
+        ),
+    )
+    parser.add_argument(
+        "--token",
+        dest="token",
+        action="store",
+        default=os.environ.get("SAMEWORDS_TOKEN"),
+        help=(
+            "The secret the workers must present to the `--coordinator`. "
+            "(default: the SAMEWORDS_TOKEN environment variable, or a "
+            "generated token that is printed)"
+        ),
+    )
+    parser.add_argument(
+        "--queue-size",
+        dest="queue_size",
+        action="store",
+        type=int,
+        default=4,
+        help=(
+            "Number of processed files that may wait to be written when "
+            "processing several files. (default: %(default)s)"
+        ),
+    )
+    parser.add_argument(
+        "--shared-memory",
+        dest="shared_memory",
+        action="store_true",
+        help=(
+            "When processing several files, pass the documents to the worker "
+            "processes in shared memory instead of copying each paragraph."
+        ),
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="no_cache",
+        action="store_true",
+        help=(
+            "Do not use the cache of processed paragraphs. Without this, "
+            "paragraphs that have not changed since an earlier run are "
+            "reused from the cache."
+        ),
+    )
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        action="store",
+        default=CACHE_DIR,
+        help="Location of the paragraph cache. (default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--cache-size",
+        dest="cache_size",
+        action="store",
+        type=int,
+        default=100,
+        help=(
+            "Maximum size of the paragraph cache in MB. The least recently "
+            "used paragraphs are removed first. (default: %(default)s)"
+        ),
+    )
     parser.add_argument(
         "--config-file",
         dest="config",
@@ -118,16 +249,568 @@ def parse_arguments():
         help="Show version and exit.",
     )
 
-    return vars(parser.parse_args())
+    parser.add_argument(
+        "--server",
+        dest="server",
+        action="store_true",
+        help=(
+            "Run as a server on a local socket. While the server is running, "
+            "other invocations of the script send their files to it instead "
+            "of starting their own processing."
+        ),
+    )
+    parser.add_argument(
+        "--socket",
+        dest="socket",
+        action="store",
+        default=SOCKET_PATH,
+        help="Location of the server socket. (default: '%(default)s')",
+    )
+    parser.add_argument(
+        "--no-daemon",
+        dest="no_daemon",
+        action="store_true",
+        help="Process the file in this process even when a server is running.",
+    )
+    parser.add_argument(
+        "--lsp",
+        dest="lsp",
+        action="store_true",
+        help=(
+            "Run as a language server for editors on stdin and stdout. "
+            "Formatting a document processes its changed paragraphs."
+        ),
+    )
+
+    parser.add_argument(
+        "--metrics-file",
+        dest="metrics_file",
+        action="store",
+        metavar="FILE",
+        help="Write the processing metrics in OpenMetrics text format to FILE.",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        dest="metrics_port",
+        action="store",
+        type=int,
+        metavar="PORT",
+        help=(
+            "Serve the processing metrics in OpenMetrics text format on "
+            "http://127.0.0.1:PORT/ while the script runs."
+        ),
+    )
+    parser.add_argument(
+        "--stats",
+        dest="stats",
+        action="store_true",
+        help=(
+            "Print the wall and CPU time of each processing phase, the counts "
+            "of paragraphs, words, registry entries and annotations and the "
+            "throughput to stderr."
+        ),
+    )
+    parser.add_argument(
+        "--stats-json",
+        dest="stats_json",
+        action="store",
+        metavar="PATH",
+        help="Write the statistics of the run as JSON to PATH.",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        action="store",
+        metavar="OUT",
+        help=(
+            "Profile the processing of the file with cProfile instead of "
+            "writing the result. A profile of each phase (chunking, "
+            "tokenization, matching, cleanup and writing) is written to "
+            "`OUT/<phase>.pstats`, and a summary of the slowest functions is "
+            "printed and written to `OUT/summary.txt`."
+        ),
+    )
+    parser.add_argument(
+        "--profile-section",
+        dest="profile_section",
+        action="store",
+        type=int,
+        metavar="N",
+        help="Only profile numbered section N (counted from 0).",
+    )
+    parser.add_argument(
+        "--profile-paragraph",
+        dest="profile_paragraph",
+        action="store",
+        type=int,
+        metavar="N",
+        help=(
+            "Only profile numbered paragraph N (counted from 0), within the "
+            "section given with `--profile-section` if any."
+        ),
+    )
+    parser.add_argument(
+        "--profile-top",
+        dest="profile_top",
+        action="store",
+        type=int,
+        default=20,
+        metavar="N",
+        help="Number of functions in the profile summary. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--memory-report",
+        dest="memory_report",
+        action="store",
+        metavar="PATH",
+        help=(
+            "Trace the memory allocations while processing the file and write "
+            "a JSON report of the peak memory of each paragraph and phase, "
+            "the number of objects created and the largest paragraphs to "
+            "PATH. The paragraph cache is not used. Only for a single file."
+        ),
+    )
+    parser.add_argument(
+        "--trace",
+        dest="trace",
+        action="store",
+        metavar="OUT.json",
+        help=(
+            "Write a timeline of the processing in the Chrome trace event "
+            "format, which can be opened in Perfetto or chrome://tracing. It "
+            "shows each file, numbered section and paragraph and the worker "
+            "process that handled it."
+        ),
+    )
+    parser.add_argument(
+        "--no-progress",
+        dest="no_progress",
+        action="store_true",
+        help=(
+            "Do not show the progress of the run. It is shown on stderr when "
+            "stdout is a terminal."
+        ),
+    )
+    parser.add_argument(
+        "--progress-lines",
+        dest="progress_lines",
+        action="store_true",
+        help=(
+            "Write the progress of the run to stderr as a JSON object per "
+            "line, e.g. for the logs of continuous integration."
+        ),
+    )
+    parser.add_argument(
+        "--slow-log",
+        dest="slow_log",
+        action="store",
+        type=float,
+        metavar="MS",
+        help=(
+            "Log each registry entry and paragraph that takes more than MS "
+            "milliseconds to process to stderr, with its line in the input, "
+            "lemma, context size and nesting level. Only for a single file."
+        ),
+    )
+
+    args = vars(parser.parse_args())
+    if not args["file"] and not args["server"] and not args["lsp"]:
+        parser.error("the following arguments are required: FILE")
+    return args
+
+
+def read_normalized(filename: str, preserve_unnumbered: bool = False) -> str:
+    """Read and normalize the input file and tell the user on stderr if the
+    Unicode normalization changed the content."""
+    content, changed = normalize_content(read_content(filename), preserve_unnumbered)
+    if changed:
+        print(
+            "Note: Unicode normalization (NFC) changed the content of "
+            "{}.".format(filename),
+            file=sys.stderr,
+        )
+    return content
+
+
+def expand_paths(paths: List[str]) -> List[Tuple[str, str]]:
+    """Expand directories and glob patterns into the `.tex` files they
+    contain. Return a list of tuples with the path of each file and the path
+    its output should have relative to the output directory. Files found in a
+    directory keep their location relative to that directory."""
+    expanded = []
+    for path in paths:
+        if os.path.isdir(path):
+            pattern = os.path.join(glob.escape(path), "**", "*.tex")
+            for match in sorted(glob.glob(pattern, recursive=True)):
+                expanded.append((match, os.path.relpath(match, path)))
+        elif os.path.isfile(path):
+            expanded.append((path, os.path.basename(path)))
+        else:
+            matches = sorted(glob.glob(path, recursive=True))
+            if not matches:
+                raise FileNotFoundError(
+                    "The input '{}' does not match any files.".format(path)
+                )
+            for match in matches:
+                if os.path.isfile(match):
+                    expanded.append((match, os.path.basename(match)))
+    return expanded
+
+
+def process_batch(
+    paths: List[str],
+    output: str,
+    procedure: str,
+    processes: int = None,
+    preserve_unnumbered: bool = False,
+    cache: ParagraphCache = None,
+    shared: bool = False,
+    queue_size: int = 4,
+    coordinator: str = None,
+    stats: Statistics = None,
+    tracer: "Tracer" = None,
+    progress: "Progress" = None,
+    token: str = None,
+) -> None:
+    """Process all files matched by `paths` and write them to the `output`
+    directory. Print a summary of the time spent on each file and of the
+    waiting in the pipeline. If a `coordinator` address is given, the work
+    is handed out to `samewords worker` processes connecting to it with the
+    `token`. The counts of all files are added to `stats`, the timeline of
+    the pipeline is recorded by the `tracer` and the paragraphs done by the
+    workers advance the `progress`, if given."""
+    from samewords.distributed import Coordinator, parse_address
+    from samewords.pipeline import Pipeline
+    from samewords.progress import prescan_file
+
+    files = expand_paths(paths)
+    targets = [os.path.join(output, relative) for _, relative in files]
+    if len(set(targets)) != len(targets):
+        raise ValueError(
+            "Several input files would be written to the same output file. "
+            "Give the directory containing them instead."
+        )
+    print("Starting conversion of {} files.".format(len(files)))
+    start = time.perf_counter()
+    if coordinator:
+        host, port = parse_address(coordinator)
+        distributed = Coordinator(
+            [f for f, _ in files],
+            procedure,
+            host,
+            port,
+            preserve_unnumbered=preserve_unnumbered,
+            cache=cache,
+            token=token,
+        )
+        print("Waiting for workers on {}:{}.".format(*distributed.address))
+        if token is None:
+            print("Start them with SAMEWORDS_TOKEN={}.".format(distributed.token))
+        summary = []
+        with distributed:
+            for result, target in zip(distributed.results(), targets):
+                os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+                with open(target, mode="w") as f:
+                    f.write(result.content)
+                summary.append((result, target))
+        report = distributed.report()
+    else:
+        pipeline = Pipeline(
+            procedure,
+            processes,
+            queue_size,
+            preserve_unnumbered=preserve_unnumbered,
+            cache=cache,
+            shared=shared,
+            tracer=tracer,
+            progress=progress,
+        )
+        with ExitStack() as stack:
+            if progress is not None:
+                # The paragraphs found in the cache are reported to observers.
+                stack.enter_context(observe(progress))
+                for filename, _ in files:
+                    progress.add_total(*prescan_file(filename, procedure))
+            results = pipeline.run([(f, t) for (f, _), t in zip(files, targets)])
+        if progress is not None:
+            progress.finish()
+        summary = list(zip(results, targets))
+        report = pipeline.stats.report()
+    print("Conversion succeeded.\n")
+    width = max(len(result.filename) for result, _ in summary)
+    for result, target in summary:
+        if stats is not None:
+            stats.update(result.stats)
+        print(
+            "{:<{width}}  {:>5} paragraphs  {:>5} skipped  {:>8.3f}s  -> {}".format(
+                result.filename,
+                result.stats["paragraphs"],
+                result.stats["paragraphs_skipped"] + result.stats["sections_skipped"],
+                result.seconds,
+                target,
+                width=width,
+            )
+        )
+    print("\nTotal time: {:.3f}s".format(time.perf_counter() - start))
+    print(report)
+
+
+def create_progress(args: Dict) -> Optional["Progress"]:
+    """Create the progress of the run, if it is wanted. Unless written as
+    lines, it is only shown when stdout is a terminal and the file is not
+    processed by a server, which cannot report it."""
+    from samewords.progress import Progress
+
+    if args["progress_lines"]:
+        return Progress(lines=True)
+    if args["no_progress"] or args["watch"] or not sys.stdout.isatty():
+        return None
+    if not args["no_daemon"] and os.path.exists(args["socket"]):
+        return None
+    return Progress()
+
+
+def output_location(filename: str, output: str) -> str:
+    """Determine the output file from the `--output` argument. Ask before
+    overwriting an existing file."""
+    if os.path.isdir(output):
+        _, output_filename = os.path.split(filename)
+        output_dir = output
+    elif os.path.isfile(output):
+        answer = input("The file {} already exists. Overwrite (y/n)?".format(output))
+        if answer.lower() == "y":
+            output_dir, output_filename = os.path.split(output)
+        else:
+            print("Quit.")
+            exit(0)
+    else:
+        output_dir, output_filename = os.path.split(output)
+    return os.path.join(output_dir, output_filename)
+
+
+def process_with_server(content: str, procedure: str, args: Dict) -> Optional[str]:
+    """Let the running server process the content with the current settings.
+    Return None if the server cannot be reached."""
+    params = {"string": content, "settings": settings}
+    try:
+        return call(procedure, params, args["socket"])["content"]
+    except OSError:
+        return None
+
+
+def process_file(
+    args: Dict,
+    filename: str,
+    procedure: str,
+    cache: ParagraphCache = None,
+    stats: Statistics = None,
+) -> None:
+    """Process a single file and write the result to stdout or the output
+    location. The counts and the time of each phase are recorded in `stats`,
+    if given."""
+    if stats is not None:
+        with stats.recording():
+            return _process_file(args, filename, procedure, cache, stats)
+    return _process_file(args, filename, procedure, cache, stats)
+
+
+def _process_file(
+    args: Dict,
+    filename: str,
+    procedure: str,
+    cache: ParagraphCache,
+    stats: Statistics,
+) -> None:
+    output = args["location"]
+    preserve = args["preserve_unnumbered"]
+    output_result = output_location(filename, output) if output else None
+    if output_result:
+        # Starting conversion
+        print("Starting conversion.")
+
+    if args["stream"] or args["mmap"]:
+        if output_result is None:
+            out = sys.stdout.buffer if args["mmap"] else sys.stdout
+        elif os.path.isfile(output_result) and os.path.samefile(
+            filename, output_result
+        ):
+            raise ValueError("The input file cannot be used as output when streaming.")
+        else:
+            out = open(output_result, mode="wb" if args["mmap"] else "w")
+        try:
+            if args["mmap"]:
+                samewords.core.process_mapped(filename, out, procedure, stats, cache)
+            else:
+                for part in samewords.core.process_document_stream(
+                    filename, procedure, preserve, stats, cache
+                ):
+                    out.write(part)
+        finally:
+            if output_result:
+                out.close()
+        if output_result:
+            print("Conversion succeeded. Saved file to {}".format(output_result))
+        return
+
+    output_content = None
+    with phase("read", filename=filename):
+        content = read_normalized(filename, preserve)
+    # The server cannot report the phases to the observers of this run.
+    if not args["no_daemon"] and not observing() and os.path.exists(args["socket"]):
+        output_content = process_with_server(content, procedure, args)
+    if output_content is None:
+        output_content = samewords.core.process_string(content, procedure, stats, cache)
+    if not output_result:
+        with phase("write"):
+            print(output_content)
+    else:
+        print("Conversion succeeded. Saving file to {}".format(output_result))
+        with phase("write"), open(output_result, mode="w") as f:
+            f.write(output_content)
+
+
+def watch_file(
+    filename: str,
+    output: str,
+    procedure: str,
+    cache: ParagraphCache = None,
+    preserve_unnumbered: bool = False,
+) -> None:
+    """Process the file each time it changes until interrupted."""
+    from samewords.watch import Watcher
+
+    output_result = output_location(filename, output)
+
+    def report(stats: Statistics, seconds: float) -> None:
+        print(
+            "Updated {}: {} paragraphs processed, {} reused in {:.3f}s.".format(
+                output_result, stats["paragraphs"], stats["paragraphs_cached"], seconds
+            )
+        )
+
+    print("Watching {} for changes. Stop with Ctrl-C.".format(filename))
+    try:
+        watcher = Watcher(
+            filename, output_result, procedure, cache, preserve_unnumbered
+        )
+        watcher.watch(report=report)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+
+
+def report_cache(cache: ParagraphCache) -> None:
+    """Tell how many paragraphs were found in the cache."""
+    lookups = cache.hits + cache.misses
+    if lookups:
+        print(
+            "Cache: {} of {} paragraphs reused ({:.0%} hit rate).".format(
+                cache.hits, lookups, cache.hit_rate()
+            ),
+            file=sys.stderr,
+        )
+
+
+def profile_file(filename: str, procedure: str, args: Dict) -> None:
+    """Profile the processing of the file and write the profiles."""
+    from samewords.profiling import profile_document
+
+    profiler = profile_document(
+        filename,
+        procedure,
+        args["profile_section"],
+        args["profile_paragraph"],
+        args["preserve_unnumbered"],
+    )
+    paths = profiler.write(args["profile"], args["profile_top"])
+    print(profiler.summary(args["profile_top"]))
+    print(
+        "Profiled {} paragraphs. Wrote {}.".format(
+            profiler.paragraphs, ", ".join(paths)
+        )
+    )
+
+
+def report_memory(
+    args: Dict, filename: str, procedure: str, stats: Statistics = None
+) -> None:
+    """Process the file while tracing the memory allocations and write the
+    memory report."""
+    from samewords.profiling import MemoryProfiler, tracing
+
+    profiler = MemoryProfiler()
+    with tracing(), instrumentation.counting(), observe(profiler):
+        process_file(args, filename, procedure, None, stats)
+    with open(args["memory_report"], mode="w") as f:
+        json.dump(profiler.report(), f, indent=2)
+
+
+def report_stats(stats: Statistics, args: Dict) -> None:
+    """Print the statistics to stderr and write them as JSON, as requested."""
+    if args["stats"]:
+        print(stats.format(), file=sys.stderr)
+    if args["stats_json"]:
+        with open(args["stats_json"], mode="w") as f:
+            json.dump(stats.summary(), f, indent=2)
+
+
+def worker_main(argv: List[str]) -> None:
+    """Run `samewords worker`, which processes tasks from a coordinator."""
+    from samewords.distributed import parse_address, run_workers
+
+    parser = argparse.ArgumentParser(
+        prog="samewords worker",
+        description="Process tasks from a samewords coordinator.",
+    )
+    parser.add_argument("address", metavar="HOST:PORT", help="The coordinator.")
+    parser.add_argument(
+        "--processes",
+        "-j",
+        type=int,
+        default=1,
+        help="Number of worker processes. (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--token",
+        default=os.environ.get("SAMEWORDS_TOKEN"),
+        help=(
+            "The secret of the coordinator. (default: the SAMEWORDS_TOKEN "
+            "environment variable)"
+        ),
+    )
+    args = parser.parse_args(argv)
+    if not args.token:
+        parser.error("the token of the coordinator must be given with --token")
+    run_workers(parse_address(args.address), args.token, args.processes)
 
 
 def main():
+    if sys.argv[1:2] == ["worker"]:
+        worker_main(sys.argv[2:])
+        return
+
     # Read command line arguments
     args = parse_arguments()
 
-    filename = args["file"][0]
-    output = args["location"]
-    config = args["config"]
+    if args["config"]:
+        parse_config_file(args["config"])
+
+    if args["metrics_port"] is not None:
+        from samewords.metrics import serve_metrics
+
+        serve_metrics(args["metrics_port"])
+
+    if args["server"]:
+        from samewords.server import serve
+
+        print("Serving on {}. Stop with Ctrl-C.".format(args["socket"]))
+        try:
+            serve(args["socket"], args["processes"])
+        except KeyboardInterrupt:
+            print("Stopped serving.")
+        finally:
+            if args["metrics_file"]:
+                registry.write(args["metrics_file"])
+        return
 
     if not True in [args["annotate"], args["clean"], args["update"]]:
         procedure = "annotate"
@@ -138,31 +821,111 @@ def main():
     else:
         procedure = "update"
 
-    if config:
-        parse_config_file(config)
+    if args["lsp"]:
+        from samewords.lsp import serve as serve_lsp
 
-    if not output:
-        print(samewords.core.process_document(filename, procedure))
-    else:
-        if os.path.isdir(output):
-            _, output_filename = os.path.split(filename)
-            output_dir = output
-        elif os.path.isfile(output):
-            answer = input(
-                "The file {} already exists. Overwrite (y/n)?".format(output)
+        sys.exit(serve_lsp(sys.stdin.buffer, sys.stdout.buffer, procedure))
+
+    if args["profile"]:
+        profile_file(args["file"][0], procedure, args)
+        return
+
+    filename = args["file"][0]
+    output = args["location"]
+
+    cache = None
+    if not args["no_cache"]:
+        try:
+            cache = ParagraphCache(args["cache_dir"], args["cache_size"] * 2**20)
+        except OSError as e:
+            print(
+                "Warning: Continuing without the cache. {}".format(e),
+                file=sys.stderr,
+            )
+    stats = Statistics() if args["stats"] or args["stats_json"] else None
+    tracer = None
+    if args["trace"]:
+        from samewords.trace import Tracer
+
+        tracer = Tracer()
+    slow_log = None
+    if args["slow_log"] is not None:
+        from samewords.profiling import SlowLog
+
+        slow_log = SlowLog(
+            args["slow_log"] / 1000,
+            lambda record: print(SlowLog.format(record), file=sys.stderr),
+        )
+    progress = create_progress(args)
+
+    try:
+        # An existing file is taken by its name, even if it looks like a
+        # glob pattern.
+        is_pattern = not os.path.exists(filename) and any(c in filename for c in "*?[")
+        several = len(args["file"]) > 1 or os.path.isdir(filename) or is_pattern
+        if (args["watch"] or several) and (
+            args["slow_log"] is not None or args["memory_report"]
+        ):
+            raise ValueError(
+                "`--slow-log` and `--memory-report` can only be used when "
+                "processing a single file once."
+            )
+        if args["watch"]:
+            if len(args["file"]) > 1 or not output:
+                raise ValueError(
+                    "Watching requires a single file and an output location "
+                    "given with `--output`."
+                )
+            watch_file(filename, output, procedure, cache, args["preserve_unnumbered"])
+        elif several:
+            if not output:
+                raise ValueError(
+                    "An output directory must be given with `--output` when "
+                    "processing several files."
+                )
+            if os.path.isfile(output):
+                raise ValueError(
+                    "The output location '{}' must be a directory when "
+                    "processing several files.".format(output)
+                )
+            process_batch(
+                args["file"],
+                output,
+                procedure,
+                args["processes"],
+                args["preserve_unnumbered"],
+                cache,
+                args["shared_memory"],
+                args["queue_size"],
+                args["coordinator"],
+                stats,
+                tracer,
+                progress,
+                args["token"],
             )
-            if answer.lower() == "y":
-                output_dir, output_filename = os.path.split(output)
-            else:
-                print("Quit.")
-                exit(0)
         else:
-            output_dir, output_filename = os.path.split(output)
-        output_result = os.path.join(output_dir, output_filename)
+            if progress is not None:
+                from samewords.progress import prescan_file
 
-        # Starting conversion
-        print("Starting conversion.")
-        output_content = samewords.core.process_document(filename, procedure)
-        print("Conversion succeeded. Saving file to {}".format(output_result))
-        with open(output_result, mode="w") as f:
-            f.write(output_content)
+                progress.add_total(*prescan_file(filename, procedure))
+            with ExitStack() as stack:
+                for observer in [tracer, slow_log, progress]:
+                    if observer is not None:
+                        stack.enter_context(observe(observer))
+                if args["memory_report"]:
+                    report_memory(args, filename, procedure, stats)
+                else:
+                    with phase("file", filename=filename):
+                        process_file(args, filename, procedure, cache, stats)
+            if progress is not None:
+                progress.finish()
+        if stats is not None:
+            report_stats(stats, args)
+        if tracer is not None:
+            tracer.write(args["trace"])
+    finally:
+        if cache is not None:
+            cache.close()
+            report_cache(cache)
+        if args["metrics_file"]:
+            registry.write(args["metrics_file"])
@@ -1,40 +1,387 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import time
+
 from samewords.matcher import Matcher
+from samewords.metrics import CHUNKS_SKIPPED, MATCH_SECONDS, PARAGRAPHS
+from samewords.metrics import TOKENIZE_SECONDS, registry
+from samewords.settings import settings
+from samewords.stats import Statistics, count, observe, observing, phase
 from samewords.tokenize import Tokenizer
-from samewords.document import chunk_pars, chunk_doc, doc_content
+from samewords.document import chunk_pars, chunk_doc, doc_content, doc_stream
+from samewords.document import doc_mapped, doc_spans, par_spans, decode_span
+
+from typing import TYPE_CHECKING, Awaitable, BinaryIO, Dict, Iterator, List, Tuple
+from typing import Union
+
+# Only needed for the annotations. The modules that need asyncio, the
+# executors, the cache and the tracing are imported where they are used, so
+# importing the package stays fast.
+if TYPE_CHECKING:
+    from concurrent.futures import Executor
+    from samewords.cache import ParagraphCache
+
+
+# The macros of which a text must contain at least one for the processing
+# with each method to change it.
+MARKERS = {
+    "annotate": ["\\edtext"],
+    "update": ["\\edtext", "\\sameword"],
+    "clean": ["\\sameword"],
+}
+
+
+def needs_processing(text: str, method: str = "annotate") -> bool:
+    """Cheap check of whether processing can change the text. Annotation
+    requires an `\\edtext` and cleaning requires a `\\sameword` (see
+    `MARKERS`), so text without them is passed on as it is."""
+    return any(marker in text for marker in MARKERS[method])
+
+
+def process_paragraph(
+    par: str,
+    method: str = "annotate",
+    stats: Statistics = None,
+    cache: "ParagraphCache" = None,
+) -> str:
+    """Process a single numbered paragraph unless `needs_processing` tells
+    that nothing can change or the result is found in the `cache`. Register
+    the outcome in `stats`, if given."""
+    if not needs_processing(par, method):
+        CHUNKS_SKIPPED.inc(kind="paragraph")
+        if stats is not None:
+            stats.add("paragraphs_skipped")
+        return par
+    if cache is not None:
+        result = cache.get(par, method)
+        if result is not None:
+            if stats is not None:
+                stats.add("paragraphs_cached")
+            if observing():
+                count("entries_cached", par.count("\\edtext"))
+            return result
+    if stats is not None:
+        stats.add("paragraphs")
+    with phase("paragraph", text=par):
+        result = run_annotation(par, method)
+    if cache is not None:
+        cache.put(par, method, result)
+    return result
+
+
+def process_section(
+    section: str,
+    method: str = "annotate",
+    stats: Statistics = None,
+    cache: "ParagraphCache" = None,
+) -> str:
+    """Process the paragraphs of a numbered section. A section that does not
+    need processing is passed on without splitting it into paragraphs."""
+    if not needs_processing(section, method):
+        CHUNKS_SKIPPED.inc(kind="section")
+        if stats is not None:
+            stats.add("sections_skipped")
+        return section
+    if stats is not None:
+        stats.add("sections")
+    with phase("section", text=section):
+        with phase("chunk"):
+            pars = chunk_pars(section)
+        return "".join([process_paragraph(par, method, stats, cache) for par in pars])
 
 
 def run_annotation(input_text: str, method: str = "annotate") -> str:
-    tokenization = Tokenizer(input_text)
-    matcher = Matcher(tokenization.wordlist, tokenization.registry)
-    if method == "annotate":
-        words = matcher.annotate()
-    elif method == "update":
-        words = matcher.update()
+    start = time.perf_counter()
+    with phase("tokenize"):
+        tokenization = Tokenizer(input_text)
+    tokenized = time.perf_counter()
+    matcher = Matcher(
+        tokenization.wordlist, tokenization.registry, tokenization.offsets
+    )
+    if method in ["update", "clean"]:
+        with phase("cleanup"):
+            words = matcher.cleanup()
+    if method in ["annotate", "update"]:
+        with phase("match"):
+            words = matcher.annotate()
+    matched = time.perf_counter()
+    with phase("write"):
+        result = words.write()
+    TOKENIZE_SECONDS.observe(tokenized - start)
+    MATCH_SECONDS.observe(matched - tokenized)
+    PARAGRAPHS.inc(method=method)
+    if observing():
+        count("words", len(tokenization.wordlist))
+        count("entries", len(tokenization.registry))
+        # The change in the number of annotations of the paragraph.
+        change = result.count("\\sameword") - input_text.count("\\sameword")
+        count("annotations_added", max(change, 0))
+        count("annotations_removed", max(-change, 0))
+    return result
+
+
+def run_task(
+    par: str, method: str, task_settings: Dict, trace: Dict = None
+) -> Tuple[str, float, Dict, List[Dict]]:
+    """Run the annotation of a single paragraph in a worker. The settings of
+    the parent process are passed with each task, as they may have been
+    modified at runtime (e.g. from a config file). The metrics of the task
+    are returned for the parent to merge. With `trace`, the phases of the
+    task are returned as trace events, with `trace` as the arguments of the
+    paragraph."""
+    settings.update(task_settings)
+    start = time.perf_counter()
+    if trace is None:
+        result, events = run_annotation(par, method), []
     else:
-        words = matcher.cleanup()
-    return words.write()
+        from samewords.trace import Tracer
+
+        tracer = Tracer()
+        with observe(tracer), phase("paragraph", text=par, **trace):
+            result = run_annotation(par, method)
+        events = tracer.events
+    return result, time.perf_counter() - start, registry.drain(), events
+
+
+def plan_string(
+    content: str,
+    method: str = "annotate",
+    stats: Statistics = None,
+    cache: "ParagraphCache" = None,
+) -> List[Tuple[str, bool]]:
+    """Split the content into parts for processing elsewhere. Return a list
+    of (text, pending) tuples, where the pending parts are the numbered
+    paragraphs that must be processed and the others are done already
+    (skipped or found in the `cache`)."""
+    if stats is None:
+        stats = Statistics()
+    parts = []
+    for i, chunk in enumerate(chunk_doc(content)):
+        # Only unequal indices contain numbered reledmac paragraphs
+        if i % 2 == 0:
+            parts.append((chunk, False))
+        elif not needs_processing(chunk, method):
+            CHUNKS_SKIPPED.inc(kind="section")
+            stats.add("sections_skipped")
+            parts.append((chunk, False))
+        else:
+            stats.add("sections")
+            for par in chunk_pars(chunk):
+                if not needs_processing(par, method):
+                    CHUNKS_SKIPPED.inc(kind="paragraph")
+                    stats.add("paragraphs_skipped")
+                    parts.append((par, False))
+                    continue
+                cached = cache.get(par, method) if cache is not None else None
+                if cached is not None:
+                    stats.add("paragraphs_cached")
+                    if observing():
+                        count("entries_cached", par.count("\\edtext"))
+                    parts.append((cached, False))
+                else:
+                    stats.add("paragraphs")
+                    parts.append((par, True))
+    return parts
 
 
-def process_document(filename: str, method: str = "annotate") -> str:
+def process_document(
+    filename: str,
+    method: str = "annotate",
+    preserve_unnumbered: bool = False,
+    stats: Statistics = None,
+    cache: "ParagraphCache" = None,
+    return_stats: bool = False,
+) -> Union[str, Tuple[str, Statistics]]:
     """The function directing the processing of a document. Return updated
-    document as string."""
+    document as string. If `preserve_unnumbered` is true, the text outside
+    the numbered sections is not Unicode normalized. If `stats` is given,
+    the counts, the time of each phase and the counted operations are
+    recorded in it (see `Statistics.recording`). With `return_stats`, return
+    the document and the statistics."""
 
-    content = doc_content(filename)
-    return process_string(content, method=method)
+    if stats is None and return_stats:
+        stats = Statistics()
+    if stats is None:
+        return _process_document(filename, method, preserve_unnumbered, None, cache)
+    with stats.recording():
+        result = _process_document(filename, method, preserve_unnumbered, stats, cache)
+    return (result, stats) if return_stats else result
 
 
-def process_string(content: str, method: str = "annotate") -> str:
-    """Process an input string. Return updated document as string."""
+def _process_document(
+    filename: str,
+    method: str,
+    preserve_unnumbered: bool,
+    stats: Statistics,
+    cache: "ParagraphCache",
+) -> str:
+    with phase("read", filename=filename):
+        content = doc_content(filename, preserve_unnumbered)
+    return process_string(content, method=method, stats=stats, cache=cache)
+
+
+def process_string(
+    content: str,
+    method: str = "annotate",
+    stats: Statistics = None,
+    cache: "ParagraphCache" = None,
+) -> str:
+    """Process an input string. Return updated document as string. The
+    number of processed and skipped sections and paragraphs and the time of
+    each phase are added to `stats`, if given. Paragraphs found in the
+    `cache` are not processed again."""
+
+    if stats is not None:
+        with stats.recording():
+            return _process_string(content, method, stats, cache)
+    return _process_string(content, method, stats, cache)
 
-    chunked_content = chunk_doc(content)
-    updated = []
-    for i, chunk in enumerate(chunked_content):
-        # Only unequal indices contain numbered reledmac paragraphs
-        if not i % 2 == 0:
-            chunk = "".join([run_annotation(par, method) for par in chunk_pars(chunk)])
-        updated.append(chunk)
 
+def _process_string(
+    content: str, method: str, stats: Statistics, cache: "ParagraphCache"
+) -> str:
+    with phase("document", text=content):
+        with phase("chunk"):
+            chunked_content = chunk_doc(content)
+        updated = []
+        for i, chunk in enumerate(chunked_content):
+            # Only unequal indices contain numbered reledmac paragraphs
+            if not i % 2 == 0:
+                chunk = process_section(chunk, method, stats, cache)
+            updated.append(chunk)
+
+    return "".join(updated)
+
+
+def process_document_stream(
+    filename: str,
+    method: str = "annotate",
+    preserve_unnumbered: bool = False,
+    stats: Statistics = None,
+    cache: "ParagraphCache" = None,
+) -> Iterator[str]:
+    """Process the document one paragraph at a time. Yield the updated
+    document in consecutive parts, so it can be written while the rest of the
+    document is still being read."""
+
+    for numbered, chunk in doc_stream(filename, preserve_unnumbered):
+        yield process_paragraph(chunk, method, stats, cache) if numbered else chunk
+
+
+def process_mapped(
+    filename: str,
+    output: BinaryIO,
+    method: str = "annotate",
+    stats: Statistics = None,
+    cache: "ParagraphCache" = None,
+) -> None:
+    """Process a memory-mapped document and write the result to the binary
+    `output` stream. Only the numbered paragraphs are decoded and processed;
+    the text outside the numbered sections is copied from the mapped file
+    as it is, so it is not normalized."""
+
+    with doc_mapped(filename) as content, memoryview(content) as view:
+        for i, (start, end) in enumerate(doc_spans(content)):
+            # Only unequal indices contain numbered reledmac paragraphs
+            if i % 2 == 0:
+                output.write(view[start:end])
+                continue
+            for par_start, par_end in par_spans(content, start, end):
+                par = decode_span(content, par_start, par_end)
+                result = process_paragraph(par, method, stats, cache)
+                output.write(result.encode("utf-8"))
+
+
+def _write(filename: str, content: str) -> None:
+    with open(filename, mode="w") as f:
+        f.write(content)
+
+
+async def process_string_async(
+    content: str,
+    method: str = "annotate",
+    executor: "Executor" = None,
+    stats: Statistics = None,
+    cache: "ParagraphCache" = None,
+) -> str:
+    """Process an input string without blocking the event loop. Each numbered
+    paragraph is a separate task in the `executor` (default: the default
+    executor of the loop), so a process pool can be used for the CPU work.
+    If the processing is cancelled, the paragraphs not yet started are
+    cancelled with it."""
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    task_settings = dict(settings)
+    parts = plan_string(content, method, stats, cache)
+    tasks = {
+        index: loop.run_in_executor(executor, run_task, par, method, task_settings)
+        for index, (par, pending) in enumerate(parts)
+        if pending
+    }
+    try:
+        await asyncio.gather(*tasks.values())
+    finally:
+        for task in tasks.values():
+            task.cancel()
+    updated = []
+    for index, (par, pending) in enumerate(parts):
+        if pending:
+            result, _, metrics, _ = tasks[index].result()
+            registry.merge(metrics)
+            if cache is not None:
+                cache.put(par, method, result)
+            par = result
+        updated.append(par)
     return "".join(updated)
+
+
+async def process_document_async(
+    filename: str,
+    method: str = "annotate",
+    preserve_unnumbered: bool = False,
+    executor: "Executor" = None,
+    output: str = None,
+    stats: Statistics = None,
+    cache: "ParagraphCache" = None,
+) -> str:
+    """Process a document without blocking the event loop. The file is read
+    (and the result written to `output`, if given) in the default executor
+    of the loop, and the paragraphs are processed in the `executor`. Return
+    the updated document."""
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    content = await loop.run_in_executor(
+        None, doc_content, filename, preserve_unnumbered
+    )
+    result = await process_string_async(content, method, executor, stats, cache)
+    if output is not None:
+        await loop.run_in_executor(None, _write, output, result)
+    return result
+
+
+def documents_as_completed(
+    filenames: List[str],
+    method: str = "annotate",
+    executor: "Executor" = None,
+    preserve_unnumbered: bool = False,
+    limit: int = None,
+) -> Iterator[Awaitable[Tuple[str, str]]]:
+    """Start processing the documents and return an iterator of awaitables
+    in the order they are done, like `asyncio.as_completed`. Each gives the
+    filename and the updated document. At most `limit` documents are
+    processed at a time, if given. Must be called from a running event
+    loop."""
+    import asyncio
+
+    semaphore = asyncio.Semaphore(limit or max(len(filenames), 1))
+
+    async def process(filename: str) -> Tuple[str, str]:
+        async with semaphore:
+            return filename, await process_document_async(
+                filename, method, preserve_unnumbered, executor
+            )
+
+    return asyncio.as_completed([process(filename) for filename in filenames])
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Processing of a corpus by workers on several machines.
+
+The coordinator reads the documents and splits their numbered paragraphs
+into tasks of up to `batch_size` paragraphs, which it hands out over TCP to
+any number of workers (`samewords worker HOST:PORT`). When a worker dies or
+stops answering, its task is given to another worker. The processed
+documents are returned in order, and a report of the throughput is
+available when all are done. No other services are needed.
+
+The protocol is newline-delimited JSON. A worker asks for a task with
+`{"next": true}`, optionally with the `results` of its previous task, and
+is answered with the next task or `{"done": true}`. The first message of a
+worker must carry the `token` of the coordinator, which is shared with the
+workers out of band, or the connection is closed with an `error`.
+"""
+
+import collections
+import hmac
+import json
+import multiprocessing
+import secrets
+import socket
+import socketserver
+import threading
+import time
+
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from samewords.cache import ParagraphCache
+from samewords.core import plan_string, run_annotation
+from samewords.document import doc_content
+from samewords.metrics import registry
+from samewords.parallel import DocumentResult
+from samewords.settings import settings
+from samewords.stats import Statistics
+
+
+def parse_address(address: str, default_host: str = "127.0.0.1") -> Tuple[str, int]:
+    """Split `HOST:PORT` (or just `PORT`) into a host and a port number."""
+    host, _, port = address.rpartition(":")
+    return host or default_host, int(port)
+
+
+class _Document:
+    def __init__(self, filename: str, parts: List, stats: Statistics) -> None:
+        self.filename = filename
+        self.parts = parts
+        self.stats = stats
+        self.remaining = 0
+        self.seconds = 0.0
+
+
+class _Task:
+    def __init__(self, task_id: int, document: int, items: List[Tuple[int, str]]):
+        self.id = task_id
+        self.document = document
+        self.items = items  # The index of each paragraph in the parts and its text.
+        self.attempts = 0
+        self.done = False
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        coordinator = self.server.coordinator
+        self.request.settimeout(coordinator.task_timeout)
+        task = None
+        authorized = False
+        try:
+            for line in self.rfile:
+                message = json.loads(line.decode("utf-8"))
+                if not authorized:
+                    if not coordinator.authorize(message):
+                        reply = {"error": "The token was not accepted."}
+                        self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+                        return
+                    authorized = True
+                    with coordinator._condition:
+                        coordinator.workers += 1
+                if not isinstance(message, dict):
+                    # A broken worker. Its task is handed out again.
+                    return
+                if task is not None and ("results" in message or "error" in message):
+                    coordinator.complete(task, message)
+                elif task is not None:
+                    # The worker asks again without finishing its task.
+                    coordinator.retry(task)
+                task = coordinator.next_task()
+                if task is None:
+                    reply = {"done": True}
+                else:
+                    reply = {
+                        "task": task.id,
+                        "method": coordinator.method,
+                        "settings": coordinator.task_settings,
+                        "paragraphs": [par for _, par in task.items],
+                    }
+                self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+                self.wfile.flush()
+                if task is None:
+                    return
+        except (OSError, ValueError):
+            # The worker died or stopped answering.
+            pass
+        finally:
+            if task is not None and not task.done:
+                coordinator.retry(task)
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class Coordinator:
+    """
+    Hand out the numbered paragraphs of `filenames` to workers connecting to
+    `host` and `port` (0 picks a free port). A task is given to another
+    worker when its worker disconnects or has not answered within
+    `task_timeout` seconds, at most `max_attempts` times. Workers must
+    present the `token`, which is generated if not given.
+
+    Attributes:
+        self.workers: The number of worker connections so far.
+        self.retries: The number of tasks that were handed out again.
+        self.paragraphs: The number of paragraphs processed by the workers.
+    """
+
+    def __init__(
+        self,
+        filenames: List[str],
+        method: str = "annotate",
+        host: str = "127.0.0.1",
+        port: int = 0,
+        batch_size: int = 32,
+        task_timeout: float = 300.0,
+        max_attempts: int = 3,
+        preserve_unnumbered: bool = False,
+        cache: ParagraphCache = None,
+        token: str = None,
+    ) -> None:
+        self.filenames = filenames
+        self.method = method
+        self.batch_size = batch_size
+        self.task_timeout = task_timeout
+        self.max_attempts = max_attempts
+        self.preserve_unnumbered = preserve_unnumbered
+        self.cache = cache
+        self.token = token or secrets.token_hex(16)
+        self.task_settings = dict(settings)
+        self.workers = 0
+        self.retries = 0
+        self.paragraphs = 0
+        self.error: Optional[Exception] = None
+        self._documents: Dict[int, _Document] = {}
+        self._pending: Deque[_Task] = collections.deque()
+        self._planned = 0
+        # The number of documents being read and planned.
+        self._reading = 0
+        self._tasks = 0
+        self._condition = threading.Condition()
+        self._start = None
+        self._elapsed = None
+        self._server = _Server((host, port), _Handler)
+        self._server.coordinator = self
+        self.address = self._server.server_address
+
+    def start(self) -> None:
+        """Accept workers in a background thread."""
+        self._start = time.perf_counter()
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "Coordinator":
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def authorize(self, message: Dict) -> bool:
+        """Determine whether the first message of a worker carries the
+        token."""
+        token = message.get("token") if isinstance(message, dict) else None
+        if not isinstance(token, str):
+            return False
+        return hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8"))
+
+    def _claim(self) -> int:
+        """Take the next document to be planned. Must be called with the
+        condition held."""
+        index = self._planned
+        self._planned += 1
+        self._reading += 1
+        return index
+
+    def _plan(self, index: int) -> None:
+        """Read the claimed document and queue its paragraphs as tasks. The
+        document is read without holding the condition, so the other workers
+        are served meanwhile."""
+        filename = self.filenames[index]
+        stats = Statistics()
+        try:
+            content = doc_content(filename, self.preserve_unnumbered)
+            parts = plan_string(content, self.method, stats, self.cache)
+        except Exception as e:
+            with self._condition:
+                self.error = e
+                self._reading -= 1
+                self._condition.notify_all()
+            return
+        document = _Document(filename, [par for par, _ in parts], stats)
+        pending = [(i, par) for i, (par, p) in enumerate(parts) if p]
+        with self._condition:
+            for start in range(0, len(pending), self.batch_size):
+                self._tasks += 1
+                items = pending[start : start + self.batch_size]
+                self._pending.append(_Task(self._tasks, index, items))
+                document.remaining += 1
+            self._documents[index] = document
+            self._reading -= 1
+            self._condition.notify_all()
+
+    def _finished(self) -> bool:
+        """Determine whether all tasks are done. Must be called with the
+        condition held."""
+        return (
+            self._planned == len(self.filenames)
+            and self._reading == 0
+            and not self._pending
+            and all(d.remaining == 0 for d in self._documents.values())
+        )
+
+    def next_task(self) -> Optional[_Task]:
+        """Return the next task to hand out, or None when there is no more
+        work. Wait while the remaining tasks are being processed, since they
+        may have to be handed out again."""
+        while True:
+            with self._condition:
+                while not (
+                    self.error is not None
+                    or self._pending
+                    or self._planned < len(self.filenames)
+                    or self._finished()
+                ):
+                    self._condition.wait()
+                if self.error is not None or self._finished():
+                    return None
+                if self._pending:
+                    task = self._pending.popleft()
+                    task.attempts += 1
+                    return task
+                index = self._claim()
+            self._plan(index)
+
+    def complete(self, task: _Task, message: Dict) -> None:
+        results = message.get("results")
+        broken = "error" not in message and not (
+            isinstance(results, list)
+            and len(results) == len(task.items)
+            and all(isinstance(result, str) for result in results)
+        )
+        with self._condition:
+            if task.done:
+                return
+            if broken:
+                # The results do not fit the task, so it is handed out again.
+                self.retry(task)
+                return
+            task.done = True
+            if "error" in message:
+                self.error = ValueError(message["error"])
+                self._condition.notify_all()
+                return
+            document = self._documents[task.document]
+            results = list(zip(task.items, results))
+            for (index, _), result in results:
+                document.parts[index] = result
+            registry.merge(message.get("metrics", {}))
+            document.seconds += message.get("seconds", 0.0)
+            document.remaining -= 1
+            self.paragraphs += len(task.items)
+            self._condition.notify_all()
+        if self.cache is not None:
+            for (_, par), result in results:
+                self.cache.put(par, self.method, result)
+
+    def retry(self, task: _Task) -> None:
+        with self._condition:
+            if task.attempts >= self.max_attempts:
+                self.error = RuntimeError(
+                    "A task of {} failed {} times.".format(
+                        self._documents[task.document].filename, task.attempts
+                    )
+                )
+            else:
+                self.retries += 1
+                self._pending.appendleft(task)
+            self._condition.notify_all()
+
+    def results(self) -> Iterator[DocumentResult]:
+        """Yield the processed documents in the order of `filenames` as they
+        are done. Raise the error of the run if there was one."""
+        for index in range(len(self.filenames)):
+            while True:
+                with self._condition:
+                    while (
+                        self.error is None
+                        and index < self._planned
+                        and not (
+                            index in self._documents
+                            and self._documents[index].remaining == 0
+                        )
+                    ):
+                        self._condition.wait()
+                    if self.error is not None:
+                        raise self.error
+                    if index < self._planned:
+                        document = self._documents.pop(index)
+                        break
+                    self._claim()
+                # Documents without work for the workers are read here.
+                self._plan(index)
+            yield DocumentResult(
+                document.filename,
+                "".join(document.parts),
+                document.stats,
+                document.seconds,
+            )
+        self._elapsed = time.perf_counter() - self._start
+
+    def report(self) -> str:
+        elapsed = self._elapsed or time.perf_counter() - self._start
+        return (
+            "Processed {} documents with {} paragraphs in {:.3f}s "
+            "({:.1f} paragraphs/s) using {} worker connections; "
+            "{} tasks were retried.".format(
+                len(self.filenames),
+                self.paragraphs,
+                elapsed,
+                self.paragraphs / elapsed if elapsed else 0.0,
+                self.workers,
+                self.retries,
+            )
+        )
+
+
+def run_worker(
+    address: Tuple[str, int], token: str, connect_timeout: float = 30.0
+) -> int:
+    """Process tasks from the coordinator at `address`, which is given the
+    `token`, until it has no more work. Keep trying to connect for
+    `connect_timeout` seconds. Return the number of processed tasks."""
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            sock = socket.create_connection(address)
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+    tasks = 0
+    with sock, sock.makefile("rwb") as stream:
+        message = {"next": True, "token": token}
+        while True:
+            stream.write(json.dumps(message).encode("utf-8") + b"\n")
+            stream.flush()
+            line = stream.readline()
+            if not line:
+                return tasks
+            task = json.loads(line.decode("utf-8"))
+            if "error" in task:
+                raise ConnectionError("The coordinator refused: " + task["error"])
+            if task.get("done"):
+                return tasks
+            settings.update(task["settings"])
+            start = time.perf_counter()
+            message = {"next": True}
+            try:
+                message["results"] = [
+                    run_annotation(par, task["method"]) for par in task["paragraphs"]
+                ]
+            except Exception as e:
+                message["results"] = []
+                message["error"] = str(e)
+            message["seconds"] = time.perf_counter() - start
+            message["metrics"] = registry.drain()
+            tasks += 1
+
+
+def run_workers(address: Tuple[str, int], token: str, processes: int = 1) -> None:
+    """Run `processes` workers in separate processes and wait for them."""
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(address, token))
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
@@ -8,22 +8,116 @@ of a reledmac-encoded LaTeX file and serve up content from each paragraph
 between `\\beginnumbering` and `\\endnumbering` for sameword processing.
 """
 
+import mmap
+import os
 import regex
 import unicodedata
 
-from typing import List
+from bisect import bisect_right
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Tuple, Union
 
+_begin_pattern = regex.compile(r"\\beginnumbering\n")
+_end_pattern = regex.compile(r"\n\\endnumbering")
+_pstart_pattern = regex.compile(r"\\pstart")
+_autopar_pattern = regex.compile(r"\\autopar")
+_blank_pattern = regex.compile("\n\n")
+# The same patterns for matching in bytes-like objects.
+_byte_patterns = {
+    pattern: regex.compile(pattern.pattern.encode("ascii"))
+    for pattern in [
+        _begin_pattern,
+        _end_pattern,
+        _pstart_pattern,
+        _autopar_pattern,
+        _blank_pattern,
+    ]
+}
 
-def doc_content(filename: str) -> str:
-    """Return the content of file."""
+
+def _typed(pattern, content):
+    """Return the version of the compiled pattern that matches the type of
+    the content."""
+    if isinstance(content, str):
+        return pattern
+    return _byte_patterns[pattern]
+
+
+def read_content(filename: str) -> str:
+    """Return the content of file as it is."""
 
     with open(filename, mode="r", encoding="utf-8") as f:
         try:
-            return unicodedata.normalize("NFC", f.read())
+            return f.read()
         except UnicodeDecodeError as e:
             raise ValueError("The input file must be in utf-8 unicode encoding.") from e
 
 
+def is_nfc(text: str) -> bool:
+    """Determine whether the text is already in normalization form C."""
+    try:
+        return unicodedata.is_normalized("NFC", text)
+    except AttributeError:
+        # `is_normalized` is only available from Python 3.8.
+        return unicodedata.normalize("NFC", text) == text
+
+
+def normalize_content(
+    content: str, preserve_unnumbered: bool = False
+) -> Tuple[str, bool]:
+    """Return the content in normalization form C and whether the
+    normalization changed anything. Only the numbered sections that are not
+    already normalized are converted. If `preserve_unnumbered` is true, the
+    text outside the numbered sections is left as it is."""
+
+    if is_nfc(content):
+        return content, False
+    parts = []
+    for i, (start, end) in enumerate(doc_spans(content)):
+        chunk = content[start:end]
+        # Only unequal indices contain numbered reledmac paragraphs
+        if (i % 2 or not preserve_unnumbered) and not is_nfc(chunk):
+            chunk = unicodedata.normalize("NFC", chunk)
+        parts.append(chunk)
+    normalized = "".join(parts)
+    return normalized, normalized != content
+
+
+def doc_content(filename: str, preserve_unnumbered: bool = False) -> str:
+    """Return the content of file in normalization form C. See
+    `normalize_content`."""
+
+    content, _ = normalize_content(read_content(filename), preserve_unnumbered)
+    return content
+
+
+def doc_spans(content: Union[str, bytes, mmap.mmap]) -> List[Tuple[int, int]]:
+    """
+    Split document into a list of (start, end) offsets of its chunks. All
+    unequal numbered indices are numbered text.
+
+    :param content: The content of the document as a string or a bytes-like
+    object, such as a memory-mapped file.
+    """
+    starts = _typed(_begin_pattern, content).finditer(content)
+    ends = _typed(_end_pattern, content).finditer(content)
+    spans = []
+    for start, end in zip(starts, ends):
+        # Add the span between previous numbered section (or document start)
+        # and the next numbered section.
+        spans.append((spans[-1][1] if spans else 0, start.start()))
+        # Now, add the span of the numbered section
+        spans.append((start.start(), end.end()))
+    if not spans and _typed(_begin_pattern, content).search(content):
+        raise ValueError(
+            r"Your document did not contain one or both of "
+            r"\beginnumbering and \endnumbering"
+        )
+    # Add the tail from last numbered to end
+    spans.append((spans[-1][1] if spans else 0, len(content)))
+    return spans
+
+
 def chunk_doc(content: str) -> List[str]:
     """
     Split document into a list of chunks. All unequal numbered indices are
@@ -31,34 +125,35 @@ def chunk_doc(content: str) -> List[str]:
 
     :param content: The content of the document as a string.
     """
-    starts = regex.finditer(r"\\beginnumbering\n", content)
-    ends = regex.finditer(r"\n\\endnumbering", content)
-    if "\\beginnumbering\n" in content:
-        indices = []
-        for start, end in zip(starts, ends):
-            if not indices:
-                # Setup the indices with the slice before first numbered text
-                indices.append([0, start.span()[0]])
-            else:
-                # Add the indices between previous numbered section and next
-                indices.append([indices[-1][-1], start.span()[0]])
-            # Now, add the indices of the numbered section
-            indices.append([start.span()[0], end.span()[1]])
-        # Add the tail from last numbered to end
-        try:
-            indices.append([indices[-1][-1], len(content) + 1])
-        except IndexError:
-            raise ValueError(
-                r"Your document did not contain one or both of "
-                r"\beginnumbering and \endnumbering"
-            )
+    return [content[start:end] for start, end in doc_spans(content)]
 
-        # Chunk the text according to the indices
-        chunked = [content[start:end] for start, end in indices]
 
+def par_spans(
+    content: Union[str, bytes, mmap.mmap], start: int = 0, end: int = None
+) -> List[Tuple[int, int]]:
+    """Given the content and the span of a numbered section as returned by
+    `doc_spans`, return the list of (start, end) offsets of its paragraphs.
+    See `chunk_pars`. Raise a ValueError if the section has no paragraphs."""
+    if end is None:
+        end = len(content)
+    if _typed(_autopar_pattern, content).search(content, start, end):
+        pattern = _typed(_blank_pattern, content)
     else:
-        chunked = [content]
-    return chunked
+        pattern = _typed(_pstart_pattern, content)
+    positions = [idx.start() for idx in pattern.finditer(content, start, end)]
+    if not positions:
+        raise ValueError(
+            r"Your document contains a numbered section without any "
+            r"paragraphs (\pstart, or blank lines with \autopar)"
+        )
+
+    spans = [(start, positions[0])]
+    for index, par in enumerate(positions):
+        try:
+            spans.append((par, positions[index + 1]))
+        except IndexError:
+            spans.append((par, end))
+    return spans
 
 
 def chunk_pars(content):
@@ -70,18 +165,140 @@ def chunk_pars(content):
     documentation). The use of `\\autopar` assumes that the `\\autopar` command
     is given right after the `\\beginnumbering` as in the documentation.
     """
+    return [content[start:end] for start, end in par_spans(content)]
 
-    if content.find(r"\autopar") is not -1:
-        positions = [idx.start() for idx in regex.finditer("\n\n", content)]
-    else:
-        positions = [idx.start() for idx in regex.finditer(r"\\pstart", content)]
 
-    paragraphs = []
-    paragraphs.append(content[: positions[0]])
-    for index, par in enumerate(positions):
-        try:
-            paragraphs.append(content[par : positions[index + 1]])
-        except IndexError:
-            paragraphs.append(content[par:])
+@contextmanager
+def doc_mapped(filename: str) -> Iterator[Union[bytes, mmap.mmap]]:
+    """Map the file into memory and provide its raw content as a bytes-like
+    object that can be passed to `doc_spans` and `par_spans`. Only the
+    pages that are actually read are loaded from disk."""
+
+    with open(filename, mode="rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files cannot be mapped.
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            yield content
+
+
+def decode_span(content: Union[bytes, mmap.mmap], start: int, end: int) -> str:
+    """Decode and normalize a span of the raw content like `doc_content`."""
+    try:
+        text = content[start:end].decode("utf-8")
+    except UnicodeDecodeError as e:
+        raise ValueError("The input file must be in utf-8 unicode encoding.") from e
+    if is_nfc(text):
+        return text
+    return unicodedata.normalize("NFC", text)
+
+
+class LineIndex:
+    """The offsets where the lines of a text start. It is built once, so the
+    line of an offset is found by bisection instead of counting the
+    newlines before it."""
+
+    def __init__(self, content: Union[str, bytes]) -> None:
+        newline = "\n" if isinstance(content, str) else b"\n"
+        self.starts = [0]
+        pos = content.find(newline)
+        while pos != -1:
+            self.starts.append(pos + 1)
+            pos = content.find(newline, pos + 1)
+
+    def line(self, offset: int) -> int:
+        """Return the line number (counted from 1) of the offset."""
+        return bisect_right(self.starts, offset)
+
+
+def iter_chunks(lines: Iterable[str]) -> Iterator[Tuple[bool, str]]:
+    """Incrementally split the text given as an iterable of strings (e.g. the
+    lines of a file) and yield tuples of a boolean indicating whether the
+    chunk is numbered text and the chunk itself.
 
-    return paragraphs
+    Each numbered chunk is a paragraph equal to those returned by
+    `chunk_pars` from the numbered sections of `chunk_doc`. Unnumbered text
+    is passed on as soon as it is read, so it may be split into several
+    chunks, but always right after a line break. Only the current paragraph
+    is kept in memory.
+
+    As `chunk_pars`, this assumes that a numbered section uses `\\autopar`
+    before its first `\\pstart`, if it uses `\\autopar` at all.
+    """
+    buffer = ""
+    numbered = False
+    par_pattern = None  # The boundary of paragraphs in the current section.
+    par_pos = 0  # Where to look for the next paragraph boundary.
+    scanned = 0  # How much of the buffer has been searched for the section end.
+    for text in lines:
+        buffer += text
+        while True:
+            if not numbered:
+                begin = _begin_pattern.search(buffer)
+                if begin:
+                    if begin.start():
+                        yield False, buffer[: begin.start()]
+                    buffer = buffer[begin.start() :]
+                    numbered = True
+                    par_pattern = None
+                    par_pos = scanned = 0
+                    continue
+                # Keep what may be the start of a `\\beginnumbering`.
+                cut = buffer.rfind("\n", 0, len(buffer) - 15) + 1
+                if cut:
+                    yield False, buffer[:cut]
+                    buffer = buffer[cut:]
+                break
+
+            end = _end_pattern.search(buffer, scanned)
+            if par_pattern is None:
+                pstart = _pstart_pattern.search(buffer)
+                autopar = _autopar_pattern.search(buffer)
+                if autopar and (not pstart or autopar.start() < pstart.start()):
+                    par_pattern = _blank_pattern
+                elif pstart:
+                    par_pattern = _pstart_pattern
+                elif not end:
+                    scanned = max(0, len(buffer) - 13)
+                    break
+            par = par_pattern.search(buffer, par_pos) if par_pattern else None
+            if par and (not end or par.start() < end.start()):
+                yield True, buffer[: par.start()]
+                buffer = buffer[par.start() :]
+                par_pos = par.end() - par.start()
+                scanned = 0
+                continue
+            if end:
+                yield True, buffer[: end.end()]
+                buffer = buffer[end.end() :]
+                numbered = False
+                continue
+            # Keep searching from where a boundary may still begin.
+            scanned = max(0, len(buffer) - 13)
+            par_pos = max(par_pos, len(buffer) - 6)
+            break
+
+    if numbered:
+        raise ValueError(
+            r"Your document did not contain one or both of "
+            r"\beginnumbering and \endnumbering"
+        )
+    if buffer:
+        yield False, buffer
+
+
+def doc_stream(
+    filename: str, preserve_unnumbered: bool = False
+) -> Iterator[Tuple[bool, str]]:
+    """Yield the chunks of the file as `iter_chunks`, with each chunk
+    normalized like `doc_content`."""
+
+    with open(filename, mode="r", encoding="utf-8") as f:
+        try:
+            for numbered, chunk in iter_chunks(f):
+                if (numbered or not preserve_unnumbered) and not is_nfc(chunk):
+                    chunk = unicodedata.normalize("NFC", chunk)
+                yield numbered, chunk
+        except UnicodeDecodeError as e:
+            raise ValueError("The input file must be in utf-8 unicode encoding.") from e
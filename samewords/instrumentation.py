@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Counters of the operations in the hot paths of tokenization and matching.
+
+The counters are disabled by default. The code counting an operation checks
+`enabled` first, so a disabled counter costs a single attribute lookup:
+
+    if instrumentation.enabled:
+        instrumentation.count("words_created")
+
+Enable the counters with `counting`. The counters are:
+
+    tokenizers: `Tokenizer` instances, including those for lemmas.
+    regex_compilations: Patterns compiled while processing.
+    bracket_scans, bracket_chars: `Brackets` scans and characters scanned.
+    increment_after_calls, increment_after_elements: Calls of
+    `Word._increment_after` and the elements they touched.
+    find_index_calls: Searches of `Matcher._find_index`, including the
+    searches started again after a partial match.
+    find_index_depth: The most searches started again in a single call.
+    context_windows: Contexts built around an apparatus entry.
+    words_created, macros_created, elements_created: `Word`, `Macro` and
+    `Element` objects created.
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator
+
+enabled = False
+counts = Counter()
+# The counters that hold the highest value instead of a sum.
+_maxima = set()
+
+
+def count(name: str, value: int = 1) -> None:
+    counts[name] += value
+
+
+def maximum(name: str, value: int) -> None:
+    """Keep the highest of the values given for the name."""
+    _maxima.add(name)
+    if value > counts[name]:
+        counts[name] = value
+
+
+def merge(target: Counter, source: Counter) -> None:
+    """Add the counts of `source` to `target`."""
+    for name, value in source.items():
+        if name in _maxima:
+            target[name] = max(target[name], value)
+        else:
+            target[name] += value
+
+
+@contextmanager
+def counting() -> Iterator[Counter]:
+    """Enable the counters while the context lasts. Yield the Counter of the
+    counts made in the context, which are added to the outer counts when it
+    ends."""
+    global enabled, counts
+    was_enabled, outer = enabled, counts
+    enabled, counts = True, Counter()
+    try:
+        yield counts
+    finally:
+        inner = counts
+        enabled, counts = was_enabled, outer
+        merge(outer, inner)
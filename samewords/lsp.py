@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A language server for editors, speaking the Language Server Protocol over
+stdin and stdout.
+
+The server keeps a copy of each open `.tex` buffer, which the editor updates
+with incremental change notifications. The boundaries of the numbered
+paragraphs are adjusted with each change, and the buffer is only split again
+when a change touches the markers that define them (`\\beginnumbering`,
+`\\endnumbering`, `\\pstart`, `\\autopar` or a blank line). Formatting the
+buffer processes the paragraphs that have changed since they were last
+processed and returns the minimal text edits that add, update or remove the
+`\\sameword` annotations.
+
+The processing method (`annotate`, `update` or `clean`) given to `serve` can
+be changed in the `initializationOptions` of the client with `method`, and
+the settings can be extended with `config` like a configuration file.
+"""
+
+import difflib
+import json
+import regex
+import sys
+
+from bisect import bisect_right
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from samewords.cache import MemoryCache
+from samewords.core import needs_processing, run_annotation
+from samewords.document import _autopar_pattern, _begin_pattern, _blank_pattern
+from samewords.document import _end_pattern, _pstart_pattern, doc_spans, par_spans
+from samewords.settings import apply_config
+
+# The patterns that determine the boundaries of the numbered paragraphs.
+_boundary_patterns = [
+    _begin_pattern,
+    _end_pattern,
+    _pstart_pattern,
+    _autopar_pattern,
+    _blank_pattern,
+]
+# Changes are checked for boundary markers this far around them.
+_window = max(len(p.pattern) for p in _boundary_patterns)
+# Tokens compared when computing the edits of a processed paragraph.
+_diff_tokens = regex.compile(r"\\[A-Za-z@]+|\\.|\w+|\s+|.", regex.S)
+
+Edit = Tuple[int, int, str]  # The start and end offset and the new text.
+
+
+def text_edits(old: str, new: str, offset: int = 0) -> List[Edit]:
+    """Return the edits that turn `old` into `new`, with offsets counted from
+    `offset`. The texts are compared by LaTeX tokens, so each added or
+    removed annotation gives a single edit."""
+    a = _diff_tokens.findall(old)
+    b = _diff_tokens.findall(new)
+    positions = [offset]
+    for token in a:
+        positions.append(positions[-1] + len(token))
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    return [
+        (positions[i1], positions[i2], "".join(b[j1:j2]))
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes()
+        if tag != "equal"
+    ]
+
+
+def _utf16_length(text: str) -> int:
+    return len(text) + sum(1 for c in text if ord(c) > 0xFFFF)
+
+
+class Buffer:
+    """
+    The text of an open document with its line starts and the spans of its
+    chunks, both kept up to date with each change.
+
+    Attributes:
+        self.spans: [start, end, numbered] of each chunk. The numbered chunks
+        are the paragraphs of the numbered sections.
+        self.error: The error found when splitting the text, if any.
+        self.splits: The number of times the whole text has been split.
+    """
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.lines = [0] + [m.end() for m in regex.finditer("\n", text)]
+        self.spans: List[List] = []
+        self.error: Optional[str] = None
+        self.splits = 0
+        self.split()
+
+    def split(self) -> None:
+        """Split the whole text into its chunks."""
+        self.splits += 1
+        self.error = None
+        self.spans = []
+        try:
+            for i, (start, end) in enumerate(doc_spans(self.text)):
+                # Only unequal indices contain numbered reledmac paragraphs
+                if i % 2 == 0:
+                    self.spans.append([start, end, False])
+                else:
+                    self.spans += [
+                        [s, e, True] for s, e in par_spans(self.text, start, end)
+                    ]
+        except ValueError as e:
+            # Nothing is processed until the structure is fixed.
+            self.error = str(e)
+            self.spans = [[0, len(self.text), False]]
+
+    def offset(self, position: Dict) -> int:
+        """Convert an LSP position (line and UTF-16 character) to an offset."""
+        if position["line"] >= len(self.lines):
+            return len(self.text)
+        start = self.lines[position["line"]]
+        units = position["character"]
+        offset = start
+        while units > 0 and offset < len(self.text) and self.text[offset] != "\n":
+            units -= 2 if ord(self.text[offset]) > 0xFFFF else 1
+            offset += 1
+        return offset
+
+    def position(self, offset: int) -> Dict:
+        line = bisect_right(self.lines, offset) - 1
+        character = _utf16_length(self.text[self.lines[line] : offset])
+        return {"line": line, "character": character}
+
+    def change(self, start: int, end: int, new: str) -> None:
+        """Replace the text between the offsets with `new`."""
+        old_text = self.text
+        self.text = old_text[:start] + new + old_text[end:]
+        delta = len(new) - (end - start)
+
+        first = bisect_right(self.lines, start)
+        last = bisect_right(self.lines, end)
+        added = [start + m.end() for m in regex.finditer("\n", new)]
+        self.lines[first:] = added + [pos + delta for pos in self.lines[last:]]
+
+        if self._touches_boundary(old_text, start, end) or self._touches_boundary(
+            self.text, start, start + len(new)
+        ):
+            self.split()
+            return
+        index = bisect_right([span[0] for span in self.spans], start) - 1
+        if start == end and index > 0 and start == self.spans[index][0]:
+            # Text inserted at a boundary belongs to the preceding chunk.
+            index -= 1
+        if end > self.spans[index][1]:
+            self.split()
+            return
+        self.spans[index][1] += delta
+        for span in self.spans[index + 1 :]:
+            span[0] += delta
+            span[1] += delta
+
+    @staticmethod
+    def _touches_boundary(text: str, start: int, end: int) -> bool:
+        """Determine whether a boundary marker overlaps or adjoins the text
+        between the offsets."""
+        window_start = max(0, start - _window)
+        window_end = min(len(text), end + _window)
+        for pattern in _boundary_patterns:
+            for match in pattern.finditer(
+                text, window_start, window_end, overlapped=True
+            ):
+                if match.start() <= end and match.end() >= start:
+                    return True
+        return False
+
+    def paragraphs(self) -> List[Tuple[int, int]]:
+        return [(start, end) for start, end, numbered in self.spans if numbered]
+
+
+class LanguageServer:
+    """
+    Handle the LSP messages read from `reader` and write the responses and
+    notifications to `writer`.
+
+    Attributes:
+        self.buffers: The open documents by their URI.
+        self.cache: The processed paragraphs of all open documents.
+    """
+
+    def __init__(
+        self, reader: BinaryIO, writer: BinaryIO, method: str = "annotate"
+    ) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.method = method
+        self.buffers: Dict[str, Buffer] = {}
+        self.cache = MemoryCache()
+        self.stopped = False
+        self.handlers = {
+            "initialize": self.initialize,
+            "shutdown": self.shutdown,
+            "textDocument/didOpen": self.did_open,
+            "textDocument/didChange": self.did_change,
+            "textDocument/didClose": self.did_close,
+            "textDocument/formatting": self.formatting,
+        }
+
+    def read_message(self) -> Optional[Dict]:
+        length = None
+        while True:
+            line = self.reader.readline()
+            if not line:
+                return None
+            line = line.strip()
+            if not line:
+                break
+            name, _, value = line.decode("ascii").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        if length is None:
+            return None
+        return json.loads(self.reader.read(length).decode("utf-8"))
+
+    def send(self, message: Dict) -> None:
+        message["jsonrpc"] = "2.0"
+        body = json.dumps(message).encode("utf-8")
+        self.writer.write(b"Content-Length: %d\r\n\r\n%s" % (len(body), body))
+        self.writer.flush()
+
+    def run(self) -> int:
+        """Handle messages until the client exits. Return the exit code."""
+        while True:
+            message = self.read_message()
+            if message is None:
+                return 1
+            if message.get("method") == "exit":
+                return 0 if self.stopped else 1
+            self.handle(message)
+
+    def handle(self, message: Dict) -> None:
+        params = message.get("params") or {}
+        handler = self.handlers.get(message.get("method"))
+        if "id" not in message:
+            # Notifications without a handler are ignored. Errors cannot be
+            # answered, so they are reported on stderr.
+            try:
+                if handler is not None:
+                    handler(params)
+            except Exception as e:
+                print("samewords: {}".format(e), file=sys.stderr)
+            return
+        if handler is None:
+            self.send(
+                {
+                    "id": message["id"],
+                    "error": {"code": -32601, "message": "Method not found"},
+                }
+            )
+            return
+        try:
+            result = handler(params)
+        except Exception as e:
+            self.send(
+                {"id": message["id"], "error": {"code": -32603, "message": str(e)}}
+            )
+            return
+        self.send({"id": message["id"], "result": result})
+
+    def initialize(self, params: Dict) -> Dict:
+        options = params.get("initializationOptions") or {}
+        self.method = options.get("method", self.method)
+        if "config" in options:
+            apply_config(options["config"])
+        return {
+            "capabilities": {
+                # Incremental text document synchronization.
+                "textDocumentSync": {"openClose": True, "change": 2},
+                "documentFormattingProvider": True,
+            },
+            "serverInfo": {"name": "samewords"},
+        }
+
+    def shutdown(self, params: Dict) -> None:
+        self.stopped = True
+
+    def did_open(self, params: Dict) -> None:
+        document = params["textDocument"]
+        self.buffers[document["uri"]] = Buffer(document["text"])
+
+    def did_change(self, params: Dict) -> None:
+        uri = params["textDocument"]["uri"]
+        for change in params["contentChanges"]:
+            if "range" not in change:
+                # The client sent the whole text.
+                self.buffers[uri] = Buffer(change["text"])
+                continue
+            buffer = self.buffers[uri]
+            start = buffer.offset(change["range"]["start"])
+            end = buffer.offset(change["range"]["end"])
+            buffer.change(start, end, change["text"])
+
+    def did_close(self, params: Dict) -> None:
+        del self.buffers[params["textDocument"]["uri"]]
+        self.prune()
+
+    def formatting(self, params: Dict) -> List[Dict]:
+        uri = params["textDocument"]["uri"]
+        buffer = self.buffers[uri]
+        edits, diagnostics = [], []
+        if buffer.error:
+            diagnostics.append(self._diagnostic(buffer, 0, 0, buffer.error))
+        for start, end in buffer.paragraphs():
+            par = buffer.text[start:end]
+            if not needs_processing(par, self.method):
+                continue
+            result = self.cache.get(par, self.method)
+            if result is None:
+                try:
+                    result = run_annotation(par, self.method)
+                except Exception as e:
+                    diagnostics.append(self._diagnostic(buffer, start, end, str(e)))
+                    continue
+                self.cache.put(par, self.method, result)
+            if result != par:
+                edits += text_edits(par, result, start)
+        self.prune()
+        self.send(
+            {
+                "method": "textDocument/publishDiagnostics",
+                "params": {"uri": uri, "diagnostics": diagnostics},
+            }
+        )
+        return [
+            {
+                "range": {"start": buffer.position(s), "end": buffer.position(e)},
+                "newText": new,
+            }
+            for s, e, new in edits
+        ]
+
+    def prune(self) -> None:
+        """Remove the cached paragraphs that are not in an open document,
+        such as the earlier versions of edited paragraphs."""
+        self.cache.prune(
+            buffer.text[start:end]
+            for buffer in self.buffers.values()
+            for start, end in buffer.paragraphs()
+        )
+
+    @staticmethod
+    def _diagnostic(buffer: Buffer, start: int, end: int, message: str) -> Dict:
+        return {
+            "range": {"start": buffer.position(start), "end": buffer.position(end)},
+            "severity": 1,
+            "source": "samewords",
+            "message": message,
+        }
+
+
+def serve(reader: BinaryIO, writer: BinaryIO, method: str = "annotate") -> int:
+    """Run the language server on the streams (usually stdin and stdout)
+    until the client exits. Return the exit code."""
+    return LanguageServer(reader, writer, method).run()
@@ -4,17 +4,24 @@ from warnings import warn
 from samewords.tokenize import (
     Words,
     Registry,
+    RegistryEntry,
     Word,
     Tokenizer,
     Macro,
     Element,
     LatexSyntaxError,
 )
+from samewords import instrumentation
 from samewords.brackets import Brackets
+from samewords.metrics import ENTRIES, ENTRIES_ANNOTATED
 from samewords.settings import settings
+from samewords.stats import phase
 from samewords.test import temp_settings
 
-from typing import List, Tuple, Union
+from typing import Dict, List, Tuple, Union
+
+# A `\sameword` macro and its optional level argument.
+_sameword_pattern = regex.compile(r"(\\sameword)([^{]+)?")
 
 
 class Matcher:
@@ -23,9 +30,16 @@ class Matcher:
     with samewords.
     """
 
-    def __init__(self, words: Words, registry: Registry) -> None:
+    def __init__(
+        self, words: Words, registry: Registry, offsets: List[int] = None
+    ) -> None:
+        """
+        :param offsets: The offset of each word in the input, if known. It
+        is given to the observers of the phase of each registry entry.
+        """
         self.words = words
         self.registry = registry
+        self.offsets = offsets
 
     def annotate(self, registry: Registry = None) -> Words:
         """
@@ -35,110 +49,120 @@ class Matcher:
         if not registry:
             registry = self.registry
 
+        ENTRIES.inc(len(registry))
         for entry in registry:
-            # Get data points for phrase and its start and end
-            edtext_start = entry["data"][0]
-            edtext_end = entry["data"][1] + 1
-            edtext_lvl = entry["lvl"] + 1  # Reledmac 1-indexes the levels.
-            edtext = self.words[edtext_start:edtext_end]
+            offset = self.offsets[entry["data"][0]] if self.offsets else None
+            with phase("entry", level=entry["lvl"] + 1, offset=offset) as meta:
+                self._annotate_entry(entry, meta)
+        return self.words
+
+    def _annotate_entry(self, entry: RegistryEntry, meta: Dict) -> None:
+        """Annotate a single registry entry. The lemma and the size of the
+        context are added to the `meta` of its phase."""
+        # Get data points for phrase and its start and end
+        edtext_start = entry["data"][0]
+        edtext_end = entry["data"][1] + 1
+        edtext_lvl = entry["lvl"] + 1  # Reledmac 1-indexes the levels.
+        edtext = self.words[edtext_start:edtext_end]
 
-            # Identify search words and ellipsis
-            search_ws, ellipsis = self._define_search_words(edtext)
+        # Identify search words and ellipsis
+        search_ws, ellipsis = self._define_search_words(edtext)
 
+        if ellipsis:
+            # If we have a lemma note with ellipsis, we need to establish
+            # context for both ellipsis elements (which may be nested
+            # inside the edtext).
+            ell_sidx = edtext.index(search_ws[0], default=0) + edtext_start
+            ell_eidx = edtext.rindex(search_ws[1], default=0) + edtext_start
+
+            el1_ctxt = self._get_contexts(self.words, ell_sidx)
+            el2_ctxt = self._get_contexts(self.words, ell_eidx)
+            contexts = el1_ctxt + el2_ctxt
+        else:
+            # Establish the context
+            ctxt_before = self._get_context_before(self.words, edtext_start)
+            ctxt_after = self._get_context_after(self.words, edtext_end)
+            contexts = [w.get_text() for w in ctxt_before] + [
+                w.get_text() for w in ctxt_after
+            ]
+        meta["lemma"] = search_ws
+        meta["context"] = len(contexts)
+
+        # Is there a match in either context?
+        if search_ws and self._in_context(contexts, search_ws, ellipsis):
+            ENTRIES_ANNOTATED.inc()
+
+            # Annotate the edtext
+            # -------------------
             if ellipsis:
-                # If we have a lemma note with ellipsis, we need to establish
-                # context for both ellipsis elements (which may be nested
-                # inside the edtext).
-                ell_sidx = edtext.index(search_ws[0], default=0) + edtext_start
-                ell_eidx = edtext.rindex(search_ws[1], default=0) + edtext_start
-
-                el1_ctxt = self._get_contexts(self.words, ell_sidx)
-                el2_ctxt = self._get_contexts(self.words, ell_eidx)
-                contexts = el1_ctxt + el2_ctxt
+                sidx = edtext.index(search_ws[0], default=0)
+                eidx = edtext.rindex(search_ws[1], default=0)
+                if self._in_context(el1_ctxt, search_ws[0:1], ellipsis):
+                    self._add_sameword(edtext[sidx : sidx + 1], edtext_lvl)
+                if self._in_context(el2_ctxt, search_ws[-1:], ellipsis):
+                    self._add_sameword(edtext[eidx : eidx + 1], edtext_lvl)
             else:
-                # Establish the context
-                ctxt_before = self._get_context_before(self.words, edtext_start)
-                ctxt_after = self._get_context_after(self.words, edtext_end)
-                contexts = [w.get_text() for w in ctxt_before] + [
-                    w.get_text() for w in ctxt_after
-                ]
-
-            # Is there a match in either context?
-            if search_ws and self._in_context(contexts, search_ws, ellipsis):
-
-                # Annotate the edtext
-                # -------------------
+                try:
+                    with temp_settings({"sensitive_context_match": False}):
+                        sidx, eidx = self._find_index(edtext, search_ws)
+                except TypeError:
+                    raise ValueError(
+                        "Looks like edtext and lemma content "
+                        "don't match in "
+                        "'{}'".format(edtext.write())
+                    )
+
+                self._process_annotation(edtext, sidx, eidx, edtext_lvl)
+
+            # Annotate the lemma if relevant
+            # ------------------
+            if r"\lemma" in edtext[-1].ann_apps[-1].cont:
+                # get the relevant app Element
+                app_note = edtext[-1].ann_apps[-1]
+                # split up the apparatus note into before, lem, after
+                s, e = self._find_lemma_pos(app_note)
                 if ellipsis:
-                    sidx = edtext.index(search_ws[0], default=0)
-                    eidx = edtext.rindex(search_ws[1], default=0)
+                    # Tokenize the lemma words and ellipsis
+                    # Annotate the lemma word where the context matches
+                    # We want to annotate words even though they may not
+                    # be first or last index in tokenized text. So we get
+                    #  the indexes of those (list comp `idxs`) and then
+                    # use those to index into the tokenized list in
+                    # replacing.
+                    lemma = self._find_ellipsis_words(app_note.cont[s:e])
+                    idxs = [i for i, w in enumerate(lemma) if w.content]
                     if self._in_context(el1_ctxt, search_ws[0:1], ellipsis):
-                        self._add_sameword(edtext[sidx : sidx + 1], edtext_lvl)
+                        lemma[idxs[0]] = self._add_sameword(
+                            lemma[idxs[0] : idxs[0] + 1], level=0
+                        )[0]
                     if self._in_context(el2_ctxt, search_ws[-1:], ellipsis):
-                        self._add_sameword(edtext[eidx : eidx + 1], edtext_lvl)
-                else:
-                    try:
-                        with temp_settings({"sensitive_context_match": False}):
-                            sidx, eidx = self._find_index(edtext, search_ws)
-                    except TypeError:
-                        raise ValueError(
-                            "Looks like edtext and lemma content "
-                            "don't match in "
-                            "'{}'".format(edtext.write())
-                        )
-
-                    self._process_annotation(edtext, sidx, eidx, edtext_lvl)
-
-                # Annotate the lemma if relevant
-                # ------------------
-                if r"\lemma" in edtext[-1].ann_apps[-1].cont:
-                    # get the relevant app Element
-                    app_note = edtext[-1].ann_apps[-1]
-                    # split up the apparatus note into before, lem, after
-                    s, e = self._find_lemma_pos(app_note)
-                    if ellipsis:
-                        # Tokenize the lemma words and ellipsis
-                        # Annotate the lemma word where the context matches
-                        # We want to annotate words even though they may not
-                        # be first or last index in tokenized text. So we get
-                        #  the indexes of those (list comp `idxs`) and then
-                        # use those to index into the tokenized list in
-                        # replacing.
-                        lemma = self._find_ellipsis_words(app_note.cont[s:e])
-                        idxs = [i for i, w in enumerate(lemma) if w.content]
-                        if self._in_context(el1_ctxt, search_ws[0:1], ellipsis):
-                            lemma[idxs[0]] = self._add_sameword(
-                                lemma[idxs[0] : idxs[0] + 1], level=0
-                            )[0]
-                        if self._in_context(el2_ctxt, search_ws[-1:], ellipsis):
-                            lemma[idxs[-1]] = self._add_sameword(
-                                lemma[idxs[-1] : idxs[-1] + 1], level=0
-                            )[0]
-
-                    else:
-                        lemma = Tokenizer(app_note.cont[s:e]).wordlist
-                        lemma = self._process_annotation(lemma, 0, len(lemma), 0)
+                        lemma[idxs[-1]] = self._add_sameword(
+                            lemma[idxs[-1] : idxs[-1] + 1], level=0
+                        )[0]
 
-                    # patch app note up again with new lemma content
-                    bef = app_note.cont[:s]
-                    after = app_note.cont[e:]
-                    new = bef + lemma.write() + after
-                    # update the app note Element with the new content
-                    edtext[-1].update_element(app_note, new)
-
-                # Then annotate the contexts
-                # ------------------------------
-                if ellipsis:
-                    for pos, word in zip([ell_sidx, ell_eidx], search_ws):
-                        ctxt = self._get_context_before(
-                            self.words, pos
-                        ) + self._get_context_after(self.words, pos + 1)
-                        if self._in_context(ctxt, [word], ellipsis):
-                            self._annotate_context(ctxt, [word])
                 else:
-                    for ctxt in [ctxt_before, ctxt_after]:
-                        self._annotate_context(ctxt, search_ws)
-
-        return self.words
+                    lemma = Tokenizer(app_note.cont[s:e]).wordlist
+                    lemma = self._process_annotation(lemma, 0, len(lemma), 0)
+
+                # patch app note up again with new lemma content
+                bef = app_note.cont[:s]
+                after = app_note.cont[e:]
+                new = bef + lemma.write() + after
+                # update the app note Element with the new content
+                edtext[-1].update_element(app_note, new)
+
+            # Then annotate the contexts
+            # ------------------------------
+            if ellipsis:
+                for pos, word in zip([ell_sidx, ell_eidx], search_ws):
+                    ctxt = self._get_context_before(
+                        self.words, pos
+                    ) + self._get_context_after(self.words, pos + 1)
+                    if self._in_context(ctxt, [word], ellipsis):
+                        self._annotate_context(ctxt, [word])
+            else:
+                for ctxt in [ctxt_before, ctxt_after]:
+                    self._annotate_context(ctxt, search_ws)
 
     def update(self) -> Words:
         """
@@ -194,21 +218,18 @@ class Matcher:
         return wordlist
 
     def validate(self) -> Union[Words, LatexSyntaxError]:
+        # The bracket balance of the words before each index, so the balance
+        # of an entry is found without writing it.
+        balance = [0]
+        for word in self.words:
+            text = word.full()
+            balance.append(balance[-1] + text.count("{") - text.count("}"))
         for entry in self.registry:
-            text = self.words[entry["data"][0] : entry["data"][1] + 1].write()
-            s = 0
-            pos = 0
-            while pos < len(text):
-                c = text[pos]
-                if c == "{":
-                    s += 1
-                elif c == "}":
-                    s -= 1
-                pos += 1
-            if s != 0:
+            start, end = entry["data"][0], entry["data"][1] + 1
+            if balance[end] != balance[start]:
                 raise LatexSyntaxError(
                     "There are unbalanced parentheses in the following "
-                    "string: \n" + text
+                    "string: \n" + self.words[start:end].write()
                 )
         return self
 
@@ -219,6 +240,8 @@ class Matcher:
 
     def _get_context_after(self, complete: Words, boundary: int) -> Words:
         distance = settings["context_distance"]
+        if instrumentation.enabled:
+            instrumentation.count("context_windows")
         start = boundary
         end = start
         count = 0
@@ -231,6 +254,8 @@ class Matcher:
 
     def _get_context_before(self, complete: Words, boundary: int) -> Words:
         distance = settings["context_distance"]
+        if instrumentation.enabled:
+            instrumentation.count("context_windows")
         end = boundary
         start = end
         count = 0
@@ -326,7 +351,7 @@ class Matcher:
         # Is the phrase wrapped in a \sameword{}?
         sw_wrap = None
         lvl_match = None
-        pat = regex.compile(r"(\\sameword)([^{]+)?")
+        pat = _sameword_pattern
         sw_idxs = [
             i for i, val in enumerate(word.macros) if regex.search(pat, val.full())
         ]
@@ -424,42 +449,41 @@ class Matcher:
         self, context: Union[List[str], Words], searches: List, start: int = 0
     ) -> Union[Tuple[int, int], bool]:
         """Return the position of the start and end of a match of
-        search_words list in context. If no match is made, return -1 in both
-        tuple values.
+        search_words list in context. If no match is made, return False.
 
         Procedure: If the first word of the searches is matched, start from
         that. While there are items in the search word list, see if the next
         item (that has content) in the context matches the next item in the
-        search words list. """
+        search words list. If not, search again from the word that did not
+        match. """
         context = self._apply_sensitivity(context)
         searches = self._apply_sensitivity(searches)
-
-        if searches[0] not in context[start:]:
-            return False
-
-        context_start = context[start:].index(searches[0]) + start
-        ctxt_index = context_start
-        search_index = 0
-
-        if ctxt_index is not -1:
+        restarts = 0
+        while True:
+            if instrumentation.enabled:
+                instrumentation.count("find_index_calls")
+                instrumentation.maximum("find_index_depth", restarts)
+            try:
+                context_start = context.index(searches[0], start)
+            except ValueError:
+                return False
+            ctxt_index = context_start
+            search_index = 0
             while len(searches) > search_index:
-                try:
-                    # We only match non-empty Word objects. This makes it
-                    # match across non-text macros.
-                    if context[ctxt_index]:
-                        if context[ctxt_index] == searches[search_index]:
-                            search_index += 1
-                        else:
-                            return self._find_index(context, searches, start=ctxt_index)
-                    ctxt_index += 1
-
-                except IndexError:
-                    # If there is an index error in the context lookup,
-                    # the list has ended, so there is not full match.
+                if ctxt_index >= len(context):
+                    # The context has ended, so there is no full match.
                     return False
-
-            return context_start, ctxt_index
-        return False
+                # We only match non-empty Word objects. This makes it
+                # match across non-text macros.
+                if context[ctxt_index]:
+                    if context[ctxt_index] != searches[search_index]:
+                        break
+                    search_index += 1
+                ctxt_index += 1
+            else:
+                return context_start, ctxt_index
+            start = ctxt_index
+            restarts += 1
 
     def _find_lemma_pos(self, app_note: Element) -> Tuple[int, int]:
         """Given an apparatus note Element return the start and end index of
@@ -480,6 +504,8 @@ class Matcher:
         If there is no ellipsis pattern, return an empty Words list. """
         settings_pat = "|".join([pat for pat in settings["ellipsis_patterns"]])
         ellipsis_pat = regex.compile("(" + settings_pat + ")")
+        if instrumentation.enabled:
+            instrumentation.count("regex_compilations")
         ellipsis_search = regex.search(ellipsis_pat, input_string)
         if ellipsis_search:
             spos = ellipsis_search.span()[0]
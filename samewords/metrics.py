@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Operational metrics of a samewords process.
+
+The metrics are collected in a registry of counters and histograms that can
+be exported in the OpenMetrics text format (which Prometheus also reads),
+either written to a file or served over HTTP on localhost. The counts made
+in worker processes are sent back to the parent with the results (see
+`Registry.drain` and `Registry.merge`).
+"""
+
+import os
+import threading
+
+from typing import TYPE_CHECKING, Dict, List, Sequence, Tuple
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, v) for k, v in labels) + "}"
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self) -> List[str]:
+        return [
+            "{}_total{} {}".format(self.name, _format_labels(key), value)
+            for key, value in sorted(self.values.items())
+        ]
+
+    def drain(self) -> Dict:
+        with self._lock:
+            values, self.values = self.values, {}
+        return {"values": list(values.items())}
+
+    def reset(self) -> None:
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def merge(self, data: Dict) -> None:
+        with self._lock:
+            for key, value in data["values"]:
+                key = tuple(tuple(pair) for pair in key)
+                self.values[key] = self.values.get(key, 0) + value
+
+
+class Histogram:
+    """The distribution of observed values (e.g. durations in seconds)."""
+
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.count += 1
+            self.sum += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(self.name, bound, cumulative))
+        lines.append('{}_bucket{{le="+Inf"}} {}'.format(self.name, self.count))
+        lines.append("{}_sum {}".format(self.name, self.sum))
+        lines.append("{}_count {}".format(self.name, self.count))
+        return lines
+
+    def drain(self) -> Dict:
+        with self._lock:
+            data = {"counts": self.counts, "count": self.count, "sum": self.sum}
+            self.counts = [0] * len(self.buckets)
+            self.count = 0
+            self.sum = 0.0
+        return data
+
+    def reset(self) -> None:
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def merge(self, data: Dict) -> None:
+        with self._lock:
+            self.counts = [a + b for a, b in zip(self.counts, data["counts"])]
+            self.count += data["count"]
+            self.sum += data["sum"]
+
+
+class Registry:
+    """A collection of metrics that can be exported together."""
+
+    def __init__(self) -> None:
+        self.metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter(name, documentation))
+
+    def histogram(
+        self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def _register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError("The metric {} already exists.".format(metric.name))
+        self.metrics[metric.name] = metric
+        return metric
+
+    def exposition(self) -> str:
+        """Return all metrics in the OpenMetrics text format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+            lines.append("# HELP {} {}".format(metric.name, metric.documentation))
+            lines += metric.samples()
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write(self, filename: str) -> None:
+        with open(filename, mode="w") as f:
+            f.write(self.exposition())
+
+    def drain(self) -> Dict:
+        """Return the values of all metrics and reset them. Used to send the
+        counts of a worker process to its parent."""
+        return {name: metric.drain() for name, metric in self.metrics.items()}
+
+    def merge(self, data: Dict) -> None:
+        """Add values returned by `drain` of another registry."""
+        for name, values in data.items():
+            self.metrics[name].merge(values)
+
+    def reset(self) -> None:
+        """Forget the values of all metrics without waiting for their locks,
+        which another thread may have held when the process was forked."""
+        for metric in self.metrics.values():
+            metric.reset()
+
+
+registry = Registry()
+# A forked worker process starts with a copy of the counts of its parent and
+# would send them back with its own on the first `drain`.
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=registry.reset)
+
+PARAGRAPHS = registry.counter(
+    "samewords_paragraphs", "Numbered paragraphs processed, by method."
+)
+CHUNKS_SKIPPED = registry.counter(
+    "samewords_chunks_skipped",
+    "Numbered sections and paragraphs passed on without processing, by kind.",
+)
+WORDS = registry.counter("samewords_words", "Words produced by the tokenizer.")
+ENTRIES = registry.counter(
+    "samewords_registry_entries", "Registry entries compared with their context."
+)
+ENTRIES_ANNOTATED = registry.counter(
+    "samewords_registry_entries_annotated",
+    "Registry entries with a context match that were annotated.",
+)
+TOKENIZE_SECONDS = registry.histogram(
+    "samewords_tokenize_seconds", "Time spent tokenizing each paragraph."
+)
+MATCH_SECONDS = registry.histogram(
+    "samewords_match_seconds",
+    "Time spent cleaning up, matching and annotating each paragraph, without "
+    "writing it.",
+)
+
+
+def serve_metrics(
+    port: int, host: str = "127.0.0.1", metrics: Registry = registry
+) -> "ThreadingHTTPServer":
+    """Serve the metrics on the port in a background thread. Return the
+    server, which can be stopped with `shutdown`."""
+    # The HTTP server is slow to import and only needed here.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            body = self.server.registry.exposition().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args) -> None:
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.registry = metrics
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Processing of documents in a shared pool of worker processes.
+
+Each numbered paragraph of each document is submitted to the pool as a
+separate task, so a single large document does not keep the other workers
+idle while the smaller documents have already been finished. The batches of
+the command line are run by `samewords.pipeline`, which submits the
+paragraphs with the functions of this module.
+
+The paragraphs are normally sent to the workers and back as strings. With
+`SharedDocument`, the document is placed in shared memory instead, and only
+the offsets of the paragraphs and the lengths of the results are sent.
+"""
+
+import time
+
+from concurrent.futures import Executor, Future
+from typing import Callable, Dict, List, NamedTuple, Tuple, Union
+
+from samewords.cache import ParagraphCache
+from samewords.core import MARKERS, plan_string, run_task
+from samewords.document import doc_spans, par_spans
+from samewords.metrics import CHUNKS_SKIPPED, registry
+from samewords.settings import settings
+from samewords.stats import Statistics, count, observing
+from samewords.trace import Tracer
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+# The markers of `needs_processing` for spans of encoded text.
+_markers = {
+    method: [marker.encode("utf-8") for marker in markers]
+    for method, markers in MARKERS.items()
+}
+# The shared memory blocks a worker process has attached to, oldest first.
+_attached: Dict[str, "shared_memory.SharedMemory"] = {}
+
+
+class DocumentResult(NamedTuple):
+    filename: str
+    content: str
+    stats: Statistics
+    seconds: float  # Time spent by the workers on the paragraphs of the file.
+
+
+def submit_string(
+    pool: Executor,
+    content: str,
+    method: str = "annotate",
+    task_settings: Dict = None,
+    stats: Statistics = None,
+    cache: ParagraphCache = None,
+) -> List[Union[str, Tuple[str, Future]]]:
+    """Submit the numbered paragraphs of the content that need processing to
+    the pool. Return the parts of the document, where the text that is
+    already done is a string and the submitted paragraphs are tuples of the
+    paragraph and its future result. See `collect`."""
+    if task_settings is None:
+        task_settings = dict(settings)
+    parts = []
+    for par, pending in plan_string(content, method, stats, cache):
+        if pending:
+            parts.append((par, pool.submit(run_task, par, method, task_settings)))
+        else:
+            parts.append(par)
+    return parts
+
+
+def collect(
+    parts: List[Union[str, Tuple[str, Future]]],
+    method: str = "annotate",
+    cache: ParagraphCache = None,
+    tracer: Tracer = None,
+) -> Tuple[str, float]:
+    """Wait for the results of the parts returned by `submit_string` and
+    return the updated document and the time spent by the workers. The trace
+    events of the tasks are added to the `tracer`, if given."""
+    updated = []
+    seconds = 0.0
+    for part in parts:
+        if isinstance(part, str):
+            updated.append(part)
+        else:
+            par, task = part
+            result, elapsed, metrics, events = task.result()
+            registry.merge(metrics)
+            if tracer is not None:
+                tracer.extend(events)
+            if cache is not None:
+                cache.put(par, method, result)
+            updated.append(result)
+            seconds += elapsed
+    return "".join(updated), seconds
+
+
+def _attach(name: str) -> "shared_memory.SharedMemory":
+    """Return the shared memory block of the name, attaching to it the first
+    time it is used in this worker. Only the latest blocks are kept open."""
+    block = _attached.get(name)
+    if block is None:
+        if len(_attached) >= 8:
+            oldest = next(iter(_attached))
+            _attached.pop(oldest).close()
+        block = _attached[name] = shared_memory.SharedMemory(name)
+    return block
+
+
+def _run_shared(
+    source: str,
+    result: str,
+    span: Tuple[int, int],
+    slot: Tuple[int, int],
+    method: str,
+    task_settings: Dict,
+    trace: Dict = None,
+) -> Tuple[Union[int, bytes], float, Dict, List[Dict]]:
+    """Process the paragraph at `span` of the `source` block in a worker and
+    write the output into `slot` of the `result` block. Return the length of
+    the output, or the output itself if it does not fit in the slot, with
+    the elapsed time, the metrics and the trace events of the task (see
+    `run_task`)."""
+    start = time.perf_counter()
+    par = bytes(_attach(source).buf[span[0] : span[1]]).decode("utf-8")
+    output, _, metrics, events = run_task(par, method, task_settings, trace)
+    output = output.encode("utf-8")
+    if len(output) <= slot[1] - slot[0]:
+        _attach(result).buf[slot[0] : slot[0] + len(output)] = output
+        output = len(output)
+    return output, time.perf_counter() - start, metrics, events
+
+
+class SharedDocument:
+    """
+    A document whose numbered paragraphs are processed in worker processes
+    through shared memory. The encoded document is copied into a `source`
+    block once, and each worker reads its paragraph from there and writes
+    the output into its slot of a `result` block. Call `close` (or use it
+    as a context manager) to release the blocks.
+
+    Attributes:
+        self.parts: The encoded parts of the document that are done and the
+        (span, slot) tuples of the paragraphs to process.
+    """
+
+    def __init__(
+        self,
+        content: str,
+        method: str = "annotate",
+        stats: Statistics = None,
+        cache: ParagraphCache = None,
+    ) -> None:
+        if shared_memory is None:
+            raise RuntimeError("Shared memory requires Python 3.8 or newer.")
+        if stats is None:
+            stats = Statistics()
+        self.method = method
+        self.cache = cache
+        data = content.encode("utf-8")
+        self.parts: List[Union[bytes, Tuple[Tuple[int, int], Tuple[int, int]]]] = []
+        # The index of the section of each paragraph to process.
+        self._sections: List[int] = []
+        self._tasks: List[Future] = []
+        capacity = 0
+        for i, (start, end) in enumerate(doc_spans(data)):
+            # Only unequal indices contain numbered reledmac paragraphs
+            if i % 2 == 0:
+                self.parts.append(data[start:end])
+                continue
+            if not self._needs_processing(data, start, end):
+                CHUNKS_SKIPPED.inc(kind="section")
+                stats.add("sections_skipped")
+                self.parts.append(data[start:end])
+                continue
+            stats.add("sections")
+            for par_start, par_end in par_spans(data, start, end):
+                if not self._needs_processing(data, par_start, par_end):
+                    CHUNKS_SKIPPED.inc(kind="paragraph")
+                    stats.add("paragraphs_skipped")
+                    self.parts.append(data[par_start:par_end])
+                    continue
+                if cache is not None:
+                    par = data[par_start:par_end].decode("utf-8")
+                    cached = cache.get(par, method)
+                    if cached is not None:
+                        stats.add("paragraphs_cached")
+                        if observing():
+                            count("entries_cached", par.count("\\edtext"))
+                        self.parts.append(cached.encode("utf-8"))
+                        continue
+                stats.add("paragraphs")
+                # The annotations make the output longer than the input.
+                size = (par_end - par_start) * 3 // 2 + 256
+                slot = (capacity, capacity + size)
+                capacity += size
+                self.parts.append(((par_start, par_end), slot))
+                self._sections.append(i // 2)
+
+        self.source = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        self.source.buf[: len(data)] = data
+        self.result = shared_memory.SharedMemory(create=True, size=max(capacity, 1))
+
+    def _needs_processing(self, data: bytes, start: int, end: int) -> bool:
+        return any(data.find(m, start, end) != -1 for m in _markers[self.method])
+
+    def submit(
+        self,
+        pool: Executor,
+        task_settings: Dict = None,
+        trace: Dict = None,
+        done: Callable[[int], None] = None,
+    ) -> None:
+        """Submit the paragraphs that need processing to the pool. With
+        `trace`, the tasks are traced with it and the index of their section
+        as the arguments of the paragraph (see `run_task`). `done` is called
+        with the number of `\\edtext`s of each paragraph when its task is
+        done."""
+        if task_settings is None:
+            task_settings = dict(settings)
+        pending = [part for part in self.parts if not isinstance(part, bytes)]
+        for (span, slot), section in zip(pending, self._sections):
+            task = pool.submit(
+                _run_shared,
+                self.source.name,
+                self.result.name,
+                span,
+                slot,
+                self.method,
+                task_settings,
+                None if trace is None else dict(trace, section=section),
+            )
+            if done is not None:
+                entries = bytes(self.source.buf[span[0] : span[1]]).count(b"\\edtext")
+                task.add_done_callback(lambda _, entries=entries: done(entries))
+            self._tasks.append(task)
+
+    def collect(self, tracer: Tracer = None) -> Tuple[str, float]:
+        """Wait for the results of the submitted paragraphs and return the
+        updated document and the time spent by the workers. The trace events
+        of the tasks are added to the `tracer`, if given."""
+        tasks = iter(self._tasks)
+        updated = []
+        seconds = 0.0
+        for part in self.parts:
+            if isinstance(part, bytes):
+                updated.append(part)
+                continue
+            (start, end), slot = part
+            output, elapsed, metrics, events = next(tasks).result()
+            registry.merge(metrics)
+            if tracer is not None:
+                tracer.extend(events)
+            if isinstance(output, int):
+                output = bytes(self.result.buf[slot[0] : slot[0] + output])
+            if self.cache is not None:
+                par = bytes(self.source.buf[start:end]).decode("utf-8")
+                self.cache.put(par, self.method, output.decode("utf-8"))
+            updated.append(output)
+            seconds += elapsed
+        return b"".join(updated).decode("utf-8"), seconds
+
+    def close(self) -> None:
+        if self.source is None:
+            return
+        for task in self._tasks:
+            task.cancel()
+        for block in (self.source, self.result):
+            block.close()
+            block.unlink()
+        self.source = self.result = None
+
+    def __enter__(self) -> "SharedDocument":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
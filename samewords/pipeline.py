@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch processing in three stages connected by bounded queues.
+
+A reader thread reads and chunks the files and submits their numbered
+paragraphs to a pool of worker processes. A writer thread reassembles the
+documents in order and writes them. The reader waits when too many
+paragraphs are being processed or too many documents are waiting to be
+written, so memory use stays bounded when the input is read faster than it
+can be processed. The time each stage spends waiting is recorded in
+`PipelineStats`, which tells whether the pool is too small (the reader
+waits) or larger than needed (the writer waits). A timeline of the stages
+and the workers can be recorded with a `Tracer`, and the paragraphs done by
+the workers advance a `Progress`.
+"""
+
+import os
+import queue
+import threading
+import time
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+
+from samewords.cache import ParagraphCache
+from samewords.core import plan_string, run_task
+from samewords.document import doc_content
+from samewords.parallel import DocumentResult, SharedDocument, collect, shared_memory
+from samewords.progress import Progress
+from samewords.settings import settings
+from samewords.stats import Statistics
+from samewords.trace import Tracer, section_indices
+
+
+class PipelineStats:
+    """
+    Queue depths and stall times of a pipeline run.
+
+    Attributes:
+        self.read_seconds: Time spent reading and chunking the files.
+        self.write_seconds: Time spent writing the files.
+        self.reader_stall: Time the reader waited for a free place in the
+        pool or in the queue of documents to write.
+        self.writer_stall: Time the writer waited for documents and results.
+        self.max_in_flight: The most paragraphs being processed at once.
+        self.depths: The depth of the queue of documents to write, sampled
+        each time a document was added.
+    """
+
+    def __init__(self) -> None:
+        self.documents = 0
+        self.read_seconds = 0.0
+        self.write_seconds = 0.0
+        self.reader_stall = 0.0
+        self.writer_stall = 0.0
+        self.max_in_flight = 0
+        self.depths: List[int] = []
+
+    def as_dict(self) -> Dict:
+        return {
+            "documents": self.documents,
+            "read_seconds": self.read_seconds,
+            "write_seconds": self.write_seconds,
+            "reader_stall": self.reader_stall,
+            "writer_stall": self.writer_stall,
+            "max_in_flight": self.max_in_flight,
+            "max_queue_depth": max(self.depths, default=0),
+            "mean_queue_depth": (
+                sum(self.depths) / len(self.depths) if self.depths else 0.0
+            ),
+        }
+
+    def report(self) -> str:
+        data = self.as_dict()
+        return (
+            "Reading {read_seconds:.3f}s, writing {write_seconds:.3f}s. "
+            "Reader waited {reader_stall:.3f}s, writer waited {writer_stall:.3f}s. "
+            "Queue depth max {max_queue_depth}, mean {mean_queue_depth:.1f}; "
+            "at most {max_in_flight} paragraphs in flight.".format(**data)
+        )
+
+
+class Pipeline:
+    """
+    Process files with `method` in a pool of `processes` workers (default:
+    the number of CPUs). At most `max_in_flight` paragraphs (default: four
+    per worker) are processed at once and at most `queue_size` documents
+    wait to be written. With `shared`, the documents are passed to the
+    workers in shared memory (see `SharedDocument`), and only the queue of
+    documents bounds the work in flight. The reading, writing and the
+    processing of each paragraph are recorded by the `tracer`, if given,
+    and the `progress` is advanced each time a paragraph is done.
+    """
+
+    def __init__(
+        self,
+        method: str = "annotate",
+        processes: int = None,
+        queue_size: int = 4,
+        max_in_flight: int = None,
+        preserve_unnumbered: bool = False,
+        cache: ParagraphCache = None,
+        shared: bool = False,
+        tracer: Tracer = None,
+        progress: Progress = None,
+    ) -> None:
+        self.method = method
+        self.processes = processes or os.cpu_count()
+        self.queue_size = queue_size
+        self.max_in_flight = max_in_flight or 4 * self.processes
+        self.preserve_unnumbered = preserve_unnumbered
+        self.cache = cache
+        self.shared = shared and shared_memory is not None
+        self.stats = PipelineStats()
+        self.tracer = tracer
+        self.progress = progress
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def run(self, jobs: List[Tuple[str, str]]) -> List[DocumentResult]:
+        """Process each (input, output) file of `jobs`. Return the result of
+        each document in order, without its content."""
+        documents = queue.Queue(self.queue_size)
+        results = []
+        errors = []
+        with ProcessPoolExecutor(self.processes) as pool:
+            slots = threading.BoundedSemaphore(self.max_in_flight)
+            reader = threading.Thread(
+                target=self._guard,
+                args=(errors, self._read, pool, jobs, documents, slots),
+            )
+            writer = threading.Thread(
+                target=self._write, args=(errors, documents, results)
+            )
+            reader.start()
+            writer.start()
+            reader.join()
+            if errors:
+                # Let the writer finish when the reader failed.
+                documents.put(None)
+            writer.join()
+        if errors:
+            raise errors[0]
+        return results
+
+    @staticmethod
+    def _guard(errors: List[Exception], target, *args) -> None:
+        try:
+            target(*args)
+        except Exception as e:
+            errors.append(e)
+
+    def _read(
+        self,
+        pool: ProcessPoolExecutor,
+        jobs: List[Tuple[str, str]],
+        documents: queue.Queue,
+        slots: threading.BoundedSemaphore,
+    ) -> None:
+        task_settings = dict(settings)
+        for filename, target in jobs:
+            start = time.perf_counter()
+            stats = Statistics()
+            trace = None if self.tracer is None else {"file": filename}
+            content = doc_content(filename, self.preserve_unnumbered)
+            if self.shared:
+                job = SharedDocument(content, self.method, stats, self.cache)
+                read = time.perf_counter()
+                done = None if self.progress is None else self.progress.advance
+                job.submit(pool, task_settings, trace, done)
+            else:
+                parts = plan_string(content, self.method, stats, self.cache)
+                read = time.perf_counter()
+                sections = iter(section_indices(content, parts) if trace else [])
+                job = [
+                    self._submit(pool, slots, par, task_settings, trace, sections)
+                    if pending
+                    else par
+                    for par, pending in parts
+                ]
+            self.stats.read_seconds += read - start
+            if self.tracer is not None:
+                self.tracer.complete("read", start, read, {"file": filename})
+            queued = time.perf_counter()
+            documents.put((filename, target, job, stats, start))
+            self.stats.reader_stall += time.perf_counter() - queued
+            self.stats.depths.append(documents.qsize())
+        documents.put(None)
+
+    def _submit(
+        self,
+        pool: ProcessPoolExecutor,
+        slots: threading.BoundedSemaphore,
+        par: str,
+        task_settings: Dict,
+        trace: Dict,
+        sections: Iterator[int],
+    ) -> Tuple[str, Future]:
+        if trace is not None:
+            trace = dict(trace, section=next(sections))
+        start = time.perf_counter()
+        slots.acquire()
+        self.stats.reader_stall += time.perf_counter() - start
+        with self._lock:
+            self._in_flight += 1
+            self.stats.max_in_flight = max(self.stats.max_in_flight, self._in_flight)
+        task = pool.submit(run_task, par, self.method, task_settings, trace)
+        task.add_done_callback(lambda _: self._release(slots, par))
+        return par, task
+
+    def _release(self, slots: threading.BoundedSemaphore, par: str) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        slots.release()
+        if self.progress is not None:
+            self.progress.advance(par.count("\\edtext"))
+
+    def _write(
+        self,
+        errors: List[Exception],
+        documents: queue.Queue,
+        results: List[DocumentResult],
+    ) -> None:
+        """Write the documents in order until the reader is done. After an
+        error, the remaining documents are only taken from the queue, so the
+        reader is not blocked."""
+        while True:
+            start = time.perf_counter()
+            item = documents.get()
+            self.stats.writer_stall += time.perf_counter() - start
+            if item is None:
+                return
+            try:
+                if not errors:
+                    results.append(self._write_document(*item))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                if self.shared:
+                    item[2].close()
+
+    def _write_document(
+        self, filename: str, target: str, job, stats: Statistics, read: float
+    ) -> DocumentResult:
+        start = time.perf_counter()
+        if self.shared:
+            content, seconds = job.collect(self.tracer)
+        else:
+            content, seconds = collect(job, self.method, self.cache, self.tracer)
+        self.stats.writer_stall += time.perf_counter() - start
+
+        start = time.perf_counter()
+        os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+        with open(target, mode="w") as f:
+            f.write(content)
+        end = time.perf_counter()
+        self.stats.write_seconds += end - start
+        self.stats.documents += 1
+        if self.tracer is not None:
+            self.tracer.complete("write", start, end, {"file": filename})
+            self.tracer.file_span(filename, read, end)
+        return DocumentResult(filename, "", stats, seconds)
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Profiling of the processing phases with cProfile and tracemalloc.
+
+Each phase (chunking, tokenization, matching, cleanup and writing) gets its
+own profile, so the report of a slow case shows where in the phase the time
+is spent without the other phases getting in the way. The processing can be
+limited to a single numbered section or paragraph to reproduce a slow case.
+
+`MemoryProfiler` records the peak memory allocated by each paragraph and
+phase and the number of objects the tokenization and matching created.
+Before Python 3.9, tracemalloc cannot reset its peak, so the peaks are the
+highest since tracing started.
+
+`SlowLog` logs the registry entries and paragraphs that take longer than a
+threshold with their line in the document.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from samewords import instrumentation
+from samewords.core import needs_processing, run_annotation
+from samewords.document import LineIndex, chunk_doc, chunk_pars, doc_content
+from samewords.stats import PhaseObserver, observe, phase
+
+PROFILED_PHASES = ["chunk", "tokenize", "match", "cleanup", "write"]
+# The instrumentation counts of the objects created by the processing.
+OBJECT_COUNTS = ["words_created", "macros_created", "elements_created"]
+
+
+class PhaseProfiler(PhaseObserver):
+    """
+    Profile each of `phases` separately while observing the processing.
+
+    Attributes:
+        self.profiles: The profile of each phase that has run.
+        self.paragraphs: The number of paragraphs that were processed.
+    """
+
+    def __init__(self, phases: List[str] = None) -> None:
+        self.phases = PROFILED_PHASES if phases is None else phases
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        self.paragraphs = 0
+        self._active = None
+
+    def start(self, name: str, meta: Dict) -> Optional[cProfile.Profile]:
+        if name not in self.phases or self._active is not None:
+            # Only one profile can be enabled at a time.
+            return None
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        self._active = name
+        profile.enable()
+        return profile
+
+    def stop(self, name: str, meta: Dict, token: Optional[cProfile.Profile]) -> None:
+        if token is not None:
+            token.disable()
+            self._active = None
+
+    def summary(self, top: int = 20) -> str:
+        """Return the `top` functions by cumulative time of each phase."""
+        parts = []
+        for name in self.phases:
+            if name not in self.profiles:
+                continue
+            stream = io.StringIO()
+            stats = pstats.Stats(self.profiles[name], stream=stream)
+            stats.strip_dirs().sort_stats("cumulative").print_stats(top)
+            parts.append("== {} ==\n{}".format(name, stream.getvalue().strip("\n")))
+        return "\n\n".join(parts) + "\n"
+
+    def write(self, directory: str, top: int = 20) -> List[str]:
+        """Write the profile of each phase to `<phase>.pstats` and the
+        summary to `summary.txt` in the directory. Return the paths."""
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for name, profile in self.profiles.items():
+            paths.append(os.path.join(directory, name + ".pstats"))
+            profile.dump_stats(paths[-1])
+        paths.append(os.path.join(directory, "summary.txt"))
+        with open(paths[-1], mode="w") as f:
+            f.write(self.summary(top))
+        return paths
+
+
+def profile_document(
+    filename: str,
+    method: str = "annotate",
+    section: int = None,
+    paragraph: int = None,
+    preserve_unnumbered: bool = False,
+) -> PhaseProfiler:
+    """Process the numbered paragraphs of the document with a profile of each
+    phase. The result is not kept. The sections and paragraphs are counted
+    from 0. With `section`, only the paragraphs of that numbered section are
+    processed. With `paragraph`, only that paragraph is processed; it is
+    counted within the section if one is given, otherwise within the whole
+    document."""
+    profiler = PhaseProfiler()
+    content = doc_content(filename, preserve_unnumbered)
+    with observe(profiler):
+        with phase("chunk"):
+            sections = chunk_doc(content)[1::2]
+            if section is not None:
+                if not 0 <= section < len(sections):
+                    raise ValueError(
+                        "The document has no numbered section {}.".format(section)
+                    )
+                sections = [sections[section]]
+            pars = [par for chunk in sections for par in chunk_pars(chunk)]
+        if paragraph is not None:
+            if not 0 <= paragraph < len(pars):
+                raise ValueError(
+                    "The document has no numbered paragraph {}.".format(paragraph)
+                )
+            pars = [pars[paragraph]]
+        for par in pars:
+            if needs_processing(par, method):
+                run_annotation(par, method)
+                profiler.paragraphs += 1
+    return profiler
+
+
+@contextmanager
+def tracing() -> Iterator[None]:
+    """Trace the memory allocations while the context lasts, unless they are
+    traced already."""
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        yield
+    finally:
+        if started:
+            tracemalloc.stop()
+
+
+class MemoryProfiler(PhaseObserver):
+    """
+    Record the peak memory allocated in each phase and paragraph while
+    observing the processing. The allocations must be traced (see `tracing`)
+    and the objects are only counted while the instrumentation is enabled.
+
+    Attributes:
+        self.paragraphs: A record of each processed paragraph with its
+        length, the start of its text, the peak allocation of the paragraph
+        and of each of its phases in bytes and the number of objects created.
+        self.phases: The highest peak allocation of each phase.
+        self.peak: The highest traced memory in bytes.
+    """
+
+    def __init__(self) -> None:
+        self.paragraphs: List[Dict] = []
+        self.phases: Dict[str, int] = {}
+        self.peak = 0
+        self._frames: List[List] = []  # [name, start, peak] of active phases.
+        self._current: Optional[Dict] = None
+
+    def _fold(self) -> int:
+        """Add the peak since the last reset to the active phases and reset
+        it. Return the current traced memory."""
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak)
+        for frame in self._frames:
+            frame[2] = max(frame[2], peak)
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        return current
+
+    def start(self, name: str, meta: Dict) -> None:
+        current = self._fold()
+        self._frames.append([name, current, current])
+        if name == "paragraph":
+            text = meta.get("text", "")
+            self._current = {
+                "index": len(self.paragraphs),
+                "length": len(text),
+                "text": " ".join(text.split())[:60],
+                "phases": {},
+                "objects": instrumentation.counts.copy(),
+            }
+
+    def stop(self, name: str, meta: Dict, token: Any) -> None:
+        self._fold()
+        name, start, peak = self._frames.pop()
+        allocated = peak - start
+        self.phases[name] = max(self.phases.get(name, 0), allocated)
+        if self._current is None:
+            return
+        if name == "paragraph":
+            record = self._current
+            record["peak"] = allocated
+            created = instrumentation.counts.copy()
+            created.subtract(record["objects"])
+            record["objects"] = {key: created[key] for key in OBJECT_COUNTS}
+            self.paragraphs.append(record)
+            self._current = None
+        else:
+            phases = self._current["phases"]
+            phases[name] = max(phases.get(name, 0), allocated)
+
+    def report(self, top: int = 10) -> Dict:
+        """Return the peaks, the total number of objects created and the
+        records of all paragraphs and of the `top` largest by allocation."""
+        objects = {
+            key: sum(record["objects"][key] for record in self.paragraphs)
+            for key in OBJECT_COUNTS
+        }
+        largest = sorted(self.paragraphs, key=lambda r: r["peak"], reverse=True)
+        return {
+            "peak": self.peak,
+            "phases": self.phases,
+            "objects": objects,
+            "largest": largest[:top],
+            "paragraphs": self.paragraphs,
+        }
+
+
+class SlowLog(PhaseObserver):
+    """
+    Record the registry entries and paragraphs whose processing takes at
+    least `threshold` seconds while observing the processing. Each record is
+    passed to `report`, if given, as soon as it is made.
+
+    The line of a record is found in a `LineIndex` of the document, which is
+    built when the document phase starts. The paragraphs are located in the
+    document in order, and the entries by their offset in the paragraph.
+
+    Attributes:
+        self.records: The kind (`entry` or `paragraph`), line, time in
+        seconds and details of each slow entry and paragraph.
+    """
+
+    def __init__(self, threshold: float, report: Callable[[Dict], None] = None) -> None:
+        self.threshold = threshold
+        self.report = report
+        self.records: List[Dict] = []
+        self._text: Optional[str] = None
+        self._lines: Optional[LineIndex] = None
+        self._cursor = 0  # Where to look for the next paragraph.
+        self._paragraph: Optional[int] = None  # Offset of the paragraph.
+
+    def start(self, name: str, meta: Dict) -> Optional[float]:
+        if name == "document":
+            self._text = meta["text"]
+            self._lines = LineIndex(self._text)
+            self._cursor = 0
+        elif name == "paragraph":
+            self._paragraph = self._locate(meta.get("text", ""))
+        if name in ["entry", "paragraph"]:
+            return time.perf_counter()
+        return None
+
+    def _locate(self, text: str) -> Optional[int]:
+        if self._text is None:
+            return None
+        offset = self._text.find(text, self._cursor)
+        if offset == -1:
+            return None
+        self._cursor = offset + len(text)
+        return offset
+
+    def stop(self, name: str, meta: Dict, token: Optional[float]) -> None:
+        if name == "document":
+            self._text = self._lines = None
+        if token is None:
+            return
+        seconds = time.perf_counter() - token
+        if seconds < self.threshold:
+            return
+        offset = self._paragraph
+        record = {"kind": name, "line": None, "seconds": seconds}
+        if name == "entry":
+            record["lemma"] = " ".join(meta.get("lemma") or [])
+            record["context"] = meta.get("context")
+            record["level"] = meta["level"]
+            if offset is not None and meta.get("offset") is not None:
+                offset += meta["offset"]
+            else:
+                offset = None
+        else:
+            record["length"] = len(meta.get("text", ""))
+        if offset is not None and self._lines is not None:
+            record["line"] = self._lines.line(offset)
+        self.records.append(record)
+        if self.report is not None:
+            self.report(record)
+
+    @staticmethod
+    def format(record: Dict) -> str:
+        where = "" if record["line"] is None else " at line {}".format(record["line"])
+        if record["kind"] == "entry":
+            details = "lemma '{}', level {}, context of {} words".format(
+                record["lemma"], record["level"], record["context"]
+            )
+        else:
+            details = "{} characters".format(record["length"])
+        return "Slow {}{} ({}): {:.1f} ms".format(
+            record["kind"], where, details, record["seconds"] * 1000
+        )
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Progress of long runs with an estimate of the time left.
+
+The numbered paragraphs that need processing and their registry entries
+(`\\edtext`s) are counted by a cheap prescan of the input files before the
+run. While observing the processing, `Progress` advances each time a
+paragraph is done, and the paragraphs taken from the cache are subtracted
+from the work left. The worker processes of a batch report the paragraphs
+they finish through `advance`.
+
+The estimate is based on the registry entries, which dominate the time of
+matching, and on the throughput of the last few seconds. The progress is
+shown on a single updated line of a terminal or written as JSON lines (see
+`Progress.lines`) for logs that are read by programs.
+"""
+
+import json
+import sys
+import threading
+import time
+
+from collections import deque
+from typing import Deque, Dict, Optional, TextIO, Tuple
+
+from samewords.core import MARKERS
+from samewords.document import doc_mapped, doc_spans, par_spans
+from samewords.stats import PhaseObserver
+
+# The throughput is measured over this many seconds.
+WINDOW = 5.0
+
+
+def _count(data: bytes, marker: bytes, start: int, end: int) -> int:
+    """Count the occurrences of the marker in the span of the data, which may
+    be memory mapped."""
+    found = 0
+    pos = data.find(marker, start, end)
+    while pos != -1:
+        found += 1
+        pos = data.find(marker, pos + len(marker), end)
+    return found
+
+
+def prescan(content: bytes, method: str = "annotate") -> Tuple[int, int]:
+    """Return the number of numbered paragraphs of the raw content that need
+    processing with the method and the number of registry entries in
+    them."""
+    paragraphs, entries = 0, 0
+    markers = [marker.encode("utf-8") for marker in MARKERS[method]]
+    for i, (start, end) in enumerate(doc_spans(content)):
+        # Only unequal indices contain numbered reledmac paragraphs
+        if i % 2 == 0:
+            continue
+        for par_start, par_end in par_spans(content, start, end):
+            if any(content.find(m, par_start, par_end) != -1 for m in markers):
+                paragraphs += 1
+                entries += _count(content, b"\\edtext", par_start, par_end)
+    return paragraphs, entries
+
+
+def prescan_file(filename: str, method: str = "annotate") -> Tuple[int, int]:
+    """Prescan the file (see `prescan`) without reading it into memory."""
+    with doc_mapped(filename) as content:
+        return prescan(content, method)
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return "{}:{:02}:{:02}".format(hours, minutes, seconds)
+    return "{}:{:02}".format(minutes, seconds)
+
+
+class Progress(PhaseObserver):
+    """
+    The progress of processing `paragraphs` paragraphs with `entries`
+    registry entries, reported to the `stream` at most every `interval`
+    seconds. With `lines`, each report is a JSON object on its own line,
+    otherwise the report replaces the previous one on the line of a
+    terminal. The final report is made when all paragraphs are done or the
+    run is finished. Updates may come from several threads.
+
+    Attributes:
+        self.paragraphs, self.entries: The number of paragraphs and entries
+        to process.
+        self.done_paragraphs, self.done_entries: How many are done.
+    """
+
+    def __init__(
+        self,
+        paragraphs: int = 0,
+        entries: int = 0,
+        stream: TextIO = None,
+        lines: bool = False,
+        interval: float = None,
+        clock=time.perf_counter,
+    ) -> None:
+        self.paragraphs = paragraphs
+        self.entries = entries
+        self.done_paragraphs = 0
+        self.done_entries = 0
+        self.stream = sys.stderr if stream is None else stream
+        self.lines = lines
+        self.interval = (1.0 if lines else 0.1) if interval is None else interval
+        self._clock = clock
+        self._start = clock()
+        self._reported: Optional[float] = None
+        self._finished = False
+        # (time, paragraphs done, entries done) of the last `WINDOW` seconds.
+        self._samples: Deque[Tuple[float, int, int]] = deque([(self._start, 0, 0)])
+        self._lock = threading.Lock()
+
+    def add_total(self, paragraphs: int, entries: int) -> None:
+        with self._lock:
+            self.paragraphs += paragraphs
+            self.entries += entries
+
+    def advance(self, entries: int) -> None:
+        """Count a paragraph with the number of entries as done."""
+        with self._lock:
+            self.done_paragraphs += 1
+            self.done_entries += entries
+            now = self._clock()
+            self._samples.append((now, self.done_paragraphs, self.done_entries))
+            while len(self._samples) > 2 and self._samples[1][0] <= now - WINDOW:
+                self._samples.popleft()
+            if self.done_paragraphs >= self.paragraphs:
+                self._finish()
+            else:
+                self._report(now)
+
+    def skip(self, entries: int) -> None:
+        """Remove a paragraph found in the cache from the work."""
+        with self._lock:
+            self.paragraphs -= 1
+            self.entries -= entries
+            self._complete()
+
+    def stop(self, name: str, meta: Dict, token: None) -> None:
+        if name == "paragraph":
+            self.advance(meta.get("text", "").count("\\edtext"))
+
+    def add(self, name: str, value: int = 1) -> None:
+        if name == "entries_cached":
+            self.skip(value)
+
+    def snapshot(self) -> Dict:
+        """Return the progress, the recent throughput per second and the
+        estimated seconds left (None while unknown). The work is measured in
+        entries, or in paragraphs if there are none (e.g. when cleaning)."""
+        now = self._clock()
+        first, last = self._samples[0], self._samples[-1]
+        seconds = last[0] - first[0]
+        rates = [(b - a) / seconds if seconds else 0.0 for a, b in zip(first, last)]
+        unit = 2 if self.entries else 1
+        done = [self.done_paragraphs, self.done_entries][unit - 1]
+        total = [self.paragraphs, self.entries][unit - 1]
+        if done >= total:
+            eta: Optional[float] = 0.0
+        elif rates[unit] > 0:
+            eta = (total - done) / rates[unit]
+        else:
+            eta = None
+        return {
+            "paragraphs": self.done_paragraphs,
+            "paragraphs_total": self.paragraphs,
+            "entries": self.done_entries,
+            "entries_total": self.entries,
+            "percent": round(100 * min(done / total, 1.0), 1) if total else 100.0,
+            "elapsed": round(now - self._start, 3),
+            "paragraphs_per_second": round(rates[1], 1),
+            "entries_per_second": round(rates[2], 1),
+            "eta": None if eta is None else round(eta, 1),
+        }
+
+    def format(self) -> str:
+        data = self.snapshot()
+        if data["entries_total"]:
+            rate = "{:.0f} entries/s".format(data["entries_per_second"])
+        else:
+            rate = "{:.1f} paragraphs/s".format(data["paragraphs_per_second"])
+        return (
+            "{percent:5.1f}%  {paragraphs}/{paragraphs_total} paragraphs  "
+            "{entries}/{entries_total} entries  {rate}  ETA {eta}".format(
+                **dict(data, rate=rate, eta=format_duration(data["eta"]))
+            )
+        )
+
+    def _report(self, now: float) -> None:
+        if self._finished:
+            return
+        if self._reported is not None and now - self._reported < self.interval:
+            return
+        self._reported = now
+        if self.lines:
+            self.stream.write(json.dumps(self.snapshot()) + "\n")
+        else:
+            # Return to the start of the line and clear the previous report.
+            self.stream.write("\r" + self.format() + "\x1b[K")
+        self.stream.flush()
+
+    def _complete(self) -> None:
+        if self.done_paragraphs >= self.paragraphs:
+            self._finish()
+
+    def _finish(self) -> None:
+        if self._finished:
+            return
+        self._reported = None
+        self._report(self._clock())
+        self._finished = True
+        if not self.lines:
+            self.stream.write("\n")
+            self.stream.flush()
+
+    def finish(self) -> None:
+        """Report the final progress unless it has been reported."""
+        with self._lock:
+            self._finish()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A persistent samewords process listening on a local Unix socket.
+
+Starting Python, importing the package and preparing the worker processes
+takes longer than processing a small document. The server pays that once
+and then processes requests from any number of clients with a warm pool of
+worker processes.
+
+The protocol is JSON-RPC 2.0 with one JSON object per line. The methods
+`annotate`, `update` and `clean` take the document in `string`, and
+optionally `settings` replacing the settings of the server or `config`
+extending them like a configuration file. The result is an object with the
+`content` and the `stats` of the run. The method `shutdown` stops the
+server.
+
+Only the user running the server can use it: the socket can only be opened
+by its owner, and connections from processes of other users are refused
+where the platform tells who is connecting. The client does not send its
+requests to a socket owned by another user.
+"""
+
+import copy
+import json
+import os
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+
+from typing import Any, Dict, Optional
+
+from samewords.settings import apply_config, settings
+from samewords.stats import Statistics
+
+SOCKET_PATH = os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR", tempfile.gettempdir()),
+    "samewords-{}.sock".format(os.getuid() if hasattr(os, "getuid") else "user"),
+)
+METHODS = ["annotate", "update", "clean"]
+
+
+class RemoteError(ValueError):
+    """Raised when the server could not process a request."""
+
+    pass
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = self.server.dispatch(line)
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+            if response.get("result") == "shutdown":
+                threading.Thread(target=self.server.shutdown).start()
+                return
+
+
+def _peer_uid(sock: socket.socket) -> Optional[int]:
+    """Return the user id of the process at the other end of the Unix socket,
+    or None if the platform does not tell."""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    size = struct.calcsize("3i")
+    _, uid, _ = struct.unpack(
+        "3i", sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, size)
+    )
+    return uid
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve requests on the Unix socket at `path` using a pool of
+    `processes` workers (default: the number of CPUs)."""
+
+    daemon_threads = True
+
+    def __init__(self, path: str = SOCKET_PATH, processes: int = None) -> None:
+        if os.path.exists(path):
+            if is_running(path):
+                raise RuntimeError("A server is already running at " + path)
+            # Remove the socket left behind by a server that was stopped.
+            os.remove(path)
+        # The pool is only imported by the server, not by its clients.
+        from concurrent.futures import ProcessPoolExecutor
+        from samewords.core import run_task
+
+        self.path = path
+        processes = processes or os.cpu_count()
+        self.pool = ProcessPoolExecutor(processes)
+        # Start the workers now, so the first request does not wait for them.
+        # The metrics of the warm-up tasks are discarded with their results.
+        warm_up = [
+            self.pool.submit(run_task, "", "annotate", settings)
+            for _ in range(processes)
+        ]
+        for task in warm_up:
+            task.result()
+        super().__init__(path, _Handler)
+
+    def server_bind(self) -> None:
+        # Create the socket without access for others, even for a moment.
+        umask = os.umask(0o077)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, 0o600)
+
+    def verify_request(self, request: socket.socket, client_address: Any) -> bool:
+        """Only accept connections from processes of the user running the
+        server."""
+        uid = _peer_uid(request)
+        return uid is None or uid == os.getuid()
+
+    def dispatch(self, line: bytes) -> Dict:
+        """Run the JSON-RPC request and return the response."""
+        try:
+            request = json.loads(line.decode("utf-8"))
+        except ValueError:
+            return _error(None, -32700, "Parse error")
+        request_id = request.get("id")
+        method = request.get("method")
+        params = request.get("params", {})
+        if method == "shutdown":
+            return {"jsonrpc": "2.0", "id": request_id, "result": "shutdown"}
+        if method not in METHODS:
+            return _error(request_id, -32601, "Method not found")
+        if not isinstance(params, dict) or not isinstance(params.get("string"), str):
+            return _error(request_id, -32602, "Give the document in a string")
+        try:
+            result = self.process(method, params)
+        except Exception as e:
+            return _error(request_id, -32000, str(e))
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+    def process(self, method: str, params: Dict) -> Dict:
+        from samewords.parallel import collect, submit_string
+
+        if "settings" in params:
+            task_settings = params["settings"]
+        else:
+            task_settings = apply_config(
+                params.get("config", {}), copy.deepcopy(settings)
+            )
+        stats = Statistics()
+        parts = submit_string(self.pool, params["string"], method, task_settings, stats)
+        content, _ = collect(parts, method)
+        return {"content": content, "stats": stats.as_dict()}
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.pool.shutdown()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _error(request_id: Any, code: int, message: str) -> Dict:
+    return {
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "error": {"code": code, "message": message},
+    }
+
+
+def serve(path: str = SOCKET_PATH, processes: int = None) -> None:
+    """Run the server until it receives a `shutdown` request or is
+    interrupted."""
+    server = Server(path, processes)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def call(
+    method: str, params: Dict = None, path: str = SOCKET_PATH, timeout: float = None
+) -> Any:
+    """Send a request to the server and return its result. Raise
+    `ConnectionError` or `FileNotFoundError` if no server of the user is
+    running, and `RemoteError` if the request failed."""
+    if os.stat(path).st_uid != os.getuid():
+        raise ConnectionError("The socket {} belongs to another user.".format(path))
+    request = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params or {}}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("The server closed the connection.")
+    response = json.loads(line.decode("utf-8"))
+    if "error" in response:
+        raise RemoteError(response["error"]["message"])
+    return response["result"]
+
+
+def is_running(path: str = SOCKET_PATH) -> bool:
+    """Determine whether a server accepts connections at the path."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            return False
+    return True
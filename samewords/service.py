@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP service for processing documents, built on asyncio without any
+dependencies outside the standard library.
+
+POST the document to `/annotate`, `/update` or `/clean`, either as the raw
+UTF-8 text or as a JSON object with the document in `string` and optionally
+a `config` extending the settings like a configuration file. The processed
+document is sent back when all its paragraphs are done, so a paragraph that
+fails gives `400 Bad Request` instead of a truncated document.
+
+The numbered paragraphs of concurrent requests are collected into batches
+that are processed in a pool of worker processes. When more than
+`max_in_flight` requests are being processed, new requests are answered with
+`429 Too Many Requests` without reading their document. If a worker process
+dies, the requests it was working on are answered with `503 Service
+Unavailable` and a new pool is started for the next ones.
+
+Run it with `python -m samewords.service`. It listens on localhost only,
+unless another host is given.
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import os
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Tuple
+
+from samewords.core import plan_string, run_annotation
+from samewords.metrics import registry
+from samewords.settings import apply_config, settings
+
+METHODS = ["annotate", "update", "clean"]
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+# The size of the pieces in which the document of a refused request is read
+# and thrown away.
+DISCARD_SIZE = 2**16
+
+
+def _process_batch(
+    tasks: List[Tuple[str, str, Dict]]
+) -> Tuple[List[Tuple[bool, str]], Dict]:
+    """Process a batch of (paragraph, method, settings) tasks in a worker
+    process. Return a (success, result or error message) tuple for each and
+    the metrics of the batch."""
+    results = []
+    for par, method, task_settings in tasks:
+        settings.update(task_settings)
+        try:
+            results.append((True, run_annotation(par, method)))
+        except Exception as e:
+            results.append((False, str(e)))
+    return results, registry.drain()
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str = "") -> None:
+        super().__init__(message or REASONS[status])
+        self.status = status
+
+
+class Service:
+    """
+    The HTTP service. Use `start` to listen from a running event loop or
+    `serve` to run it in a new one.
+
+    Attributes:
+        self.in_flight: The number of requests currently being processed.
+        self.batches: The number of batches sent to the workers.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8000,
+        processes: int = None,
+        max_in_flight: int = 16,
+        batch_size: int = 32,
+        batch_delay: float = 0.005,
+        max_body: int = 64 * 2**20,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.processes = processes or os.cpu_count()
+        self.max_in_flight = max_in_flight
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.max_body = max_body
+        self.in_flight = 0
+        self.batches = 0
+        self._pool = None
+        self._queue = None
+        self._server = None
+        self._batcher = None
+
+    async def start(self) -> None:
+        self._pool = ProcessPoolExecutor(self.processes)
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.ensure_future(self._run_batches())
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        # Register the actual port, in case port 0 was given.
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+        self._batcher.cancel()
+        # Waiting for the workers must not block the loop.
+        await asyncio.get_running_loop().run_in_executor(None, self._pool.shutdown)
+
+    def serve(self, started: threading.Event = None) -> None:
+        """Run the service in a new event loop until interrupted. Set the
+        `started` event, if given, when the service is listening."""
+
+        async def run():
+            await self.start()
+            if started is not None:
+                started.set()
+            try:
+                await self._server.serve_forever()
+            finally:
+                await self.stop()
+
+        asyncio.run(run())
+
+    async def submit(self, par: str, method: str, task_settings: Dict) -> str:
+        """Queue the paragraph for the next batch and wait for its result."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((par, method, task_settings, future))
+        return await future
+
+    async def _run_batches(self) -> None:
+        """Collect the queued paragraphs into batches and send each batch to
+        the pool. A batch is sent when it is full or when no more paragraphs
+        have arrived within the batch delay."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), self.batch_delay)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+            self.batches += 1
+            tasks = [
+                (par, method, task_settings) for par, method, task_settings, _ in batch
+            ]
+            try:
+                work = loop.run_in_executor(self._pool, _process_batch, tasks)
+            except BrokenProcessPool:
+                # A worker process died, which breaks the pool for good.
+                self._pool.shutdown(wait=False)
+                self._pool = ProcessPoolExecutor(self.processes)
+                work = loop.run_in_executor(self._pool, _process_batch, tasks)
+            work.add_done_callback(lambda w, batch=batch: self._resolve(w, batch))
+
+    @staticmethod
+    def _resolve(work: asyncio.Future, batch: List) -> None:
+        futures = [item[-1] for item in batch]
+        if work.exception() is not None:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(work.exception())
+            return
+        results, metrics = work.result()
+        registry.merge(metrics)
+        for future, (success, result) in zip(futures, results):
+            if future.done():
+                continue
+            if success:
+                future.set_result(result)
+            else:
+                future.set_exception(ValueError(result))
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            try:
+                method, length, headers = await self._read_head(reader)
+                if self.in_flight >= self.max_in_flight:
+                    await self._discard(reader, length)
+                    raise HTTPError(429)
+            except HTTPError as e:
+                await self._respond_error(writer, e)
+                return
+            self.in_flight += 1
+            try:
+                try:
+                    content, task_settings = await self._read_body(
+                        reader, length, headers
+                    )
+                    await self._respond(writer, method, content, task_settings)
+                except HTTPError as e:
+                    await self._respond_error(writer, e)
+            finally:
+                self.in_flight -= 1
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # The client went away.
+            pass
+        finally:
+            writer.close()
+
+    async def _read_head(
+        self, reader: asyncio.StreamReader
+    ) -> Tuple[str, int, Dict[str, str]]:
+        """Parse the request line and the headers and return the processing
+        method, the length of the document and the headers."""
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            raise HTTPError(400, "Malformed request line")
+        verb, target, _ = request_line
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        method = target.split("?")[0].strip("/")
+        if method not in METHODS:
+            raise HTTPError(404, "Use /annotate, /update or /clean")
+        if verb != "POST":
+            raise HTTPError(405)
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length > self.max_body:
+            raise HTTPError(413)
+        return method, length, headers
+
+    @staticmethod
+    async def _discard(reader: asyncio.StreamReader, length: int) -> None:
+        """Read the document of a refused request without keeping it, so the
+        client gets the answer before the connection is closed."""
+        while length > 0:
+            length -= len(await reader.readexactly(min(length, DISCARD_SIZE)))
+
+    @staticmethod
+    async def _read_body(
+        reader: asyncio.StreamReader, length: int, headers: Dict[str, str]
+    ) -> Tuple[str, Dict]:
+        """Read the document and return it with the settings to use."""
+        try:
+            body = (await reader.readexactly(length)).decode("utf-8")
+        except UnicodeDecodeError:
+            raise HTTPError(400, "The document must be in utf-8 unicode encoding.")
+
+        task_settings = settings
+        if headers.get("content-type", "").startswith("application/json"):
+            try:
+                data = json.loads(body)
+                body = data["string"]
+                if "config" in data:
+                    task_settings = apply_config(
+                        data["config"], copy.deepcopy(settings)
+                    )
+            except (ValueError, KeyError, TypeError):
+                raise HTTPError(400, "Expected a JSON object with a string")
+        return body, task_settings
+
+    async def _respond(
+        self,
+        writer: asyncio.StreamWriter,
+        method: str,
+        content: str,
+        task_settings: Dict,
+    ) -> None:
+        # Splitting a large document takes a while, so it is done off the loop.
+        loop = asyncio.get_running_loop()
+        try:
+            planned = await loop.run_in_executor(None, plan_string, content, method)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        # Queue every paragraph before waiting, so they can share batches.
+        parts = []
+        for par, pending in planned:
+            if pending:
+                par = asyncio.ensure_future(self.submit(par, method, task_settings))
+            parts.append(par)
+        pending = [part for part in parts if not isinstance(part, str)]
+        try:
+            done = iter(await asyncio.gather(*pending))
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        except BrokenProcessPool:
+            raise HTTPError(503, "A worker process stopped. Try again.")
+        except Exception as e:
+            raise HTTPError(500, str(e))
+        finally:
+            for part in pending:
+                part.cancel()
+
+        body = "".join(
+            part if isinstance(part, str) else next(done) for part in parts
+        ).encode("utf-8")
+        headers = [
+            "HTTP/1.1 200 OK",
+            "Content-Type: text/plain; charset=utf-8",
+            "Content-Length: {}".format(len(body)),
+            "Connection: close",
+        ]
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    @staticmethod
+    async def _respond_error(writer: asyncio.StreamWriter, error: HTTPError) -> None:
+        body = (str(error) + "\n").encode("utf-8")
+        headers = [
+            "HTTP/1.1 {} {}".format(error.status, REASONS[error.status]),
+            "Content-Type: text/plain; charset=utf-8",
+            "Content-Length: {}".format(len(body)),
+            "Connection: close",
+        ]
+        if error.status == 429:
+            headers.append("Retry-After: 1")
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m samewords.service",
+        description="Serve samewords processing over HTTP.",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="(default: %(default)s)")
+    parser.add_argument("--port", type=int, default=8000, help="(default: %(default)s)")
+    parser.add_argument("--processes", type=int, help="Number of worker processes.")
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=16,
+        help="Requests processed at once before answering 429. (default: %(default)s)",
+    )
+    args = parser.parse_args()
+    service = Service(args.host, args.port, args.processes, args.max_in_flight)
+    print("Serving on http://{}:{}. Stop with Ctrl-C.".format(args.host, args.port))
+    try:
+        service.serve()
+    except KeyboardInterrupt:
+        print("Stopped serving.")
+
+
+if __name__ == "__main__":
+    main()
@@ -51,3 +51,22 @@ settings = {
     # Should we annotate multi word matches with single macro?
     "multiword": False,
 }
+
+
+def apply_config(conf: dict, target: dict = None) -> dict:
+    """Update the `target` settings (default: the global settings) with the
+    values of a user configuration. Lists are extended, other values are
+    replaced. Return the target."""
+    if target is None:
+        target = settings
+    target["ellipsis_patterns"] += conf.get("ellipsis_patterns", [])
+    target["exclude_macros"] += conf.get("exclude_macros", [])
+    target["sensitive_context_match"] = conf.get(
+        "sensitive_context_match", target["sensitive_context_match"]
+    )
+    target["context_distance"] = conf.get(
+        "context_distance", target["context_distance"]
+    )
+    target["punctuation"] += conf.get("punctuation", [])
+    target["multiword"] = conf.get("multiword", target["multiword"])
+    return target
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Statistics collected while processing documents.
+
+The processing is divided into phases (reading, chunking, tokenization,
+matching, cleanup and writing) marked with `phase`. Observers registered
+with `observe`, such as a `Statistics` object, are told when each phase
+starts and stops and are given the counts reported with `count`. Without
+observers, marking a phase costs next to nothing.
+
+While a `Statistics` object is recording, the operations counted by
+`samewords.instrumentation` are added to it as well.
+"""
+
+import time
+
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+from samewords import instrumentation
+
+# The phases timed by `Statistics`. Other phases, such as a whole paragraph,
+# group these.
+PHASES = ["read", "chunk", "tokenize", "cleanup", "match", "write"]
+# The phases of processing a paragraph, whose time is the processing time.
+PROCESSING_PHASES = ["tokenize", "match", "cleanup", "write"]
+
+_observers: List["PhaseObserver"] = []
+
+
+class PhaseObserver:
+    """The interface of the observers of `phase` and `count`."""
+
+    def start(self, name: str, meta: Dict) -> Any:
+        """Called when the phase starts. The return value is given to
+        `stop`."""
+        return None
+
+    def stop(self, name: str, meta: Dict, token: Any) -> None:
+        pass
+
+    def add(self, name: str, value: int = 1) -> None:
+        pass
+
+
+@contextmanager
+def observe(observer: PhaseObserver) -> Iterator[PhaseObserver]:
+    """Register the observer while the context lasts."""
+    if observer in _observers:
+        yield observer
+        return
+    _observers.append(observer)
+    try:
+        yield observer
+    finally:
+        _observers.remove(observer)
+
+
+def observing() -> bool:
+    """Determine whether any observers are registered, so the work of
+    counting can be skipped when nobody is looking."""
+    return bool(_observers)
+
+
+@contextmanager
+def phase(name: str, **meta: Any) -> Iterator[Dict]:
+    """Mark a phase of the processing for the registered observers. The
+    keyword arguments describe what is processed, e.g. a paragraph. The
+    dictionary of them is given to the context, so details found during the
+    phase can be added for the observers."""
+    if not _observers:
+        yield meta
+        return
+    observers = list(_observers)
+    tokens = [observer.start(name, meta) for observer in observers]
+    try:
+        yield meta
+    finally:
+        for observer, token in zip(reversed(observers), reversed(tokens)):
+            observer.stop(name, meta, token)
+
+
+def count(name: str, value: int = 1) -> None:
+    """Add to a count of the registered observers."""
+    for observer in _observers:
+        observer.add(name, value)
+
+
+class Statistics(PhaseObserver):
+    """Named counts of a processing run, e.g. the number of paragraphs that
+    were processed or skipped. While it observes the processing (see
+    `observe`), the wall and CPU time of each of `PHASES` is recorded in
+    `times`. While it is `recording`, the operations counted by the
+    instrumentation are also added to `operations`."""
+
+    def __init__(self) -> None:
+        self.counts = Counter()
+        self.times: Dict[str, List[float]] = {}
+        self.operations = Counter()
+
+    def __getitem__(self, name: str) -> int:
+        return self.counts[name]
+
+    def __repr__(self) -> str:
+        return "Statistics({})".format(dict(self.counts))
+
+    def add(self, name: str, value: int = 1) -> None:
+        self.counts[name] += value
+
+    @contextmanager
+    def recording(self) -> Iterator["Statistics"]:
+        """Observe the processing and count its operations while the context
+        lasts. Nested recordings of the same object are ignored."""
+        if self in _observers:
+            yield self
+            return
+        with observe(self), instrumentation.counting() as operations:
+            try:
+                yield self
+            finally:
+                instrumentation.merge(self.operations, operations)
+
+    def start(self, name: str, meta: Dict) -> Any:
+        if name not in PHASES:
+            return None
+        return time.perf_counter(), time.process_time()
+
+    def stop(self, name: str, meta: Dict, token: Any) -> None:
+        if token is None:
+            return
+        wall, cpu = self.times.setdefault(name, [0.0, 0.0])
+        self.times[name] = [
+            wall + time.perf_counter() - token[0],
+            cpu + time.process_time() - token[1],
+        ]
+
+    def update(self, other: "Statistics") -> None:
+        """Add the counts of another run (e.g. from a worker process)."""
+        self.counts.update(other.counts)
+        for name, (wall, cpu) in other.times.items():
+            total = self.times.setdefault(name, [0.0, 0.0])
+            self.times[name] = [total[0] + wall, total[1] + cpu]
+        instrumentation.merge(self.operations, other.operations)
+
+    def as_dict(self) -> Dict:
+        return dict(self.counts)
+
+    def summary(self) -> Dict:
+        """Return the counts, the times of the phases, the throughput and the
+        counted operations of the processing."""
+        seconds = sum(self.times.get(name, [0.0])[0] for name in PROCESSING_PHASES)
+        return {
+            "counts": self.as_dict(),
+            "phases": {
+                name: {"wall": wall, "cpu": cpu}
+                for name, (wall, cpu) in self.times.items()
+            },
+            "throughput": {
+                "words_per_second": self.counts["words"] / seconds if seconds else 0.0,
+                "entries_per_second": (
+                    self.counts["entries"] / seconds if seconds else 0.0
+                ),
+            },
+            "operations": dict(self.operations),
+        }
+
+    def format(self) -> str:
+        """Return the summary as a table."""
+        summary = self.summary()
+        lines = ["{:<12} {:>10} {:>10}".format("Phase", "Wall (s)", "CPU (s)")]
+        for name, times in summary["phases"].items():
+            lines.append(
+                "{:<12} {:>10.4f} {:>10.4f}".format(name, times["wall"], times["cpu"])
+            )
+        lines.append("")
+        for name, value in sorted(summary["counts"].items()):
+            lines.append("{:<20} {:>10}".format(name, value))
+        for name, value in summary["throughput"].items():
+            lines.append("{:<20} {:>10.1f}".format(name.replace("_", " "), value))
+        if summary["operations"]:
+            lines.append("")
+            for name, value in sorted(summary["operations"].items()):
+                lines.append("{:<24} {:>10}".format(name, value))
+        return "\n".join(lines)
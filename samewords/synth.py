@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic reledmac editions for testing and benchmarking at scale.
+
+The documents are made of numbered sections (`\\beginnumbering` ...
+`\\endnumbering`) of paragraphs (`\\pstart` ... `\\pend`) of pseudo-Latin
+words. The words are drawn from a vocabulary by a Zipf distribution, so
+some words recur often, as in real texts, and the matching of lemmas in
+their context has something to find. `\\edtext` entries are placed at
+random with nested entries, lemmas with ellipsis, entries of several
+words, macros excluded from the matching and comments mixed in.
+
+The same options and seed always give the same document:
+
+    from samewords.synth import generate
+    content = generate(paragraphs=200, words=150, seed=1)
+
+Run `python -m samewords.synth --help` for the command line.
+"""
+
+import argparse
+import itertools
+import random
+import sys
+
+from typing import List, Tuple
+
+_SYLLABLES = (
+    "a ae an ar ca ce ci co cu de di do e er es fa fe fi ge gi i in is la "
+    "le li lo ma me mi mo mu na ne ni no nu o or pa pe pi po qua que qui ra "
+    "re ri ro sa se si so su ta te ti to tu u um us va ve vi"
+).split()
+# Macros of the default `exclude_macros` setting, with `{}` for the argument.
+EXCLUDED_MACROS = ["\\index{{{}}}", "\\sidenote{{{}}}", "\\edlabel{{{}}}"]
+PREAMBLE = "\\documentclass{book}\n\\usepackage[final]{reledmac}\n\\begin{document}\n"
+
+
+def make_vocabulary(size: int, rng: random.Random) -> List[str]:
+    """Return `size` distinct pseudo-Latin words, shortest first."""
+    words = set()
+    length = 1
+    while len(words) < size:
+        # Draw longer words when the short ones run out.
+        for _ in range(size * 4):
+            words.add("".join(rng.choice(_SYLLABLES) for _ in range(length)))
+            if len(words) == size:
+                break
+        length += 1
+    return sorted(words, key=lambda word: (len(word), word))
+
+
+class Synthesizer:
+    """
+    Generator of reledmac documents. The options are:
+
+        sections: Numbered sections of the document.
+        paragraphs: Paragraphs of each section.
+        words: Words of each paragraph.
+        vocabulary: Distinct words of the document.
+        skew: Exponent of the Zipf distribution of the words. The higher
+        it is, the more often the most common words recur.
+        density: Probability that a word starts an `\\edtext`.
+        depth: Deepest nesting of `\\edtext`s (1 for no nesting).
+        lemma: Proportion of `\\edtext`s with a `\\lemma` in the note.
+        ellipsis: Proportion of lemmas of three or more words that are
+        abbreviated with `\\dots{}`.
+        multiword: Proportion of `\\edtext`s of several words.
+        excluded: Probability that an excluded macro (see
+        `EXCLUDED_MACROS`) follows a word.
+        comments: Probability that a comment follows a word.
+        seed: Seed of the random numbers.
+    """
+
+    def __init__(
+        self,
+        sections: int = 1,
+        paragraphs: int = 10,
+        words: int = 100,
+        vocabulary: int = 1000,
+        skew: float = 1.1,
+        density: float = 0.05,
+        depth: int = 2,
+        lemma: float = 0.9,
+        ellipsis: float = 0.2,
+        multiword: float = 0.4,
+        excluded: float = 0.01,
+        comments: float = 0.01,
+        seed: int = 0,
+    ) -> None:
+        self.sections = sections
+        self.paragraphs = paragraphs
+        self.words = words
+        self.density = density
+        self.depth = depth
+        self.lemma = lemma
+        self.ellipsis = ellipsis
+        self.multiword = multiword
+        self.excluded = excluded
+        self.comments = comments
+        self.rng = random.Random(seed)
+        self.vocabulary = make_vocabulary(vocabulary, self.rng)
+        weights = [1 / rank**skew for rank in range(1, vocabulary + 1)]
+        self._cum_weights = list(itertools.accumulate(weights))
+        self._labels = 0
+
+    def document(self) -> str:
+        parts = [PREAMBLE]
+        for _ in range(self.sections):
+            parts.append("\n{}\n\n".format(self._unnumbered()))
+            parts.append(self.section())
+        parts.append("\n\\end{document}\n")
+        return "".join(parts)
+
+    def section(self) -> str:
+        pars = [self.paragraph() for _ in range(self.paragraphs)]
+        return "\\beginnumbering\n{}\\endnumbering\n".format("".join(pars))
+
+    def paragraph(self) -> str:
+        text, _ = self._text(self.words, 1)
+        return "\\pstart\n{}.\n\\pend\n\n".format(text)
+
+    def _word(self) -> str:
+        return self.rng.choices(self.vocabulary, cum_weights=self._cum_weights)[0]
+
+    def _unnumbered(self) -> str:
+        return " ".join(self._word() for _ in range(10)).capitalize() + "."
+
+    def _text(self, count: int, level: int) -> Tuple[str, List[str]]:
+        """Return the LaTeX of `count` words with the `\\edtext`s of `level`
+        and deeper, and the plain words."""
+        parts: List[str] = []
+        plain: List[str] = []
+        while len(plain) < count:
+            left = count - len(plain)
+            if level <= self.depth and self.rng.random() < self.density:
+                size = 1
+                if left > 1 and self.rng.random() < self.multiword:
+                    size = self.rng.randint(2, min(left, 6))
+                latex, words = self._edtext(size, level)
+            else:
+                words = [self._word()]
+                latex = words[0] + self._decoration()
+            parts.append(latex)
+            plain.extend(words)
+        return " ".join(parts), plain
+
+    def _decoration(self) -> str:
+        """Return what follows a word: punctuation, an excluded macro or a
+        comment, if any."""
+        text = ""
+        if self.rng.random() < 0.08:
+            text += self.rng.choice([",", ";", ":"])
+        if self.rng.random() < self.excluded:
+            self._labels += 1
+            macro = self.rng.choice(EXCLUDED_MACROS)
+            text += macro.format("synth-{}".format(self._labels))
+        if self.rng.random() < self.comments:
+            text += "% {}\n".format(self._word())
+        return text
+
+    def _edtext(self, size: int, level: int) -> Tuple[str, List[str]]:
+        # The words of nested entries are inside this one.
+        latex, words = self._text(size, level + 1)
+        note = "\\Afootnote{{{} B}}".format(self._word())
+        if self.rng.random() < self.lemma:
+            lemma = " ".join(words)
+            if len(words) >= 3 and self.rng.random() < self.ellipsis:
+                lemma = "{} \\dots{{}} {}".format(words[0], words[-1])
+            note = "\\lemma{{{}}}{}".format(lemma, note)
+        return "\\edtext{{{}}}{{{}}}".format(latex, note), words
+
+
+def generate(**options) -> str:
+    """Return a document generated with the options of `Synthesizer`."""
+    return Synthesizer(**options).document()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m samewords.synth",
+        description="Generate a synthetic reledmac edition.",
+    )
+    options = [
+        ("--sections", int, 1, "Numbered sections."),
+        ("--paragraphs", int, 10, "Paragraphs per section."),
+        ("--words", int, 100, "Words per paragraph."),
+        ("--vocabulary", int, 1000, "Distinct words."),
+        ("--skew", float, 1.1, "Exponent of the Zipf distribution of words."),
+        ("--density", float, 0.05, "Probability that a word starts an edtext."),
+        ("--depth", int, 2, "Deepest nesting of edtexts."),
+        ("--lemma", float, 0.9, "Proportion of edtexts with a lemma."),
+        ("--ellipsis", float, 0.2, "Proportion of long lemmas with ellipsis."),
+        ("--multiword", float, 0.4, "Proportion of edtexts of several words."),
+        ("--excluded", float, 0.01, "Probability of an excluded macro."),
+        ("--comments", float, 0.01, "Probability of a comment."),
+        ("--seed", int, 0, "Seed of the random numbers."),
+    ]
+    for flag, kind, default, text in options:
+        parser.add_argument(
+            flag, type=kind, default=default, help=text + " (default: %(default)s)"
+        )
+    parser.add_argument(
+        "--output", help="File to write the document to (default: stdout)."
+    )
+    args = vars(parser.parse_args())
+    output = args.pop("output")
+    content = generate(**args)
+    if output:
+        with open(output, mode="w") as f:
+            f.write(content)
+    else:
+        sys.stdout.write(content)
+
+
+if __name__ == "__main__":
+    main()
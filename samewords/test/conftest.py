@@ -0,0 +1,15 @@
+import pytest
+
+import samewords.cache
+import samewords.cli
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Keep the paragraph cache of each test, and of the commands it runs,
+    in a directory of its own."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    directory = str(tmp_path / "cache" / "samewords")
+    monkeypatch.setattr(samewords.cache, "CACHE_DIR", directory)
+    monkeypatch.setattr(samewords.cli, "CACHE_DIR", directory)
+    return directory
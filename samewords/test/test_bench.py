@@ -0,0 +1,63 @@
+import json
+import subprocess
+import sys
+
+from samewords.bench import bench_case, configured, inputs, percentile, run
+from samewords.bench import settings_grid
+from samewords.settings import settings
+
+
+class TestBench:
+    def test_percentile(self):
+        assert percentile([3.0, 1.0, 2.0], 50) == 2.0
+        assert percentile([1.0, 2.0], 50) == 1.5
+        assert percentile([1.0, 2.0, 3.0, 4.0, 5.0], 90) == 4.6
+        assert percentile([7.0], 99) == 7.0
+
+    def test_configured(self):
+        distance = settings["context_distance"]
+        with configured(context_distance=5, multiword=True):
+            assert settings["context_distance"] == 5
+        assert settings["context_distance"] == distance
+        assert settings["multiword"] is False
+
+    def test_inputs(self):
+        documents = inputs([2, 4], words=20)
+        assert [name for name, _ in documents] == [
+            "da-49-l1q1.tex",
+            "simple.tex",
+            "synth-2x20",
+            "synth-4x20",
+        ]
+        assert len(documents[3][1]) > len(documents[2][1])
+
+    def test_bench_case(self):
+        content = dict(inputs([]))["da-49-l1q1.tex"]
+        result = bench_case(content, "annotate", repeat=3)
+        seconds = result["seconds"]
+        assert seconds["min"] <= seconds["p50"] <= seconds["p90"] <= seconds["max"]
+        assert result["peak_memory"] > 0
+        assert result["words"] == 812 and result["entries"] == 87
+        assert result["words_per_second"] > 0
+
+    def test_run(self):
+        grid = settings_grid([10, 20], [True], [False])
+        report = run(inputs([2], words=20, assets=False), ["clean"], grid, repeat=1)
+        assert [r["settings"]["context_distance"] for r in report["results"]] == [
+            10,
+            20,
+        ]
+        assert all(r["method"] == "clean" for r in report["results"])
+
+    def test_command_line(self, tmp_path):
+        output = tmp_path / "bench.json"
+        args = ["--no-assets", "--sizes", "2", "--words", "20", "--repeat", "1"]
+        args += ["--context-distance", "20", "--sensitive-context-match", "true"]
+        args += ["--multiword", "false", "--output", str(output)]
+        subprocess.check_call(
+            [sys.executable, "-m", "samewords.bench"] + args,
+            stderr=subprocess.DEVNULL,
+        )
+        report = json.loads(output.read_text())
+        methods = [result["method"] for result in report["results"]]
+        assert methods == ["annotate", "update", "clean"]
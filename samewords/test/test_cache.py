@@ -0,0 +1,99 @@
+import os
+
+import samewords.cache
+
+from samewords.cache import ParagraphCache
+from samewords.core import process_document, process_string
+from samewords.settings import settings
+from samewords.stats import Statistics
+from samewords.test import __testroot__, temp_settings
+
+unprocessed = os.path.join(__testroot__, "assets/da-49-l1q1.tex")
+
+
+class TestParagraphCache:
+    def test_get_and_put(self, tmp_path):
+        with ParagraphCache(str(tmp_path)) as cache:
+            assert cache.get("text", "annotate") is None
+            cache.put("text", "annotate", "result")
+            assert cache.get("text", "annotate") == "result"
+            assert cache.get("text", "clean") is None
+            assert (cache.hits, cache.misses) == (1, 2)
+
+    def test_persistence(self, tmp_path):
+        with ParagraphCache(str(tmp_path)) as cache:
+            cache.put("text", "annotate", "result")
+        with ParagraphCache(str(tmp_path)) as cache:
+            assert cache.get("text", "annotate") == "result"
+
+    def test_shared_by_two_caches(self, tmp_path):
+        first = ParagraphCache(str(tmp_path))
+        second = ParagraphCache(str(tmp_path))
+        try:
+            first.put("first", "annotate", "1")
+            assert first.get("first", "annotate") == "1"
+            # The second cache can write while the first is in use.
+            second.put("second", "annotate", "2")
+            second.flush()
+            assert first.get("second", "annotate") == "2"
+            first.flush()
+            assert second.get("first", "annotate") == "1"
+        finally:
+            first.close()
+            second.close()
+
+    def test_settings_change_key(self, tmp_path):
+        with ParagraphCache(str(tmp_path)) as cache:
+            cache.put("text", "annotate", "result")
+            with temp_settings({"context_distance": 5}):
+                assert cache.get("text", "annotate") is None
+
+    def test_settings_changed_in_place_key(self):
+        key = ParagraphCache.key("text", "annotate")
+        settings["exclude_macros"].append("foo")
+        try:
+            assert ParagraphCache.key("text", "annotate") != key
+        finally:
+            settings["exclude_macros"].remove("foo")
+        assert ParagraphCache.key("text", "annotate") == key
+
+    def test_code_change_key(self, tmp_path, monkeypatch):
+        with ParagraphCache(str(tmp_path)) as cache:
+            cache.put("text", "annotate", "result")
+            monkeypatch.setattr(samewords.cache, "_code_fingerprint", "changed")
+            assert cache.get("text", "annotate") is None
+
+    def test_least_recently_used_are_evicted(self, tmp_path):
+        cache = ParagraphCache(str(tmp_path), max_size=10)
+        cache.put("first", "annotate", "12345")
+        cache.put("second", "annotate", "12345")
+        cache.put("third", "annotate", "12345")
+        cache.get("first", "annotate")
+        assert cache.evict() == 1
+        assert cache.get("second", "annotate") is None
+        assert cache.get("first", "annotate") == "12345"
+        cache.close()
+
+    def test_rerun_uses_cache(self, tmp_path):
+        with ParagraphCache(str(tmp_path)) as cache:
+            first = Statistics()
+            expect = process_document(unprocessed, stats=first, cache=cache)
+            second = Statistics()
+            assert process_document(unprocessed, stats=second, cache=cache) == expect
+            assert second["paragraphs"] == 0
+            assert second["paragraphs_cached"] == first["paragraphs"]
+
+    def test_changed_paragraph_is_processed(self, tmp_path):
+        text = (
+            "\\beginnumbering\n\\pstart a \\edtext{a}{\\Afootnote{b}} \\pend\n"
+            "\\pstart b \\edtext{b}{\\Afootnote{c}} \\pend\n\\endnumbering\n"
+        )
+        with ParagraphCache(str(tmp_path)) as cache:
+            process_string(text, cache=cache)
+            stats = Statistics()
+            changed = text.replace("a \\edtext{a}", "a \\edtext{x}")
+            assert process_string(changed, stats=stats, cache=cache) == (
+                process_string(changed)
+            )
+            assert stats["paragraphs"] == 1
+            assert stats["paragraphs_cached"] == 1
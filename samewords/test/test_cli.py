@@ -1,7 +1,11 @@
+import json
 import os
 import subprocess
+import sys
 from pathlib import Path
 
+import samewords
+
 from samewords import cli, __root__
 from samewords.test import __testroot__
 from samewords.settings import settings
@@ -67,3 +71,135 @@ class TestCLIArguments:
         with open(os.path.join(__root__, "test/assets/simple-updated.tex")) as f:
             result = f.read()
         assert out.decode().strip() == result.strip()
+
+    def test_multiple_files_to_directory(self, tmp_path):
+        simple = os.path.join(__testroot__, "assets/simple.tex")
+        proc = subprocess.Popen(
+            ["samewords", input_file, simple, "--output", str(tmp_path)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        out, err = proc.communicate()
+        assert "Conversion succeeded" in out.decode()
+        with open(result_file) as f:
+            assert (tmp_path / "da-49-l1q1.tex").read_text() == f.read()
+        expect = samewords.core.process_document(simple)
+        assert (tmp_path / "simple.tex").read_text() == expect
+
+    def test_single_file_options_with_multiple_files(self, tmp_path):
+        simple = os.path.join(__testroot__, "assets/simple.tex")
+        output = tmp_path / "output"
+        output.mkdir()
+        for option in [["--slow-log", "5"], ["--memory-report", "report.json"]]:
+            proc = subprocess.Popen(
+                ["samewords", input_file, simple, "--output", str(output)] + option,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            out, err = proc.communicate()
+            assert proc.returncode != 0
+            assert "single file" in err.decode()
+            assert not os.listdir(str(output))
+
+    def test_file_name_like_a_pattern(self, tmp_path):
+        # Existing files and directories are not taken as glob patterns.
+        directory = tmp_path / "part[1]"
+        directory.mkdir()
+        filename = directory / "text[1].tex"
+        with open(input_file) as f:
+            filename.write_text(f.read())
+        out = subprocess.check_output(["samewords", str(filename)])
+        with open(result_file) as f:
+            assert out.decode().strip() == f.read().strip()
+        assert cli.expand_paths([str(directory)]) == [(str(filename), "text[1].tex")]
+
+    def test_expand_directory_and_glob(self):
+        assets = os.path.join(__testroot__, "assets")
+        from_dir = cli.expand_paths([assets])
+        from_glob = cli.expand_paths([os.path.join(assets, "simple*.tex")])
+        assert (os.path.join(assets, "simple.tex"), "simple.tex") in from_dir
+        assert [rel for _, rel in from_glob] == [
+            "simple-processed.tex",
+            "simple-unupdated.tex",
+            "simple-updated.tex",
+            "simple.tex",
+        ]
+
+    def test_stream_file(self):
+        proc = subprocess.Popen(
+            ["samewords", input_file, "--stream"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        out, err = proc.communicate()
+        with open(result_file) as f:
+            assert out.decode() == f.read()
+
+    def test_cache_hit_rate(self, tmp_path):
+        command = ["samewords", input_file, "--cache-dir", str(tmp_path)]
+        for expect in ["(0% hit rate)", "(100% hit rate)"]:
+            proc = subprocess.Popen(
+                command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            out, err = proc.communicate()
+            assert expect in err.decode()
+        proc = subprocess.Popen(
+            command + ["--no-cache"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        out, err = proc.communicate()
+        assert "hit rate" not in err.decode()
+
+    def test_cache_unavailable(self, tmp_path):
+        # A file where the directory of the cache should be.
+        blocked = tmp_path / "blocked"
+        blocked.write_text("")
+        proc = subprocess.Popen(
+            ["samewords", input_file, "--cache-dir", str(blocked / "cache")],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        out, err = proc.communicate()
+        assert proc.returncode == 0
+        assert "Continuing without the cache" in err.decode()
+        with open(result_file) as f:
+            assert out.decode().strip() == f.read().strip()
+
+    def test_stats_json(self, tmp_path):
+        path = tmp_path / "stats.json"
+        args = ["--no-cache", "--stats", "--stats-json", str(path)]
+        proc = subprocess.Popen(
+            ["samewords", input_file] + args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        _, err = proc.communicate()
+        assert "words per second" in err.decode("utf-8")
+        summary = json.loads(path.read_text())
+        assert summary["counts"]["paragraphs"] == 10
+        assert summary["counts"]["annotations_added"] == 63
+        assert "tokenize" in summary["phases"]
+
+    def test_metrics_file(self, tmp_path):
+        metrics = tmp_path / "metrics.txt"
+        proc = subprocess.Popen(
+            ["samewords", input_file, "--no-cache", "--metrics-file", str(metrics)],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        proc.communicate()
+        exposition = metrics.read_text()
+        assert 'samewords_paragraphs_total{method="annotate"} 10' in exposition
+        assert exposition.endswith("# EOF\n")
+
+
+class TestImports:
+    def test_modes_are_imported_when_used(self):
+        # Processing a single file should not pay for the other modes.
+        code = (
+            "import sys, samewords.cli; "
+            "print(' '.join(m for m in ['asyncio', 'http.server', "
+            "'multiprocessing', 'samewords.service', 'samewords.trace', "
+            "'samewords.pipeline', 'samewords.lsp'] if m in sys.modules))"
+        )
+        out = subprocess.check_output([sys.executable, "-c", code])
+        assert out.decode().strip() == ""
@@ -0,0 +1,149 @@
+"""
+Guards against quadratic behavior: each stage is timed on inputs of doubling
+size, and the exponent of the growth of its time, fitted on a log-log scale,
+must stay well below the 2 of a quadratic stage. Each input is chosen so that
+the quadratic work of an earlier implementation of the stage dominates at
+these sizes.
+"""
+
+import math
+import time
+import tracemalloc
+import warnings
+
+from samewords.matcher import Matcher
+from samewords.test import temp_settings
+from samewords.tokenize import Tokenizer
+
+# A linear(ithmic) stage grows with an exponent of about 1, a quadratic one
+# with an exponent of about 2.
+BOUND = 1.4
+
+
+def exponent(sizes, values) -> float:
+    """Return the slope of the least squares line through the logarithms of
+    the sizes and the values."""
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(value) for value in values]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    return covariance / sum((x - mean_x) ** 2 for x in xs)
+
+
+def seconds(stage, argument, repeat: int) -> float:
+    """Return the shortest time of the stage, which is the least noisy."""
+    times = []
+    for _ in range(repeat):
+        prepared = argument()
+        start = time.perf_counter()
+        stage(prepared)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def growth(stage, make, sizes, repeat: int = 3) -> float:
+    """Return the exponent of the growth of the time of the stage over the
+    sizes. `make(size)` returns a function that prepares the argument of the
+    stage, so the preparation is not timed."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return exponent(sizes, [seconds(stage, make(size), repeat) for size in sizes])
+
+
+def long_words(size: int) -> str:
+    # The tokenizer used to copy the rest of the paragraph for each token,
+    # which long words make far more expensive than the token itself.
+    return "\\pstart " + ("x" * 1000 + " ") * size + "\\pend"
+
+
+def repetitive(size: int) -> str:
+    # Each "a b" partially matches the lemma "a b c", which used to start a
+    # new recursive search over a copy of the rest of the context.
+    half = "a b " * (size // 4)
+    entry = "\\edtext{a b c}{\\Afootnote{x}} "
+    return "\\pstart " + (half + entry + half) * 2 + "\\pend"
+
+
+def nested(size: int) -> str:
+    # The entries used to be written out and scanned one by one, and the
+    # nested entries together span a quadratic number of words.
+    entries = "\\edtext{a " * size + "b" + "}{\\Afootnote{c}} z" * size
+    return "\\pstart " + entries + " \\pend"
+
+
+def tokenized(text: str):
+    return lambda: Tokenizer(text)
+
+
+class TestComplexity:
+    def test_tokenize(self):
+        def make(size):
+            text = long_words(size)
+            return lambda: text
+
+        assert growth(Tokenizer, make, [1000, 2000, 4000, 8000]) < BOUND
+
+    def test_tokenize_memory(self):
+        # The macros used to keep a copy of the rest of the paragraph.
+        def peak(size):
+            text = "\\pstart " + "\\emph{lorem} ipsum " * (size // 2) + "\\pend"
+            tracemalloc.start()
+            try:
+                Tokenizer(text)
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        sizes = [1000, 2000, 4000, 8000]
+        assert exponent(sizes, [peak(size) for size in sizes]) < BOUND
+
+    def test_annotate(self):
+        def make(size):
+            return tokenized(repetitive(size))
+
+        def annotate(tokenization):
+            Matcher(tokenization.wordlist, tokenization.registry).annotate()
+
+        sizes = [300, 600, 1200, 2400]
+        # The context of each entry spans the whole paragraph.
+        with temp_settings({"context_distance": sizes[-1]}):
+            assert growth(annotate, make, sizes, 5) < BOUND
+
+    def test_update(self):
+        def make(size):
+            tokenization = Tokenizer(repetitive(size))
+            matcher = Matcher(tokenization.wordlist, tokenization.registry)
+            return tokenized(matcher.annotate().write())
+
+        def update(tokenization):
+            Matcher(tokenization.wordlist, tokenization.registry).update()
+
+        sizes = [300, 600, 1200, 2400]
+        with temp_settings({"context_distance": sizes[-1]}):
+            assert growth(update, make, sizes, 5) < BOUND
+
+    def test_validate(self):
+        def make(size):
+            return tokenized(nested(size))
+
+        def validate(tokenization):
+            Matcher(tokenization.wordlist, tokenization.registry).validate()
+
+        assert growth(validate, make, [100, 200, 400, 800], 5) < BOUND
+
+    def test_find_index(self):
+        # A search that matches all but its last word at every position
+        # of the context used to recurse once for each partial match.
+        def make(size):
+            context = ["a", "b"] * size
+            return lambda: context
+
+        def find(context):
+            assert Matcher([], [])._find_index(context, ["a", "b", "c"]) is False
+
+        assert growth(find, make, [1000, 2000, 4000, 8000], 5) < BOUND
+
+    def test_find_index_long_context(self):
+        context = ["a", "b"] * 5000 + ["a", "b", "c"]
+        found = Matcher([], [])._find_index(context, ["a", "b", "c"])
+        assert found == (10000, 10003)
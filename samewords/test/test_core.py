@@ -1,5 +1,9 @@
+import asyncio
+import io
 import os
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 from samewords.test import __testroot__
 from samewords.core import *
 from samewords import document
@@ -26,3 +30,146 @@ class TestMainProcessing:
 
     def test_process_string(self):
         assert process_string(self.unproc_content) == self.proc_content
+
+    def test_process_document_stream(self):
+        parts = process_document_stream(unprocessed)
+        assert "".join(parts) == self.proc_content
+
+    def test_clean_document_stream(self):
+        parts = process_document_stream(processed, "clean")
+        assert "".join(parts) == self.unproc_content
+
+    def test_process_mapped(self):
+        output = io.BytesIO()
+        process_mapped(unprocessed, output)
+        assert output.getvalue().decode("utf-8") == self.proc_content
+
+
+class TestAsync:
+    unproc_content = document.doc_content(unprocessed)
+    proc_content = document.doc_content(processed)
+
+    def test_process_string_async(self):
+        with ThreadPoolExecutor(2) as executor:
+            result = asyncio.run(
+                process_string_async(self.unproc_content, executor=executor)
+            )
+        assert result == self.proc_content
+
+    def test_process_document_async(self, tmp_path):
+        output = str(tmp_path / "out.tex")
+        stats = Statistics()
+        with ProcessPoolExecutor(2) as executor:
+            result = asyncio.run(
+                process_document_async(
+                    unprocessed, executor=executor, output=output, stats=stats
+                )
+            )
+        assert result == self.proc_content
+        with open(output) as f:
+            assert f.read() == self.proc_content
+        assert stats["paragraphs"] == 10
+
+    def test_documents_as_completed(self):
+        async def run():
+            results = {}
+            for next_done in documents_as_completed(
+                [unprocessed, processed], "clean", limit=1
+            ):
+                filename, content = await next_done
+                results[filename] = content
+            return results
+
+        results = asyncio.run(run())
+        assert results[processed] == self.unproc_content
+        assert results[unprocessed] == self.unproc_content
+
+    def test_cancellation(self):
+        async def run():
+            task = asyncio.ensure_future(process_string_async(self.unproc_content))
+            await asyncio.sleep(0)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                return True
+            return False
+
+        assert asyncio.run(run())
+
+
+class TestPhases:
+    def test_return_stats(self):
+        result, stats = process_document(unprocessed, return_stats=True)
+        assert result == document.doc_content(processed)
+        assert set(stats.times) == {"read", "chunk", "tokenize", "match", "write"}
+        assert stats["paragraphs"] == 10
+        assert stats["annotations_added"] == 63
+        assert stats["annotations_removed"] == 0
+        summary = stats.summary()
+        assert summary["throughput"]["words_per_second"] > 0
+        assert summary["phases"]["tokenize"]["cpu"] > 0
+
+    def test_cleanup_phase(self):
+        stats = Statistics()
+        process_document(processed, "clean", stats=stats)
+        assert "cleanup" in stats.times
+        assert "match" not in stats.times
+        assert stats["annotations_removed"] == 63
+        stats = Statistics()
+        process_document(processed, "update", stats=stats)
+        assert {"cleanup", "match"} <= set(stats.times)
+
+    def test_no_observers(self):
+        stats = Statistics()
+        process_document(unprocessed)
+        with phase("read"):
+            count("words", 10)
+        assert stats.times == {} and stats.as_dict() == {}
+
+    def test_nested_observe(self):
+        stats = Statistics()
+        with observe(stats), observe(stats):
+            with phase("chunk"):
+                count("words")
+        assert stats["words"] == 1
+        assert len(stats.times) == 1
+        with phase("chunk"):
+            count("words")
+        assert stats["words"] == 1
+
+
+class TestSkipping:
+    text = (
+        "\\beginnumbering\n\\pstart\nA heading\n\\pend\n"
+        "\\pstart\na \\edtext{a}{\\Afootnote{b}}\n\\pend\n\\endnumbering\n"
+        "\\beginnumbering\n\\pstart\nOnly prose.\n\\pend\n\\endnumbering\n"
+    )
+
+    def test_skipped_chunks_are_counted(self):
+        stats = Statistics()
+        result = process_string(self.text, stats=stats)
+        assert "\\sameword{a} \\edtext{\\sameword[1]{a}}" in result
+        assert stats.as_dict() == {
+            "sections": 1,
+            "sections_skipped": 1,
+            "paragraphs": 1,
+            "paragraphs_skipped": 2,
+            "words": 5,
+            "entries": 1,
+            "annotations_added": 2,
+            "annotations_removed": 0,
+        }
+
+    def test_skipped_text_is_unchanged(self):
+        for method in ["annotate", "update", "clean"]:
+            assert process_string(self.text.replace("edtext", "emph"), method) == (
+                self.text.replace("edtext", "emph")
+            )
+
+    def test_needs_processing(self):
+        assert needs_processing("\\edtext{a}{b}", "annotate")
+        assert not needs_processing("\\sameword{a}", "annotate")
+        assert needs_processing("\\sameword{a}", "update")
+        assert needs_processing("\\sameword{a}", "clean")
+        assert not needs_processing("\\edtext{a}{b}", "clean")
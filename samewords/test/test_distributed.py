@@ -0,0 +1,122 @@
+import json
+import os
+import socket
+import threading
+
+import pytest
+
+from samewords import distributed
+from samewords.test import __testroot__
+from samewords.core import process_document
+from samewords.distributed import Coordinator, parse_address, run_worker
+
+files = [
+    os.path.join(__testroot__, "assets/da-49-l1q1.tex"),
+    os.path.join(__testroot__, "assets/multi_begins.tex"),
+    os.path.join(__testroot__, "assets/no_numbers.tex"),
+]
+
+
+def start_workers(coordinator, count=2):
+    workers = [
+        threading.Thread(
+            target=run_worker,
+            args=(coordinator.address, coordinator.token),
+            daemon=True,
+        )
+        for _ in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+    return workers
+
+
+def take_task(coordinator, reply=None, token=None):
+    """Act as a worker that takes a task and then sends `reply` or dies."""
+    address = coordinator.address
+    with socket.create_connection(address) as sock, sock.makefile("rwb") as f:
+        message = {"next": True, "token": token or coordinator.token}
+        f.write(json.dumps(message).encode("utf-8") + b"\n")
+        f.flush()
+        task = json.loads(f.readline().decode("utf-8"))
+        if reply is not None:
+            f.write(json.dumps(reply).encode("utf-8") + b"\n")
+            f.flush()
+            f.readline()
+    return task
+
+
+class TestCoordinator:
+    def test_equal_to_sequential_processing(self):
+        with Coordinator(files, batch_size=3) as coordinator:
+            start_workers(coordinator)
+            results = list(coordinator.results())
+        assert [r.filename for r in results] == files
+        for result in results:
+            assert result.content == process_document(result.filename)
+        assert coordinator.paragraphs == 16
+        assert "16 paragraphs" in coordinator.report()
+
+    def test_task_of_dead_worker_is_retried(self):
+        with Coordinator(files[:1], batch_size=4) as coordinator:
+            task = take_task(coordinator)
+            assert task["paragraphs"]
+            start_workers(coordinator, 1)
+            result = next(coordinator.results())
+        assert result.content == process_document(files[0])
+        assert coordinator.retries == 1
+
+    def test_worker_error(self):
+        with Coordinator(files[:1]) as coordinator:
+            take_task(coordinator, {"next": True, "error": "Broken"})
+            with pytest.raises(ValueError, match="Broken"):
+                list(coordinator.results())
+
+    def test_malformed_answer_is_retried(self):
+        with Coordinator(files[:1], batch_size=4, max_attempts=4) as coordinator:
+            take_task(coordinator, [])
+            task = take_task(coordinator, {"next": True, "results": ["a"]})
+            assert len(task["paragraphs"]) > 1
+            start_workers(coordinator, 1)
+            result = next(coordinator.results())
+        assert result.content == process_document(files[0])
+        # The second worker also dies with the task it is given again.
+        assert coordinator.retries == 3
+
+    def test_wrong_token(self):
+        with Coordinator(files[:1], token="secret") as coordinator:
+            assert "error" in take_task(coordinator, token="guess")
+            with pytest.raises(ConnectionError):
+                run_worker(coordinator.address, "guess")
+            assert coordinator.workers == 0
+            start_workers(coordinator, 1)
+            result = next(coordinator.results())
+        assert result.content == process_document(files[0])
+
+    def test_documents_are_read_outside_the_lock(self, monkeypatch):
+        # A task can be handed out while another document is being read.
+        reading = threading.Event()
+        release = threading.Event()
+        doc_content = distributed.doc_content
+
+        def slow_doc_content(filename, *args):
+            if filename == files[0]:
+                reading.set()
+                release.wait(10)
+            return doc_content(filename, *args)
+
+        monkeypatch.setattr(distributed, "doc_content", slow_doc_content)
+        with Coordinator(files[:2]) as coordinator:
+            try:
+                first = threading.Thread(target=coordinator.next_task, daemon=True)
+                first.start()
+                assert reading.wait(10)
+                task = coordinator.next_task()
+                assert task.document == 1
+                assert not release.is_set()
+            finally:
+                release.set()
+
+    def test_parse_address(self):
+        assert parse_address("example.org:8000") == ("example.org", 8000)
+        assert parse_address("8000") == ("127.0.0.1", 8000)
@@ -1,4 +1,6 @@
 import os
+import pytest
+import unicodedata
 
 from samewords import __root__
 from samewords.test import __testroot__
@@ -63,3 +65,113 @@ class TestChunkParagraphs:
             "B}}.\n\\edlabelE{da-49-l1q1-mjzkyp}\n\\pend\n\n\\endnumbering",
         ]
         assert chunk_pars(self.chunks[1]) == pars
+
+
+class TestIterChunks:
+    def numbered_pars(self, content):
+        chunks = chunk_doc(content)
+        return [par for i, c in enumerate(chunks) if i % 2 for par in chunk_pars(c)]
+
+    def test_equal_to_chunking(self):
+        lines = multi_begins.splitlines(keepends=True)
+        chunks = list(iter_chunks(lines))
+        assert "".join(c for _, c in chunks) == multi_begins
+        assert [c for n, c in chunks if n] == self.numbered_pars(multi_begins)
+
+    def test_arbitrary_read_sizes(self):
+        for size in [1, 5, 64]:
+            parts = [multi_begins[i : i + size] for i in range(0, 4077, size)]
+            chunks = list(iter_chunks(parts))
+            assert [c for n, c in chunks if n] == self.numbered_pars(multi_begins)
+
+    def test_autopar(self):
+        text = (
+            "Preamble\n\\beginnumbering\n\\autopar\n\nOne \\pstart paragraph."
+            "\n\n\nAnother paragraph.\n\\endnumbering\nEnd\n"
+        )
+        chunks = list(iter_chunks(text.splitlines(keepends=True)))
+        assert [c for n, c in chunks if n] == self.numbered_pars(text)
+
+    def test_no_numbered_text(self):
+        document = doc_content(os.path.join(__root__, "test/assets/no_numbers.tex"))
+        chunks = list(iter_chunks(document.splitlines(keepends=True)))
+        assert all(not n for n, _ in chunks)
+        assert "".join(c for _, c in chunks) == document
+
+    def test_missing_endnumbering(self):
+        with pytest.raises(ValueError):
+            list(iter_chunks(["\\beginnumbering\n", "\\pstart text \\pend\n"]))
+
+
+class TestSpans:
+    def test_doc_spans_of_bytes(self):
+        raw = multi_begins.encode("utf-8")
+        chunks = [raw[s:e].decode("utf-8") for s, e in doc_spans(raw)]
+        assert chunks == chunk_doc(multi_begins)
+
+    def test_par_spans_of_section(self):
+        start, end = doc_spans(multi_begins)[1]
+        pars = [multi_begins[s:e] for s, e in par_spans(multi_begins, start, end)]
+        assert pars == chunk_pars(multi_begins[start:end])
+
+    def test_section_without_paragraphs(self):
+        text = "\\beginnumbering\ntext\n\\endnumbering"
+        start, end = doc_spans(text)[1]
+        with pytest.raises(ValueError):
+            par_spans(text, start, end)
+
+    def test_mapped_document(self):
+        filename = os.path.join(__root__, "test/assets/multi_begins.tex")
+        with doc_mapped(filename) as content:
+            spans = doc_spans(content)
+            assert decode_span(content, *spans[1]) == chunk_doc(multi_begins)[1]
+
+    def test_missing_endnumbering(self):
+        with pytest.raises(ValueError):
+            doc_spans(b"\\beginnumbering\n\\pstart text \\pend\n")
+
+
+class TestLineIndex:
+    def test_lines(self):
+        lines = LineIndex("first\nsecond\n\nfourth")
+        assert lines.starts == [0, 6, 13, 14]
+        assert [lines.line(offset) for offset in [0, 5, 6, 13, 14, 20]] == [
+            1,
+            1,
+            2,
+            3,
+            4,
+            4,
+        ]
+
+    def test_bytes(self):
+        raw = multi_begins.encode("utf-8")
+        offset = raw.index(b"\\beginnumbering")
+        assert LineIndex(raw).line(offset) == raw[:offset].count(b"\n") + 1
+
+
+class TestNormalization:
+    # "ö" composed of "o" and a combining diaeresis.
+    decomposed = "pre\u0308\n\\beginnumbering\n\\pstart o\u0308\n\\endnumbering\npo\u0308st"
+
+    def test_normalized_content_is_unchanged(self):
+        assert normalize_content(multi_begins) == (multi_begins, False)
+
+    def test_normalize_everything(self):
+        content, changed = normalize_content(self.decomposed)
+        assert changed is True
+        assert content == unicodedata.normalize("NFC", self.decomposed)
+
+    def test_preserve_unnumbered(self):
+        content, changed = normalize_content(self.decomposed, preserve_unnumbered=True)
+        assert changed is True
+        assert content.startswith("pre\u0308\n")
+        assert content.endswith("po\u0308st")
+        assert "\\pstart \u00f6\n" in content
+
+    def test_stream_preserve_unnumbered(self, tmp_path):
+        filename = tmp_path / "decomposed.tex"
+        filename.write_text(self.decomposed, encoding="utf-8")
+        chunks = "".join(c for _, c in doc_stream(str(filename), True))
+        assert chunks == normalize_content(self.decomposed, True)[0]
+        assert doc_content(str(filename)) == normalize_content(self.decomposed)[0]
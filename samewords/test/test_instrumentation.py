@@ -0,0 +1,58 @@
+from samewords import instrumentation
+from samewords.core import process_string, run_annotation
+from samewords.stats import Statistics
+from samewords.tokenize import Tokenizer
+
+text = "a b \\edtext{a}{\\lemma{a}\\Afootnote{c}} a"
+
+
+class TestInstrumentation:
+    def test_disabled(self):
+        before = instrumentation.counts.copy()
+        Tokenizer("a \\edtext{b}{\\Afootnote{c}}")
+        assert not instrumentation.enabled
+        assert instrumentation.counts == before
+
+    def test_counting(self):
+        with instrumentation.counting() as counts:
+            assert instrumentation.enabled
+            Tokenizer("a \\edtext{b}{\\Afootnote{c}}")
+        assert not instrumentation.enabled
+        assert counts["words_created"] >= 2
+        assert counts["macros_created"] >= 1
+        assert counts["elements_created"] >= 2
+        with instrumentation.counting() as nothing:
+            pass
+        assert nothing == {}
+
+    def test_hot_path_counters(self):
+        with instrumentation.counting() as counts:
+            result = run_annotation(text)
+        assert "\\sameword" in result
+        assert counts["tokenizers"] > 1  # The paragraph and its lemma.
+        assert counts["regex_compilations"] >= counts["tokenizers"]
+        assert counts["bracket_scans"] > 0
+        assert counts["bracket_chars"] >= counts["bracket_scans"]
+        assert counts["context_windows"] > 0
+        assert counts["find_index_calls"] > 0
+        assert counts["increment_after_calls"] > 0
+
+    def test_maximum(self):
+        with instrumentation.counting() as outer:
+            instrumentation.maximum("depth", 3)
+            with instrumentation.counting() as inner:
+                instrumentation.maximum("depth", 2)
+                instrumentation.count("calls")
+            instrumentation.count("calls")
+        assert inner == {"depth": 2, "calls": 1}
+        assert outer == {"depth": 3, "calls": 2}
+
+    def test_statistics(self):
+        stats = Statistics()
+        process_string(
+            "\\beginnumbering\n\\pstart\n" + text + "\n\\pend\n\\endnumbering\n",
+            stats=stats,
+        )
+        assert stats.operations["tokenizers"] > 1
+        assert stats.summary()["operations"]["tokenizers"] > 1
+        assert "find_index_calls" in stats.format()
@@ -0,0 +1,177 @@
+import io
+import json
+import os
+
+from samewords.core import process_string
+from samewords.document import doc_content
+from samewords.lsp import Buffer, LanguageServer, text_edits
+from samewords.test import __testroot__
+
+unprocessed = doc_content(os.path.join(__testroot__, "assets/da-49-l1q1.tex"))
+uri = "file:///edition.tex"
+
+
+def apply_edits(text, buffer, edits):
+    """Apply LSP text edits, starting from the end of the text."""
+    offsets = [
+        (buffer.offset(e["range"]["start"]), buffer.offset(e["range"]["end"]))
+        for e in edits
+    ]
+    for (start, end), edit in sorted(zip(offsets, edits), key=lambda x: -x[0][0]):
+        text = text[:start] + edit["newText"] + text[end:]
+    return text
+
+
+def message(method, params, id=None):
+    msg = {"jsonrpc": "2.0", "method": method, "params": params}
+    if id is not None:
+        msg["id"] = id
+    body = json.dumps(msg).encode("utf-8")
+    return b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+
+
+def read_messages(data):
+    reader = LanguageServer(io.BytesIO(data), io.BytesIO())
+    messages = []
+    while True:
+        msg = reader.read_message()
+        if msg is None:
+            return messages
+        messages.append(msg)
+
+
+class TestTextEdits:
+    def test_added_annotation(self):
+        old = r"in the word"
+        new = r"in the \sameword{word}"
+        assert text_edits(old, new, 10) == [(17, 17, "\\sameword{"), (21, 21, "}")]
+
+    def test_no_change(self):
+        assert text_edits("abc def", "abc def") == []
+
+
+class TestBuffer:
+    def test_change_inside_paragraph(self):
+        buffer = Buffer(unprocessed)
+        start = buffer.text.index("Illud de quo")
+        buffer.change(start, start + len("Illud"), "Illud hic")
+        assert buffer.splits == 1
+        assert buffer.spans == Buffer(buffer.text).spans
+
+    def test_change_of_boundary(self):
+        buffer = Buffer(unprocessed)
+        start = buffer.text.index("\\pstart", buffer.text.index("\\pstart") + 1)
+        buffer.change(start, start + len("\\pstart"), "")
+        assert buffer.splits == 2
+        assert buffer.spans == Buffer(buffer.text).spans
+
+    def test_inserted_paragraph(self):
+        buffer = Buffer(unprocessed)
+        start = buffer.text.index("\\pend") + len("\\pend")
+        buffer.change(start, start, "\n\\pstart\nNew paragraph.\n\\pend")
+        assert buffer.spans == Buffer(buffer.text).spans
+
+    def test_section_without_paragraphs(self):
+        buffer = Buffer("\\beginnumbering\ntext\n\\endnumbering\n")
+        assert "without any paragraphs" in buffer.error
+        assert buffer.spans == [[0, len(buffer.text), False]]
+        start = buffer.text.index("text")
+        buffer.change(start, start, "\\pstart ")
+        assert buffer.error is None
+        assert buffer.spans == Buffer(buffer.text).spans
+
+    def test_positions(self):
+        buffer = Buffer("ab\nc\U0001d11ed\n")
+        assert buffer.position(6) == {"line": 1, "character": 4}
+        assert buffer.offset({"line": 1, "character": 3}) == 5
+        buffer.change(1, 4, "x\ny\n")
+        assert buffer.lines == [0, 3, 5, 8]
+        assert buffer.text == "ax\ny\n\U0001d11ed\n"
+
+
+class TestLanguageServer:
+    def test_session(self):
+        data = b"".join(
+            [
+                message("initialize", {"capabilities": {}}, 1),
+                message("initialized", {}),
+                message(
+                    "textDocument/didOpen",
+                    {"textDocument": {"uri": uri, "version": 1, "text": unprocessed}},
+                ),
+                message("textDocument/formatting", {"textDocument": {"uri": uri}}, 2),
+                message("shutdown", None, 3),
+                message("exit", None),
+            ]
+        )
+        output = io.BytesIO()
+        server = LanguageServer(io.BytesIO(data), output)
+        assert server.run() == 0
+        responses = read_messages(output.getvalue())
+        assert responses[0]["result"]["capabilities"]["textDocumentSync"]["change"] == 2
+        assert responses[1]["method"] == "textDocument/publishDiagnostics"
+        edits = responses[2]["result"]
+        assert edits
+        annotated = apply_edits(unprocessed, Buffer(unprocessed), edits)
+        assert annotated == process_string(unprocessed)
+
+    def test_only_changed_paragraphs_are_processed(self):
+        server = LanguageServer(io.BytesIO(), io.BytesIO())
+        server.did_open({"textDocument": {"uri": uri, "text": unprocessed}})
+        server.formatting({"textDocument": {"uri": uri}})
+        processed = server.cache.misses
+        buffer = server.buffers[uri]
+        start = buffer.position(buffer.text.index("Illud de quo"))
+        server.did_change(
+            {
+                "textDocument": {"uri": uri},
+                "contentChanges": [
+                    {"range": {"start": start, "end": start}, "text": "Hic "}
+                ],
+            }
+        )
+        edits = server.formatting({"textDocument": {"uri": uri}})
+        assert server.cache.misses == processed + 1
+        # The earlier version of the changed paragraph is removed.
+        assert len(server.cache) == processed
+        text = apply_edits(buffer.text, buffer, edits)
+        assert text == process_string(buffer.text)
+
+    def test_cache_keeps_paragraphs_of_open_documents(self):
+        server = LanguageServer(io.BytesIO(), io.BytesIO())
+        other = "file:///other.tex"
+        for name in [uri, other]:
+            server.did_open({"textDocument": {"uri": name, "text": unprocessed}})
+        server.formatting({"textDocument": {"uri": uri}})
+        cached = len(server.cache)
+        server.did_change(
+            {"textDocument": {"uri": other}, "contentChanges": [{"text": ""}]}
+        )
+        server.formatting({"textDocument": {"uri": other}})
+        assert len(server.cache) == cached
+        server.did_close({"textDocument": {"uri": uri}})
+        assert len(server.cache) == 0
+
+    def test_section_without_paragraphs(self):
+        output = io.BytesIO()
+        server = LanguageServer(io.BytesIO(), output)
+        text = "\\beginnumbering\ntext\n\\endnumbering\n"
+        server.did_open({"textDocument": {"uri": uri, "text": text}})
+        start = server.buffers[uri].position(text.index("text"))
+        server.did_change(
+            {
+                "textDocument": {"uri": uri},
+                "contentChanges": [
+                    {"range": {"start": start, "end": start}, "text": "more "}
+                ],
+            }
+        )
+        assert server.formatting({"textDocument": {"uri": uri}}) == []
+        diagnostics = read_messages(output.getvalue())[0]["params"]["diagnostics"]
+        assert "without any paragraphs" in diagnostics[0]["message"]
+
+    def test_unknown_method(self):
+        output = io.BytesIO()
+        server = LanguageServer(io.BytesIO(), output)
+        server.handle({"jsonrpc": "2.0", "id": 1, "method": "unknown"})
+        assert read_messages(output.getvalue())[0]["error"]["code"] == -32601
@@ -0,0 +1,151 @@
+import os
+import time
+import urllib.request
+
+from contextlib import contextmanager
+
+import pytest
+
+from samewords import core, metrics
+from samewords.core import process_string
+from samewords.document import doc_content
+from samewords.metrics import Registry
+from samewords.pipeline import Pipeline
+from samewords.test import __testroot__
+
+input_file = os.path.join(__testroot__, "assets/da-49-l1q1.tex")
+
+
+@pytest.fixture
+def empty():
+    """Start from an empty default registry and restore it afterwards."""
+    saved = metrics.registry.drain()
+    yield metrics.registry
+    metrics.registry.drain()
+    metrics.registry.merge(saved)
+
+
+class TestRegistry:
+    def test_exposition(self):
+        registry = Registry()
+        counter = registry.counter("test_things", "Things counted.")
+        histogram = registry.histogram("test_seconds", "Time taken.", [0.1, 1.0])
+        counter.inc(kind="a")
+        counter.inc(2, kind="a")
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        assert registry.exposition() == (
+            "# TYPE test_things counter\n"
+            "# HELP test_things Things counted.\n"
+            'test_things_total{kind="a"} 3\n'
+            "# TYPE test_seconds histogram\n"
+            "# HELP test_seconds Time taken.\n"
+            'test_seconds_bucket{le="0.1"} 1\n'
+            'test_seconds_bucket{le="1.0"} 2\n'
+            'test_seconds_bucket{le="+Inf"} 3\n'
+            "test_seconds_sum 5.55\n"
+            "test_seconds_count 3\n"
+            "# EOF\n"
+        )
+
+    def test_duplicate_name(self):
+        registry = Registry()
+        registry.counter("test_things", "Things counted.")
+        with pytest.raises(ValueError):
+            registry.counter("test_things", "Things counted again.")
+
+    def test_drain_and_merge(self):
+        worker, parent = Registry(), Registry()
+        for registry in (worker, parent):
+            registry.counter("test_things", "Things counted.")
+            registry.histogram("test_seconds", "Time taken.")
+        worker.metrics["test_things"].inc(kind="a")
+        worker.metrics["test_seconds"].observe(0.2)
+        data = worker.drain()
+        assert worker.metrics["test_things"].get(kind="a") == 0
+        parent.merge(data)
+        parent.merge(data)
+        assert parent.metrics["test_things"].get(kind="a") == 2
+        assert parent.metrics["test_seconds"].count == 2
+
+
+class TestProcessingMetrics:
+    def test_process_string(self, empty):
+        process_string(doc_content(input_file))
+        assert metrics.PARAGRAPHS.get(method="annotate") == 10
+        assert metrics.CHUNKS_SKIPPED.get(kind="paragraph") == 4
+        assert metrics.TOKENIZE_SECONDS.count == 10
+        assert metrics.MATCH_SECONDS.count == 10
+
+    def test_match_seconds_without_write(self, empty, monkeypatch):
+        phase = core.phase
+
+        @contextmanager
+        def slow_write(name, **meta):
+            with phase(name, **meta) as context:
+                yield context
+                if name == "write":
+                    time.sleep(0.01)
+
+        monkeypatch.setattr(core, "phase", slow_write)
+        process_string(doc_content(input_file))
+        assert metrics.MATCH_SECONDS.sum < 0.1
+
+    def test_parent_counts_are_not_sent_back(self, empty, tmp_path):
+        # The forked workers start with the counts made in the parent.
+        process_string(doc_content(input_file))
+        serial = metrics.registry.drain()
+        process_string(doc_content(input_file))
+        Pipeline(processes=2).run([(input_file, str(tmp_path / "out.tex"))])
+        for metric in [metrics.PARAGRAPHS, metrics.CHUNKS_SKIPPED]:
+            assert dict(metric.values) == {
+                tuple(tuple(pair) for pair in key): 2 * value
+                for key, value in serial[metric.name]["values"]
+            }
+        assert metrics.WORDS.get() > 0
+        assert metrics.ENTRIES.get() >= metrics.ENTRIES_ANNOTATED.get() > 0
+
+    def test_worker_metrics_are_merged(self, empty, tmp_path):
+        Pipeline(processes=2).run([(input_file, str(tmp_path / "out.tex"))])
+        assert metrics.PARAGRAPHS.get(method="annotate") == 10
+        assert metrics.MATCH_SECONDS.count == 10
+
+    def test_match_seconds_without_write(self, empty, monkeypatch):
+        phase = core.phase
+
+        @contextmanager
+        def slow_write(name, **meta):
+            with phase(name, **meta) as context:
+                yield context
+                if name == "write":
+                    time.sleep(0.01)
+
+        monkeypatch.setattr(core, "phase", slow_write)
+        process_string(doc_content(input_file))
+        assert metrics.MATCH_SECONDS.sum < 0.1
+
+    def test_parent_counts_are_not_sent_back(self, empty, tmp_path):
+        # The forked workers start with the counts made in the parent.
+        process_string(doc_content(input_file))
+        serial = metrics.registry.drain()
+        process_string(doc_content(input_file))
+        Pipeline(processes=2).run([(input_file, str(tmp_path / "out.tex"))])
+        for metric in [metrics.PARAGRAPHS, metrics.CHUNKS_SKIPPED]:
+            assert dict(metric.values) == {
+                tuple(tuple(pair) for pair in key): 2 * value
+                for key, value in serial[metric.name]["values"]
+            }
+
+    def test_serve_metrics(self, empty):
+        server = metrics.serve_metrics(0)
+        try:
+            url = "http://127.0.0.1:{}/metrics".format(server.server_address[1])
+            with urllib.request.urlopen(url, timeout=10) as response:
+                assert response.headers["Content-Type"] == metrics.CONTENT_TYPE
+                body = response.read().decode("utf-8")
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert "# TYPE samewords_paragraphs counter" in body
+        assert body.endswith("# EOF\n")
@@ -0,0 +1,42 @@
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+from samewords.test import __testroot__
+from samewords.cache import MemoryCache
+from samewords.core import process_document
+from samewords.document import doc_content
+from samewords.parallel import SharedDocument
+from samewords.stats import Statistics
+
+files = [
+    os.path.join(__testroot__, "assets/da-49-l1q1.tex"),
+    os.path.join(__testroot__, "assets/multi_begins.tex"),
+    os.path.join(__testroot__, "assets/no_numbers.tex"),
+]
+
+
+class TestSharedDocument:
+    def test_output_larger_than_slot(self):
+        content = doc_content(files[0])
+        with ProcessPoolExecutor(1) as pool, SharedDocument(content) as document:
+            # Leave no room for the results, so they are sent back directly.
+            document.parts = [
+                part if isinstance(part, bytes) else (part[0], (0, 0))
+                for part in document.parts
+            ]
+            document.submit(pool)
+            result, _ = document.collect()
+        assert result == process_document(files[0])
+
+    def test_cache(self):
+        cache = MemoryCache()
+        content = doc_content(files[0])
+        with ProcessPoolExecutor(1) as pool:
+            for expect in [0, 10]:
+                stats = Statistics()
+                with SharedDocument(content, stats=stats, cache=cache) as document:
+                    document.submit(pool)
+                    result, _ = document.collect()
+                assert stats["paragraphs_cached"] == expect
+                assert result == process_document(files[0])
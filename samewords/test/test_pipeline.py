@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from samewords.test import __testroot__
+from samewords.core import process_document
+from samewords.pipeline import Pipeline
+
+files = [
+    os.path.join(__testroot__, "assets/da-49-l1q1.tex"),
+    os.path.join(__testroot__, "assets/multi_begins.tex"),
+    os.path.join(__testroot__, "assets/no_numbers.tex"),
+]
+
+
+def jobs(directory):
+    return [(f, str(directory / os.path.basename(f))) for f in files]
+
+
+class TestPipeline:
+    def test_equal_to_sequential_processing(self, tmp_path):
+        results = Pipeline(processes=2).run(jobs(tmp_path))
+        assert [r.filename for r in results] == files
+        for filename, target in jobs(tmp_path):
+            with open(target) as f:
+                assert f.read() == process_document(filename)
+        assert [r.stats["paragraphs"] for r in results] == [10, 6, 0]
+        assert [r.stats["paragraphs_skipped"] for r in results] == [4, 3, 0]
+        assert results[-1].seconds == 0
+
+    def test_clean(self, tmp_path):
+        processed = os.path.join(__testroot__, "assets/da-49-l1q1-processed.tex")
+        target = str(tmp_path / "out.tex")
+        Pipeline("clean", processes=1).run([(processed, target)])
+        with open(target) as f:
+            assert f.read() == process_document(files[0], "clean")
+
+    def test_bounded_queues(self, tmp_path):
+        pipeline = Pipeline(processes=1, queue_size=1, max_in_flight=2)
+        pipeline.run(jobs(tmp_path) * 3)
+        stats = pipeline.stats.as_dict()
+        assert stats["documents"] == 9
+        assert stats["max_in_flight"] <= 2
+        assert stats["max_queue_depth"] <= 1
+
+    def test_shared_memory(self, tmp_path):
+        Pipeline(processes=2, shared=True).run(jobs(tmp_path))
+        for filename, target in jobs(tmp_path):
+            with open(target) as f:
+                assert f.read() == process_document(filename)
+
+    def test_missing_file(self, tmp_path):
+        missing = [(str(tmp_path / "missing.tex"), str(tmp_path / "out.tex"))]
+        with pytest.raises(FileNotFoundError):
+            Pipeline(processes=1).run(jobs(tmp_path) + missing)
@@ -0,0 +1,118 @@
+import os
+import pstats
+
+import pytest
+
+from samewords import instrumentation
+from samewords.test import __testroot__
+from samewords.core import process_document
+from samewords.profiling import MemoryProfiler, PhaseProfiler, profile_document
+from samewords.profiling import SlowLog, tracing
+from samewords.stats import observe, phase
+
+unprocessed = os.path.join(__testroot__, "assets/da-49-l1q1.tex")
+processed = os.path.join(__testroot__, "assets/da-49-l1q1-processed.tex")
+
+
+class TestProfiling:
+    def test_profile_document(self, tmp_path):
+        profiler = profile_document(unprocessed)
+        assert profiler.paragraphs == 10
+        assert set(profiler.profiles) == {"chunk", "tokenize", "match", "write"}
+        paths = profiler.write(str(tmp_path), top=5)
+        assert sorted(os.listdir(str(tmp_path))) == [
+            "chunk.pstats",
+            "match.pstats",
+            "summary.txt",
+            "tokenize.pstats",
+            "write.pstats",
+        ]
+        assert len(paths) == 5
+        stats = pstats.Stats(str(tmp_path / "tokenize.pstats"))
+        assert any(func[2] == "_wordlist" for func in stats.stats)
+        summary = (tmp_path / "summary.txt").read_text()
+        assert "== tokenize ==" in summary and "== match ==" in summary
+
+    def test_cleanup_phase(self):
+        profiler = profile_document(processed, "update")
+        assert {"cleanup", "match"} <= set(profiler.profiles)
+
+    def test_limits(self):
+        assert profile_document(unprocessed, paragraph=3).paragraphs == 1
+        assert profile_document(unprocessed, section=0).paragraphs == 10
+        assert profile_document(unprocessed, section=0, paragraph=13).paragraphs == 1
+        with pytest.raises(ValueError):
+            profile_document(unprocessed, section=1)
+        with pytest.raises(ValueError):
+            profile_document(unprocessed, paragraph=100)
+
+    def test_nested_phases(self):
+        profiler = PhaseProfiler(["chunk", "tokenize"])
+        with observe(profiler):
+            with phase("chunk"), phase("tokenize"):
+                pass
+        assert set(profiler.profiles) == {"chunk"}
+
+
+class TestMemoryProfiler:
+    def test_report(self):
+        profiler = MemoryProfiler()
+        with tracing(), instrumentation.counting(), observe(profiler):
+            process_document(unprocessed)
+        report = profiler.report(top=3)
+        assert len(report["paragraphs"]) == 10
+        assert [r["peak"] for r in report["largest"]] == sorted(
+            [r["peak"] for r in report["paragraphs"]], reverse=True
+        )[:3]
+        assert report["peak"] >= report["phases"]["paragraph"] > 0
+        assert {"tokenize", "match", "write"} <= set(report["largest"][0]["phases"])
+        assert report["objects"]["words_created"] > 812
+        assert report["objects"]["macros_created"] > 0
+        assert report["objects"]["elements_created"] > 0
+
+    def test_nested_peaks(self):
+        profiler = MemoryProfiler()
+        with tracing(), observe(profiler):
+            with phase("paragraph", text="text"):
+                with phase("tokenize"):
+                    data = bytearray(1000000)
+                del data
+                with phase("match"):
+                    pass
+        record = profiler.paragraphs[0]
+        assert record["length"] == 4
+        assert record["phases"]["tokenize"] >= 1000000
+        assert record["phases"]["match"] < 1000000
+        assert record["peak"] >= 1000000
+
+
+class TestSlowLog:
+    def test_records(self):
+        with open(unprocessed) as f:
+            lines = f.read().splitlines()
+        log = SlowLog(0)
+        with observe(log):
+            process_document(unprocessed)
+        paragraphs = [r for r in log.records if r["kind"] == "paragraph"]
+        entries = [r for r in log.records if r["kind"] == "entry"]
+        assert len(paragraphs) == 10
+        assert all(lines[r["line"] - 1].startswith("\\pstart") for r in paragraphs)
+        assert entries and all(r["line"] for r in entries)
+        for record in entries:
+            assert "\\edtext" in lines[record["line"] - 1]
+            assert record["level"] >= 1 and record["context"] is not None
+        assert "at line" in SlowLog.format(entries[0])
+
+    def test_threshold(self):
+        reported = []
+        log = SlowLog(60, reported.append)
+        with observe(log):
+            process_document(unprocessed)
+        assert log.records == reported == []
+
+    def test_without_document(self):
+        log = SlowLog(0)
+        with observe(log), phase("paragraph", text="text"):
+            pass
+        assert log.records[0]["line"] is None
+        assert "at line" not in SlowLog.format(log.records[0])
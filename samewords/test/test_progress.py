@@ -0,0 +1,108 @@
+import io
+import json
+import os
+
+from samewords.test import __testroot__
+from samewords.cache import MemoryCache
+from samewords.core import process_document
+from samewords.pipeline import Pipeline
+from samewords.progress import Progress, format_duration, prescan, prescan_file
+from samewords.stats import observe
+
+unprocessed = os.path.join(__testroot__, "assets/da-49-l1q1.tex")
+processed = os.path.join(__testroot__, "assets/da-49-l1q1-processed.tex")
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPrescan:
+    def test_prescan_file(self):
+        assert prescan_file(unprocessed) == (10, 87)
+        assert prescan_file(processed, "clean")[0] == 6
+
+    def test_unnumbered_text(self):
+        content = (
+            b"\\edtext{a}{} \\beginnumbering\n\\pstart \\edtext{b}{} "
+            b"\\edtext{c}{}\\pend\n\\pstart d \\pend\n\\endnumbering"
+        )
+        assert prescan(content) == (1, 2)
+
+
+class TestProgress:
+    def test_estimate(self):
+        clock = Clock()
+        stream = io.StringIO()
+        progress = Progress(4, 40, stream, lines=True, interval=0, clock=clock)
+        clock.now = 1.0
+        progress.advance(10)
+        clock.now = 2.0
+        progress.advance(10)
+        data = progress.snapshot()
+        assert data["percent"] == 50.0
+        assert data["entries_per_second"] == 10.0
+        assert data["eta"] == 2.0
+        progress.skip(10)
+        progress.advance(10)
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        assert [line["entries"] for line in lines] == [10, 20, 30]
+        assert lines[-1]["percent"] == 100.0 and lines[-1]["eta"] == 0.0
+        # Nothing is reported after the final report.
+        progress.finish()
+        assert len(stream.getvalue().splitlines()) == 3
+
+    def test_paragraphs_without_entries(self):
+        clock = Clock()
+        progress = Progress(4, 0, io.StringIO(), clock=clock)
+        clock.now = 2.0
+        progress.advance(0)
+        assert progress.snapshot()["percent"] == 25.0
+        assert progress.snapshot()["eta"] == 6.0
+        assert "paragraphs/s" in progress.format()
+
+    def test_terminal(self):
+        stream = io.StringIO()
+        progress = Progress(2, 2, stream, interval=0)
+        progress.advance(1)
+        progress.advance(1)
+        output = stream.getvalue()
+        assert output.startswith("\r") and output.endswith("\n")
+        assert " 50.0%  1/2 paragraphs" in output
+        assert "100.0%  2/2 paragraphs  2/2 entries" in output
+
+    def test_format_duration(self):
+        assert format_duration(None) == "--:--"
+        assert format_duration(65.4) == "1:05"
+        assert format_duration(3725) == "1:02:05"
+
+
+class TestObserving:
+    def test_document(self):
+        progress = Progress(*prescan_file(unprocessed), stream=io.StringIO())
+        with observe(progress):
+            process_document(unprocessed)
+        assert progress.done_paragraphs == progress.paragraphs == 10
+        assert progress.done_entries == progress.entries == 87
+
+    def test_cached_paragraphs(self):
+        cache = MemoryCache()
+        process_document(unprocessed, cache=cache)
+        progress = Progress(*prescan_file(unprocessed), stream=io.StringIO())
+        with observe(progress):
+            process_document(unprocessed, cache=cache)
+        assert progress.paragraphs == progress.entries == 0
+        assert progress.snapshot()["percent"] == 100.0
+
+    def test_pipeline(self, tmp_path):
+        for shared in [False, True]:
+            progress = Progress(stream=io.StringIO())
+            progress.add_total(*prescan_file(unprocessed))
+            jobs = [(unprocessed, str(tmp_path / "out.tex"))]
+            Pipeline(processes=2, shared=shared, progress=progress).run(jobs)
+            assert progress.done_paragraphs == 10
+            assert progress.done_entries == 87
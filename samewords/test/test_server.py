@@ -0,0 +1,88 @@
+import os
+import stat
+import subprocess
+import threading
+
+import pytest
+
+from samewords import server as server_module
+from samewords.core import process_document, process_string
+from samewords.document import doc_content
+from samewords.server import RemoteError, Server, call, is_running
+from samewords.test import __testroot__
+
+unprocessed = os.path.join(__testroot__, "assets/da-49-l1q1.tex")
+processed = os.path.join(__testroot__, "assets/da-49-l1q1-processed.tex")
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("server") / "samewords.sock")
+    server = Server(path, processes=2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield path
+    call("shutdown", path=path)
+    thread.join()
+    server.server_close()
+
+
+class TestServer:
+    def test_annotate_string(self, server):
+        result = call("annotate", {"string": doc_content(unprocessed)}, server)
+        assert result["content"] == process_document(unprocessed)
+        assert result["stats"]["paragraphs"] == 10
+
+    def test_clean_string(self, server):
+        with open(processed) as f:
+            content = f.read()
+        result = call("clean", {"string": content}, server)
+        assert result["content"] == process_string(content, "clean")
+
+    def test_config(self, server):
+        text = (
+            "\\beginnumbering\n\\pstart A \\edtext{a}{\\Afootnote{b}}\n"
+            "\\pend\n\\endnumbering"
+        )
+        sensitive = call("annotate", {"string": text}, server)["content"]
+        config = {"sensitive_context_match": False}
+        insensitive = call("annotate", {"string": text, "config": config}, server)
+        assert "\\sameword{A}" not in sensitive
+        assert "\\sameword{A}" in insensitive["content"]
+
+    def test_errors(self, server):
+        with pytest.raises(RemoteError):
+            call("translate", {"string": ""}, server)
+        with pytest.raises(RemoteError):
+            call("annotate", {}, server)
+        # The server does not read files for its clients.
+        with pytest.raises(RemoteError):
+            call("annotate", {"path": unprocessed}, server)
+
+    def test_only_owner_can_connect(self, server, monkeypatch):
+        assert stat.S_IMODE(os.stat(server).st_mode) == 0o600
+        monkeypatch.setattr(server_module, "_peer_uid", lambda sock: os.getuid() + 1)
+        with pytest.raises(ConnectionError):
+            call("annotate", {"string": ""}, server)
+
+    def test_socket_of_other_user(self, server, monkeypatch):
+        monkeypatch.setattr(os, "getuid", lambda: os.stat(server).st_uid + 1)
+        with pytest.raises(ConnectionError):
+            call("annotate", {"string": ""}, server)
+
+    def test_cli_uses_server(self, server):
+        assert is_running(server)
+        proc = subprocess.Popen(
+            ["samewords", unprocessed, "--socket", server, "--no-cache"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        out, err = proc.communicate()
+        with open(processed) as f:
+            assert out.decode().strip() == f.read().strip()
+
+    def test_not_running(self, tmp_path):
+        path = str(tmp_path / "none.sock")
+        assert not is_running(path)
+        with pytest.raises(OSError):
+            call("annotate", {"string": ""}, path)
@@ -0,0 +1,107 @@
+import http.client
+import json
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from samewords.core import process_string
+from samewords.document import doc_content
+from samewords.service import Service
+from samewords.test import __testroot__
+
+unprocessed = doc_content(os.path.join(__testroot__, "assets/da-49-l1q1.tex"))
+
+
+def start(service):
+    started = threading.Event()
+    thread = threading.Thread(target=service.serve, args=(started,), daemon=True)
+    thread.start()
+    started.wait(10)
+    return service
+
+
+def post(service, path, body, headers=None):
+    connection = http.client.HTTPConnection("127.0.0.1", service.port, timeout=30)
+    connection.request("POST", path, body.encode("utf-8"), headers or {})
+    response = connection.getresponse()
+    result = response.status, response.read().decode("utf-8")
+    connection.close()
+    return result
+
+
+@pytest.fixture(scope="module")
+def service():
+    return start(Service(port=0, processes=2, batch_delay=0.05))
+
+
+class TestService:
+    def test_annotate(self, service):
+        assert post(service, "/annotate", unprocessed) == (
+            200,
+            process_string(unprocessed),
+        )
+
+    def test_clean(self, service):
+        processed = process_string(unprocessed)
+        assert post(service, "/clean", processed) == (200, unprocessed)
+
+    def test_json_with_config(self, service):
+        text = (
+            "\\beginnumbering\n\\pstart A \\edtext{a}{\\Afootnote{b}}\n"
+            "\\pend\n\\endnumbering"
+        )
+        body = json.dumps(
+            {"string": text, "config": {"sensitive_context_match": False}}
+        )
+        status, result = post(
+            service, "/annotate", body, {"Content-Type": "application/json"}
+        )
+        assert status == 200
+        assert "\\sameword{A}" in result
+
+    def test_errors(self, service):
+        assert post(service, "/translate", "")[0] == 404
+        assert post(service, "/annotate", "\\beginnumbering\n")[0] == 400
+        bad_json = post(service, "/annotate", "{", {"Content-Type": "application/json"})
+        assert bad_json[0] == 400
+
+    def test_failed_paragraph(self, service):
+        # The paragraph is only found to be broken by the worker, after the
+        # request was accepted.
+        text = "\\beginnumbering\n\\pstart A \\edtext{a}\n\\pend\n\\endnumbering"
+        status, message = post(service, "/annotate", text)
+        assert status == 400
+        assert message.strip()
+
+    def test_concurrent_requests_share_batches(self, service):
+        before = service.batches
+        with ThreadPoolExecutor(4) as pool:
+            results = list(
+                pool.map(lambda _: post(service, "/annotate", unprocessed), range(4))
+            )
+        assert all(r == (200, process_string(unprocessed)) for r in results)
+        # 4 requests of 10 paragraphs each.
+        assert service.batches - before < 40
+
+    def test_too_many_requests(self):
+        service = start(Service(port=0, processes=1, max_in_flight=0))
+        assert post(service, "/annotate", unprocessed)[0] == 429
+
+    def test_too_many_requests_with_document(self):
+        service = start(Service(port=0, processes=1, max_in_flight=0))
+        status, message = post(service, "/annotate", unprocessed * 20)
+        assert status == 429
+
+    def test_worker_died(self):
+        service = start(Service(port=0, processes=1))
+        expected = (200, process_string(unprocessed))
+        assert post(service, "/annotate", unprocessed) == expected
+        for process in list(service._pool._processes.values()):
+            process.kill()
+            process.join()
+        # The request that finds the pool broken may fail, but not silently.
+        assert post(service, "/annotate", unprocessed)[0] in (200, 503)
+        assert post(service, "/annotate", unprocessed) == expected
@@ -0,0 +1,79 @@
+import random
+import subprocess
+import sys
+
+import pytest
+
+from samewords.core import process_string
+from samewords.document import chunk_doc, chunk_pars
+from samewords.synth import Synthesizer, generate, make_vocabulary
+from samewords.tokenize import Tokenizer
+
+
+def numbered_pars(content):
+    sections = chunk_doc(content)[1::2]
+    pars = [par for section in sections for par in chunk_pars(section)]
+    return [par for par in pars if "\\pstart" in par]
+
+
+class TestSynthesizer:
+    def test_seeded(self):
+        assert generate(seed=1) == generate(seed=1)
+        assert generate(seed=1) != generate(seed=2)
+
+    def test_structure(self):
+        content = generate(sections=3, paragraphs=4)
+        assert content.count("\\beginnumbering") == 3
+        assert content.count("\\pstart") == 12
+        assert content.endswith("\\end{document}\n")
+
+    def test_words_and_depth(self):
+        content = generate(words=50, density=0.3, depth=2, excluded=0, comments=0)
+        for par in numbered_pars(content):
+            tokenization = Tokenizer(par)
+            words = [w for w in tokenization.wordlist if w.content]
+            assert len(words) == 50
+            assert max(entry["lvl"] for entry in tokenization.registry) == 1
+
+    def test_without_nesting(self):
+        content = generate(density=0.3, depth=1)
+        for par in numbered_pars(content):
+            assert {entry["lvl"] for entry in Tokenizer(par).registry} == {0}
+
+    def test_proportions(self):
+        content = generate(paragraphs=20, density=0.2, lemma=1, ellipsis=1)
+        assert content.count("\\edtext") == content.count("\\lemma")
+        assert "\\dots{}" in content
+        assert "\\lemma" not in generate(lemma=0)
+        assert "\\dots" not in generate(multiword=0)
+        assert "%" not in generate(comments=0)
+        assert "%" in generate(comments=0.2)
+        assert "synth-" in generate(excluded=0.2)
+
+    def test_zipf(self):
+        synthesizer = Synthesizer(vocabulary=100, skew=2)
+        words = [synthesizer._word() for _ in range(1000)]
+        assert words.count(synthesizer.vocabulary[0]) > 500
+
+    def test_vocabulary(self):
+        words = make_vocabulary(5000, random.Random(0))
+        assert len(set(words)) == 5000
+
+    @pytest.mark.parametrize("method", ["annotate", "update", "clean"])
+    def test_processing(self, method):
+        content = generate(paragraphs=5, density=0.2, depth=3, excluded=0.05, seed=3)
+        if method != "annotate":
+            content = process_string(content, "annotate")
+        result = process_string(content, method)
+        if method == "clean":
+            assert "\\sameword" not in result
+        else:
+            assert "\\sameword" in result
+
+    def test_command_line(self, tmp_path):
+        output = tmp_path / "synth.tex"
+        subprocess.check_call(
+            [sys.executable, "-m", "samewords.synth", "--paragraphs", "3"]
+            + ["--seed", "4", "--output", str(output)]
+        )
+        assert output.read_text() == generate(paragraphs=3, seed=4)
@@ -0,0 +1,71 @@
+import json
+import os
+
+import pytest
+
+from samewords.test import __testroot__
+from samewords.core import plan_string, process_document
+from samewords.document import doc_content
+from samewords.parallel import shared_memory
+from samewords.pipeline import Pipeline
+from samewords.stats import observe
+from samewords.trace import Tracer, section_indices
+
+files = [
+    os.path.join(__testroot__, "assets/da-49-l1q1.tex"),
+    os.path.join(__testroot__, "assets/multi_begins.tex"),
+]
+
+
+def spans(tracer, name):
+    return [e for e in tracer.trace()["traceEvents"] if e["name"] == name]
+
+
+class TestTrace:
+    def test_sequential(self, tmp_path):
+        tracer = Tracer()
+        with observe(tracer):
+            process_document(files[0])
+        paragraphs = spans(tracer, "paragraph")
+        assert len(paragraphs) == 10
+        assert all(e["pid"] == os.getpid() for e in paragraphs)
+        assert paragraphs[0]["args"]["edtext"] > 0
+        assert paragraphs[0]["args"]["length"] > 0
+        tokenize = spans(tracer, "tokenize")[0]
+        assert paragraphs[0]["ts"] <= tokenize["ts"]
+        assert tokenize["ts"] + tokenize["dur"] <= (
+            paragraphs[0]["ts"] + paragraphs[0]["dur"]
+        )
+        assert len(spans(tracer, "section")) == 1
+        tracer.write(str(tmp_path / "trace.json"))
+        trace = json.loads((tmp_path / "trace.json").read_text())
+        assert trace["traceEvents"][0]["name"] == "process_name"
+
+    def test_section_indices(self):
+        content = doc_content(files[1])
+        parts = plan_string(content)
+        indices = section_indices(content, parts)
+        assert len(indices) == len([p for p, pending in parts if pending])
+        assert indices == sorted(indices)
+        assert len(set(indices)) > 1
+
+    @pytest.mark.parametrize("shared", [False, True])
+    def test_pipeline(self, tmp_path, shared):
+        if shared and shared_memory is None:
+            pytest.skip("Shared memory requires Python 3.8 or newer.")
+        tracer = Tracer()
+        jobs = [(f, str(tmp_path / os.path.basename(f))) for f in files]
+        Pipeline(processes=2, shared=shared, tracer=tracer).run(jobs)
+        paragraphs = spans(tracer, "paragraph")
+        assert len(paragraphs) == 16
+        assert all(e["pid"] != os.getpid() for e in paragraphs)
+        assert {e["args"]["file"] for e in paragraphs} == set(files)
+        writes = [e for e in spans(tracer, "write") if e["pid"] == os.getpid()]
+        assert len(spans(tracer, "read")) == len(writes) == 2
+        events = tracer.trace()["traceEvents"]
+        files_and_sections = [e for e in events if e["ph"] == "b"]
+        assert {e["name"] for e in files_and_sections} >= set(files)
+        sections = [e for e in files_and_sections if e["name"].startswith("section")]
+        assert len(sections) == len(
+            {(e["args"]["file"], e["args"]["section"]) for e in paragraphs}
+        )
@@ -0,0 +1,66 @@
+import os
+import shutil
+
+import pytest
+
+from samewords.core import process_document
+from samewords.document import doc_content
+from samewords.test import __testroot__
+from samewords.watch import Watcher
+
+unprocessed = os.path.join(__testroot__, "assets/da-49-l1q1.tex")
+
+
+class TestWatcher:
+    @pytest.fixture
+    def watched(self, tmp_path):
+        filename = str(tmp_path / "edition.tex")
+        shutil.copy(unprocessed, filename)
+        return Watcher(filename, str(tmp_path / "output.tex"))
+
+    def test_first_run_processes_everything(self, watched):
+        stats = watched.run_once()
+        assert stats["paragraphs_cached"] == 0
+        with open(watched.output) as f:
+            assert f.read() == process_document(watched.filename)
+
+    def test_only_changed_paragraphs_are_processed(self, watched):
+        first = watched.run_once()
+        with open(watched.filename) as f:
+            content = f.read()
+        with open(watched.filename, mode="w") as f:
+            f.write(content.replace("acquiri scientia", "acquiri vera scientia"))
+        stats = watched.run_once()
+        assert stats["paragraphs"] == 1
+        assert stats["paragraphs_cached"] == first["paragraphs"] - 1
+        with open(watched.output) as f:
+            assert f.read() == process_document(watched.filename)
+
+    def test_changed(self, watched):
+        assert watched.changed()
+        watched.run_once()
+        assert not watched.changed()
+        os.utime(watched.filename, ns=(0, 0))
+        assert watched.changed()
+
+    def test_watch_stops_after_runs(self, watched):
+        reports = []
+        watched.watch(interval=0.01, report=lambda *r: reports.append(r), runs=1)
+        assert len(reports) == 1
+        assert os.path.isfile(watched.output)
+
+    def test_preserve_unnumbered(self, tmp_path):
+        # "ö" composed of "o" and a combining diaeresis outside the numbering.
+        filename = str(tmp_path / "edition.tex")
+        with open(filename, mode="w", encoding="utf-8") as f:
+            f.write("o\u0308\n" + doc_content(unprocessed))
+        output = str(tmp_path / "output.tex")
+        Watcher(filename, output, preserve_unnumbered=True).run_once()
+        with open(output, encoding="utf-8") as f:
+            result = f.read()
+        assert result.startswith("o\u0308\n")
+        assert result == process_document(filename, preserve_unnumbered=True)
+
+    def test_output_must_differ_from_input(self):
+        with pytest.raises(ValueError):
+            Watcher(unprocessed, unprocessed)
@@ -4,12 +4,23 @@ from collections import UserString, UserList
 from typing import List, Tuple, Dict, Union
 from operator import itemgetter
 
+from samewords import instrumentation
 from samewords.brackets import Brackets
+from samewords.metrics import WORDS
 from samewords.settings import settings
 
 RegistryEntry = Dict[str, Union[List[int], int]]
 Registry = List[RegistryEntry]
 
+# The patterns of the tokenization are matched at a position of the input
+# instead of on a copy of the rest of it.
+_word_char = regex.compile(r"[\w\d]")
+_word_pattern = regex.compile(r"[\w\d\-']+")
+_space_pattern = regex.compile(r"[\s~]+")
+_decimal_pattern = regex.compile(r"\.\d")
+# The name, optional argument, star and opening bracket of a macro.
+_macro_head = regex.compile(r"\\(?:\w+|.)(?:\[[^\]]+\])?\*?\{?")
+
 
 class LatexSyntaxError(ValueError):
     """Raised when a LaTeX string has invalid syntax."""
@@ -21,6 +32,8 @@ class Element:
     def __init__(self, cont: str, pos: int) -> None:
         self.cont = cont
         self.pos = pos
+        if instrumentation.enabled:
+            instrumentation.count("elements_created")
 
     def __repr__(self) -> str:
         return "({}, {})".format(self.cont, self.pos)
@@ -28,7 +41,8 @@ class Element:
 
 class Macro(UserString):
     """A latex macro, holding information in its name and optional arguments.
-    TODO: Don't gobble up the whole following string in matching.
+    The input string only needs to contain the macro up to the character
+    after its opening bracket (see `Macro.at`).
     """
 
     def __init__(
@@ -47,6 +61,16 @@ class Macro(UserString):
         self.end = end
         self.to_closing = False  # Distance in wordlist to closing bracket.
         self.hidden_content = ""  # Content that won't count as words
+        if instrumentation.enabled:
+            instrumentation.count("macros_created")
+
+    @classmethod
+    def at(cls, string: str, pos: int) -> "Macro":
+        """Return the macro starting at the position of the string. Only the
+        part of the string that the macro needs is copied."""
+        head = _macro_head.match(string, pos)
+        end = head.end() + 1 if head else len(string)
+        return cls(string[pos:end], pos)
 
     def __len__(self) -> int:
         return len(self.full())
@@ -135,6 +159,8 @@ class Word(UserString):
         self.edtext_start = False
         self.edtext_end = False
         self.has_sameword = False
+        if instrumentation.enabled:
+            instrumentation.count("words_created")
 
     def __str__(self) -> str:
         return str(self.get_text())
@@ -200,6 +226,9 @@ class Word(UserString):
             self.ann_apps,
             self.punctuation,
         ]
+        if instrumentation.enabled:
+            instrumentation.count("increment_after_calls")
+            instrumentation.count("increment_after_elements", sum(map(len, elements)))
         for el in elements:
             for item in el:
                 if item.pos >= element.pos and item is not element:
@@ -370,6 +399,9 @@ class Tokenizer:
         :param input_str: The input string that will be tokenized.
         """
         self.data = input_str
+        if instrumentation.enabled:
+            instrumentation.count("tokenizers")
+            instrumentation.count("regex_compilations")
         # Recognized punctuation characters
         self._punctuation = regex.compile(
             r"[{}]+".format("".join(settings["punctuation"]))
@@ -396,6 +428,8 @@ class Tokenizer:
         self._exclude_macros = settings["exclude_macros"]
         # the registry list
         self.registry = []
+        # the offset of each word in the input string
+        self.offsets: List[int] = []
         self.wordlist = self._wordlist()
 
     def _wordlist(self) -> Words:
@@ -406,6 +440,7 @@ class Tokenizer:
         """
         pos = 0
         while pos < len(self.data):
+            self.offsets.append(pos)
             word, pos = self._tokenize(self.data, pos)
             if word.edtext_start:
                 count = len([m for m in word.macros if m.name == r"\edtext"])
@@ -422,6 +457,7 @@ class Tokenizer:
                     self._edtext_lvl -= 1
             self._words.append(word)
             self._index += 1
+        WORDS.inc(len(self._words))
         return self._words
 
     def _tokenize(self, string: str, pos: int = 0) -> Tuple[Word, int]:
@@ -435,18 +471,18 @@ class Tokenizer:
         word = Word()
         while pos < len(string):
             c = string[pos]
-            if regex.match(r"[\w\d]", c):
-                match = regex.match(r"[\w\d\-']+", string[pos:]).group(0)
+            if _word_char.match(c):
+                match = _word_pattern.match(string, pos).group(0)
                 word.content.append(Element(match, pos))
                 pos += len(match)
                 continue
             if c.isspace() or c == "~":
-                word.spaces = regex.match(r"[\s~]+", string[pos:]).group(0)
+                word.spaces = _space_pattern.match(string, pos).group(0)
                 pos += len(word.spaces)
                 break
             if regex.search(self._punctuation, c):
                 # Exception: .5 is part of word, not punctuation.
-                if regex.match(r"\.\d", string[pos:]):
+                if _decimal_pattern.match(string, pos):
                     word.content.append(Element(c, pos))
                     pos += 1
                     continue
@@ -466,8 +502,7 @@ class Tokenizer:
                     word.content.append(Element(string[pos : pos + 2], pos))
                     pos += 2
                     continue
-                macro = Macro(string[pos:])
-                macro.pos = pos
+                macro = Macro.at(string, pos)
                 word.macros.append(macro)
                 pos += len(macro)
                 if macro.name in self._exclude_macros:
@@ -524,9 +559,9 @@ class Tokenizer:
                 pos += 1
                 continue
             if c == "%":
-                lb = string[pos:].find("\n")
-                if lb is not -1:
-                    line = string[pos : pos + lb + 1]
+                lb = string.find("\n", pos)
+                if lb != -1:
+                    line = string[pos : lb + 1]
                 else:
                     line = string[pos:]
                 word.comment.append(Element(line, pos))
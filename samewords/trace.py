@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A timeline of the processing in the Chrome trace event format, which can be
+opened in Perfetto (https://ui.perfetto.dev) or `chrome://tracing`.
+
+Each file, numbered section and paragraph is a span, and the phases of a
+paragraph (tokenization, matching, cleanup and writing) are nested in it.
+The paragraphs processed by worker processes are shown in the row of their
+worker, so stragglers and idle workers can be seen at a glance. The
+timestamps are taken from `time.perf_counter`, which is shared by the
+processes of a machine.
+"""
+
+import json
+import os
+import threading
+import time
+
+from typing import Dict, List, Tuple
+
+from samewords.document import chunk_doc
+from samewords.stats import PhaseObserver
+
+# Category of the spans of the files and the sections processed by workers.
+_ASYNC_CATEGORY = "document"
+
+
+def _args(meta: Dict) -> Dict:
+    """Describe the paragraph of `text` by its length and number of
+    `\\edtext`s instead of including it."""
+    args = {key: value for key, value in meta.items() if key != "text"}
+    if "text" in meta:
+        args["length"] = len(meta["text"])
+        args["edtext"] = meta["text"].count("\\edtext")
+    return args
+
+
+def _microseconds(seconds: float) -> float:
+    return round(seconds * 1e6, 3)
+
+
+class Tracer(PhaseObserver):
+    """
+    Record the phases as trace events while observing the processing.
+    Events recorded by another tracer, e.g. in a worker process, are added
+    with `extend`.
+
+    Attributes:
+        self.events: The recorded trace events.
+    """
+
+    def __init__(self) -> None:
+        self.events: List[Dict] = []
+        self._ids: Dict[str, int] = {}
+
+    def start(self, name: str, meta: Dict) -> float:
+        return time.perf_counter()
+
+    def stop(self, name: str, meta: Dict, token: float) -> None:
+        self.complete(name, token, time.perf_counter(), _args(meta))
+
+    def complete(self, name: str, start: float, end: float, args: Dict) -> None:
+        """Record a span of the current thread."""
+        self.events.append(
+            {
+                "name": name,
+                "cat": "samewords",
+                "ph": "X",
+                "ts": _microseconds(start),
+                "dur": _microseconds(end - start),
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+        )
+
+    def file_span(self, filename: str, start: float, end: float) -> None:
+        """Record the span of a file, which may be processed by several
+        threads and processes."""
+        self._async_span(filename, self._id(filename), start, end, {})
+
+    def _id(self, filename: str) -> int:
+        return self._ids.setdefault(filename, len(self._ids) + 1)
+
+    def _async_span(
+        self, name: str, span_id: int, start: float, end: float, args: Dict
+    ) -> None:
+        common = {"cat": _ASYNC_CATEGORY, "id": span_id, "pid": os.getpid()}
+        self.events.append(
+            dict(common, name=name, ph="b", ts=_microseconds(start), args=args)
+        )
+        self.events.append(dict(common, name=name, ph="e", ts=_microseconds(end)))
+
+    def extend(self, events: List[Dict]) -> None:
+        self.events.extend(events)
+
+    def _section_spans(self) -> List[Dict]:
+        """Return the spans of the sections whose paragraphs were processed
+        by workers, from the start of the first to the end of the last."""
+        bounds: Dict[Tuple[str, int], List[float]] = {}
+        for event in self.events:
+            args = event.get("args", {})
+            if event["name"] != "paragraph" or "section" not in args:
+                continue
+            end = event["ts"] + event["dur"]
+            span = bounds.setdefault((args["file"], args["section"]), [end, end])
+            span[0] = min(span[0], event["ts"])
+            span[1] = max(span[1], end)
+        tracer = Tracer()
+        for (filename, section), (start, end) in sorted(bounds.items()):
+            tracer._async_span(
+                "section {}".format(section),
+                self._id(filename),
+                start / 1e6,
+                end / 1e6,
+                {"file": filename, "section": section},
+            )
+        return tracer.events
+
+    def trace(self) -> Dict:
+        """Return the trace in the JSON object format."""
+        events = self.events + self._section_spans()
+        names = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": "samewords" if pid == os.getpid() else "worker"},
+            }
+            for pid in sorted({event["pid"] for event in events})
+        ]
+        return {"traceEvents": names + events, "displayTimeUnit": "ms"}
+
+    def write(self, filename: str) -> None:
+        with open(filename, mode="w") as f:
+            json.dump(self.trace(), f)
+
+
+def section_indices(content: str, parts: List[Tuple[str, bool]]) -> List[int]:
+    """Return the index of the numbered section of each pending part planned
+    for the content by `plan_string`, in order."""
+    sections = chunk_doc(content)[1::2]
+    indices = []
+    section, offset = 0, 0
+    for par, pending in parts:
+        if not pending:
+            continue
+        position = sections[section].find(par, offset)
+        while position == -1:
+            section, offset = section + 1, 0
+            position = sections[section].find(par)
+        offset = position + len(par)
+        indices.append(section)
+    return indices
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Watch a document and process it again each time it is saved.
+
+The processed paragraphs are kept in memory between the runs, so only the
+paragraphs that have changed since the last save are processed again. On
+Linux the directory of the document is watched with inotify, elsewhere its
+modification time is polled.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import time
+
+from typing import Callable, Optional, Tuple
+
+from samewords.cache import MemoryCache, ParagraphCache
+from samewords.core import process_string
+from samewords.document import doc_content
+from samewords.stats import Statistics
+
+# inotify events that may mean that a file in the directory has been saved.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+
+def _inotify(directory: str) -> Optional[int]:
+    """Return a file descriptor that becomes readable when a file in the
+    directory is written, or None if inotify is not available."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK)
+    except (AttributeError, OSError):
+        return None
+    if fd < 0:
+        return None
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class Watcher:
+    """
+    Process `filename` with `method` and write the result to `output`
+    whenever the file changes. Unnumbered paragraphs are only kept with
+    `preserve_unnumbered`.
+
+    Attributes:
+        self.cache: The in-memory cache of processed paragraphs. It can be
+        backed by a persistent `ParagraphCache`.
+        self.runs: The number of times the document has been processed.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        output: str,
+        method: str = "annotate",
+        backend: ParagraphCache = None,
+        preserve_unnumbered: bool = False,
+    ) -> None:
+        if os.path.abspath(filename) == os.path.abspath(output):
+            raise ValueError("The watched file cannot be used as output.")
+        self.filename = filename
+        self.output = output
+        self.method = method
+        self.preserve_unnumbered = preserve_unnumbered
+        self.cache = MemoryCache(backend)
+        self.runs = 0
+        self._signature = None
+        self._result = None
+
+    def signature(self) -> Optional[Tuple[int, int, int]]:
+        """Identify the current version of the file by its modification
+        time, size and inode. Return None if the file is missing, e.g. while
+        it is being replaced by an editor."""
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def changed(self) -> bool:
+        signature = self.signature()
+        return signature is not None and signature != self._signature
+
+    def run_once(self) -> Statistics:
+        """Process the current version of the file and write the output if
+        it has changed. Return the statistics of the run."""
+        self._signature = self.signature()
+        stats = Statistics()
+        content = doc_content(self.filename, self.preserve_unnumbered)
+        result = process_string(content, self.method, stats, self.cache)
+        self.cache.prune()
+        if self.cache.backend is not None:
+            # Let other runs find the paragraphs of this one.
+            self.cache.backend.flush()
+        if result != self._result:
+            # Replace the output in one step, so it is never read half written.
+            temporary = self.output + ".samewords-tmp"
+            with open(temporary, mode="w") as f:
+                f.write(result)
+            os.replace(temporary, self.output)
+            self._result = result
+        self.runs += 1
+        return stats
+
+    def watch(
+        self,
+        interval: float = 0.5,
+        report: Callable[[Statistics, float], None] = None,
+        runs: int = None,
+    ) -> None:
+        """Process the file now and each time it changes. Wait at most
+        `interval` seconds between checks for changes. Call `report` with the
+        statistics and duration of each run. Errors in the document are
+        reported on stderr, and the watching continues. Stop after `runs`
+        runs, if given, otherwise run until interrupted."""
+        fd = _inotify(os.path.dirname(os.path.abspath(self.filename)))
+        try:
+            while runs is None or self.runs < runs:
+                if self.changed():
+                    start = time.perf_counter()
+                    try:
+                        stats = self.run_once()
+                    except Exception as e:
+                        self.runs += 1
+                        print("Processing failed: {}".format(e), file=sys.stderr)
+                        continue
+                    if report:
+                        report(stats, time.perf_counter() - start)
+                    continue
+                if fd is None:
+                    time.sleep(interval)
+                elif select.select([fd], [], [], interval)[0]:
+                    # Empty the event queue. We only use it as a wake-up call.
+                    while True:
+                        try:
+                            os.read(fd, 4096)
+                        except BlockingIOError:
+                            break
+        finally:
+            if fd is not None:
+                os.close(fd)
@@ -10,12 +10,13 @@ setup(
     name="samewords",
     version=__version__,
     packages=find_packages(),
+    python_requires=">=3.7",
     install_requires=["regex==2018.8.17"],
     test_requires=["pytest==5.3.2"],
     classifiers=[
         "Development Status :: 4 - Beta",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.6",
+        "Programming Language :: Python :: 3.7",
         "Topic :: Text Processing :: Markup :: LaTeX",
     ],
     description="Package for disambiguation of identical terms in critical "